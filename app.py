@@ -1,11 +1,20 @@
+import hashlib
 import logging.config
+import os
+import queue
+import threading
 
 import joblib
+import numpy as np
 import sqlalchemy
-from flask import Flask, render_template, request, redirect, url_for
+from flask import Flask, jsonify, make_response, render_template, request, redirect, url_for
 
-from src.app_util import count_down, time_of_day, plot_json
-from src.sql_util import RecordManager, ModelOutputs
+from src.app_util import (build_horizon, build_horizons, cheapest_day, normalize_input, price_curve,
+                          split_curves, time_of_day, plot_json)
+from src.batching_util import MicroBatcher
+from src.cache_util import DiskCache, LRUCache
+from src.inference_util import CompiledEncoder, CompiledForest
+from src.sql_util import RecordManager
 
 # Initialize the Flask application
 app = Flask(__name__, template_folder='app/templates',
@@ -27,12 +36,92 @@ logger.debug(
     'go to 127.0.0.1 instead of 0.0.0.0.', app.config['HOST']
     , app.config['PORT'])
 
-# Initialize the database session
-record_manager = RecordManager(app)
+# Initialize the database session, optionally writing the records from a background thread
+record_manager = RecordManager(app,
+                               write_behind=app.config['RECORD_WRITE_BEHIND'],
+                               queue_size=app.config['RECORD_QUEUE_SIZE'],
+                               batch_size=app.config['RECORD_BATCH_SIZE'],
+                               flush_interval=app.config['RECORD_FLUSH_INTERVAL'],
+                               put_timeout=app.config['RECORD_PUT_TIMEOUT'],
+                               id_block_size=app.config['RECORD_ID_BLOCK_SIZE'],
+                               output_storage=app.config['RECORD_OUTPUT_STORAGE'],
+                               retries=app.config['RECORD_DB_RETRIES'],
+                               retry_backoff=app.config['RECORD_DB_RETRY_BACKOFF'],
+                               sqlite_pragmas=app.config['SQLITE_PRAGMAS'])
 
-# Load models into memory
-encoder = joblib.load('models/encoder.joblib')
-model = joblib.load('models/model.joblib')
+
+def load_models() -> tuple:
+    """Load the encoder and the model, compiled if configured
+
+    Returns:
+        encoder: the fitted onehot encoder
+        model: the trained price model
+    """
+    loaded_encoder = joblib.load(app.config['ENCODER_PATH'])
+    loaded_model = joblib.load(app.config['MODEL_PATH'])
+    if app.config['INFERENCE_ENGINE'] == 'compiled':
+        loaded_encoder = CompiledEncoder.from_transformer(loaded_encoder)
+        loaded_model = CompiledForest.from_model(loaded_model)
+    return loaded_encoder, loaded_model
+
+
+def model_signature() -> tuple:
+    """Get the modification time and size of the model files, None for a missing file"""
+    signature = []
+    for path in (app.config['ENCODER_PATH'], app.config['MODEL_PATH']):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            signature.append(None)
+        else:
+            signature.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+# Load models into memory, they are reloaded when their files change
+models_lock = threading.Lock()
+models_signature = model_signature()
+encoder, model = load_models()
+
+# Cache price predictions of recently seen inputs, cleared whenever the models are reloaded
+prediction_cache = None
+if app.config['PREDICTION_CACHE_MAX_ENTRIES']:
+    prediction_cache = LRUCache(max_entries=app.config['PREDICTION_CACHE_MAX_ENTRIES'],
+                                ttl=app.config['PREDICTION_CACHE_TTL'])
+
+# Cache the rendered prediction pages, the outputs of a record never change once written
+page_cache = None
+if app.config['PAGE_CACHE_MAX_BYTES']:
+    page_cache = LRUCache(max_entries=app.config['PAGE_CACHE_MAX_ENTRIES'],
+                          max_bytes=app.config['PAGE_CACHE_MAX_BYTES'],
+                          sizeof=lambda page: len(page[0]),
+                          disk=DiskCache(app.config['PAGE_CACHE_DIR'], app.config['PAGE_CACHE_DISK_MAX_BYTES'])
+                          if app.config['PAGE_CACHE_DIR'] else None)
+
+
+@app.before_request
+def reload_models() -> None:
+    """Reload the models if their files changed, e.g. after a retrain, and clear the predictions of the old ones
+
+    Returns: None
+    """
+    global encoder, model, models_signature  # pylint: disable=global-statement
+    if model_signature() == models_signature:
+        return
+    with models_lock:
+        signature = model_signature()
+        if signature == models_signature:
+            return
+        try:
+            new_encoder, new_model = load_models()
+        except Exception as e:  # pylint: disable=broad-except
+            # The files may still be being written, keep the loaded models and retry on the next request
+            logger.error('Unable to reload the changed models, keeping the loaded ones. %s', e)
+            return
+        encoder, model, models_signature = new_encoder, new_model, signature
+        if prediction_cache is not None:
+            prediction_cache.clear()
+        logger.info('Reloaded the changed models and cleared the cached predictions.')
 
 
 @app.route('/')
@@ -45,7 +134,22 @@ def index():
     return render_template('index.html')
 
 
-@app.route('/prediction/<record_id>')
+@app.route('/metrics')
+def metrics():
+    """Show the counters of the in-process caches and the record writer
+
+    Returns:
+        json of the counters
+    """
+    return jsonify({
+        'prediction_cache': prediction_cache.stats() if prediction_cache is not None else None,
+        'page_cache': page_cache.stats() if page_cache is not None else None,
+        'record_writer': record_manager.stats(),
+        'predict_batcher': predict_batcher.stats() if predict_batcher is not None else None
+    })
+
+
+@app.route('/prediction/<int:record_id>')
 def show_prediction(record_id: int):
     """ Showing the prediction page with prediction results
 
@@ -53,14 +157,83 @@ def show_prediction(record_id: int):
         record_id (int): the record_id of which the predictions will show
 
     Returns:
-        renders the prediction page
+        renders the prediction page, or an empty 304 response if the browser has it already
     """
-    outputs = record_manager.session.query(ModelOutputs).filter(ModelOutputs.record_id == record_id)
-    days = [output.days_left for output in outputs]
-    price = [output.price for output in outputs]
-    graph_pred = plot_json(days, price)
+    # Record ids start over in a new database, so the pages are kept per database. Pages kept in
+    # PAGE_CACHE_DIR would otherwise be served for the records of a database recreated at the same URI
+    token, created_at = record_manager.database_info()
+    page = page_cache.get((token, record_id)) if page_cache is not None else None
+    if page is None:
+        # Fetch the outputs once, they are reused for the plot and the table
+        days, prices = record_manager.get_outputs(record_id)
+        days, prices = days.tolist(), prices.tolist()
+        graph_pred = plot_json(days, prices)
+        body = render_template('prediction.html', graphJSON=graph_pred, outputs=list(zip(days, prices)))
+        # Outputs never change once written, so the creation time of the database is a Last-Modified
+        # that all processes agree on. A page without outputs may still get them, only its ETag is used
+        page = (body, hashlib.sha256(body.encode()).hexdigest(), created_at if days else None)
+        if page_cache is not None and days:
+            page_cache.put((token, record_id), page)
+
+    body, etag, last_modified = page
+    response = make_response(body)
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def predict_curve(model_input: tuple, record_id: int):
+    """Encode the model input and predict the prices for every day left
+
+    Args:
+        model_input (tuple): the normalized model input
+        record_id (int): the record_id of the user record, used for logging
 
-    return render_template('prediction.html', graphJSON=graph_pred, outputs=outputs)
+    Returns:
+        output (:obj:`numpy.ndarray`): predicted prices, None if the input could not be processed
+    """
+    # Concurrent requests are predicted together
+    if predict_batcher is not None:
+        try:
+            output = predict_batcher.submit([model_input], int(model_input[-1])).result()[0]
+        except (AttributeError, ValueError) as e:
+            logger.error('Unable to predict the price curve of the model_input.')
+            logger.error(e)
+            return None
+        logger.info('Successfully predicted prices for for id %s', record_id)
+        return output
+    # The compiled forest evaluates the whole days left curve of the input at once
+    if isinstance(model, CompiledForest):
+        try:
+            output = price_curve(model_input, encoder, model)
+        except (AttributeError, ValueError) as e:
+            logger.error('Unable to predict the price curve of the model_input.')
+            logger.error(e)
+            return None
+        logger.info('Successfully predicted prices for for id %s', record_id)
+        return output
+    # Get the onehot encoded input data with days left count down to 0
+    try:
+        horizon = build_horizon(model_input, encoder)
+    except (AttributeError, ValueError) as e:
+        logger.error('Unable to onehot encode the model_input.')
+        logger.error(e)
+        return None
+    else:
+        logger.info('Successfully onehot encoded the model input for id %s', record_id)
+    # Predict prices
+    try:
+        output = model.predict(horizon)
+    except ValueError as e:
+        logger.error('Model_input does not have correct number of dimensions.')
+        logger.error(e)
+        return None
+    else:
+        logger.info('Successfully predicted prices for for id %s', record_id)
+        logger.debug('There are %s predictions made.', len(horizon))
+    return output
 
 
 @app.route('/predict', methods=['POST'])
@@ -79,67 +252,48 @@ def predict_price():
     duration = request.form['duration']
     days_left = request.form['days_left']
     cur_price = request.form['cur_price']
-    model_input = [airline, source, time_of_day(depart_time), stops, destination, flight_class, duration, days_left]
-    # Get a unique id for the user record
-    logger.info(model_input)
     try:
-        record_id = record_manager.unique_id()
-    except sqlalchemy.exc.OperationalError as e:
-        logger.error('Unable to get ids from the user_records table. Check network.')
-        logger.error(e)
-        return render_template('error.html', msg='Unable to connect to the database. Please check network.')
-    # pri(
-    except sqlalchemy.exc.SQLAlchemyError as e:
-        logger.error('Unable to get ids from the user_records table')
+        model_input = normalize_input([airline, source, time_of_day(depart_time), stops,
+                                       destination, flight_class, duration, days_left])
+    except ValueError as e:
+        logger.error('Unable to parse the user input.')
         logger.error(e)
-        return render_template('error.html', msg='Unable to connect to the database.')
-    else:
-        logger.debug('Successfully get all id\'s from the user_records table.')
-    # Add the user record to database
+        return render_template('error.html', msg='Unable to process the input. Check input.')
+    logger.info(model_input)
+    # Add the user record to database under a newly allocated id
     try:
-        record_manager.add_user(_id=record_id,
-                                airline=airline,
-                                source=source,
-                                depart_time=depart_time,
-                                stops=stops,
-                                destination=destination,
-                                flight_class=flight_class,
-                                duration=duration,
-                                days_left=days_left,
-                                cur_price=cur_price)
+        record_id = record_manager.add_user(airline=airline,
+                                            source=source,
+                                            depart_time=depart_time,
+                                            stops=stops,
+                                            destination=destination,
+                                            flight_class=flight_class,
+                                            duration=duration,
+                                            days_left=days_left,
+                                            cur_price=cur_price)
     except sqlalchemy.exc.OperationalError as e:
-        logger.error('Unable to add record with id %s to the user_records table. Check network.', record_id)
+        logger.error('Unable to add record to the user_records table. Check network.')
         logger.error(e)
         return render_template('error.html', msg='Unable to access to the database. Please check network.')
     except sqlalchemy.exc.SQLAlchemyError as e:
-        logger.error('Unable to add record with id %s to the user_records table.', record_id)
+        logger.error('Unable to add record to the user_records table.')
         logger.error(e)
         return render_template('error.html', msg='Unable to access to the database.')
+    except queue.Full:
+        return render_template('error.html', msg='Too many requests. Please try again later.')
     else:
         logger.info('Successfully added record with id %s to the user_records table.', record_id)
 
-    # Get input data with days left count down to 0
-    model_input = count_down(model_input)
-    # Onehot encode the input data
-    try:
-        model_input = encoder.transform(model_input).astype('float')
-    except AttributeError as e:
-        logger.error('Unable to onehot encode the model_input.')
-        logger.error(e)
-        return render_template('error.html', msg='Unable to process the input. Check input.')
+    output = prediction_cache.get(model_input) if prediction_cache is not None else None
+    if output is not None:
+        logger.info('Found cached price predictions for id %s', record_id)
     else:
-        logger.info('Successfully onehot encoded the model input for id %s', record_id)
-        # Redirect to the error page
-    # Predict prices
-    try:
-        output = model.predict(model_input)
-    except ValueError as e:
-        logger.error('Model_input does not have correct number of dimensions.')
-        logger.error(e)
-        return render_template('error.html', msg='Unable to process the input. Check input.')
-    else:
-        logger.info('Successfully predicted prices for for id %s', record_id)
-        logger.debug('There are %s predictions made.', len(model_input))
+        output = predict_curve(model_input, record_id)
+        if output is None:
+            return render_template('error.html', msg='Unable to process the input. Check input.')
+        if prediction_cache is not None:
+            output.flags.writeable = False
+            prediction_cache.put(model_input, output)
 
     # Add model outputs to database
     try:
@@ -154,6 +308,8 @@ def predict_price():
                      record_id)
         logger.error(e)
         return render_template('error.html', msg='Unable to access to the database.')
+    except queue.Full:
+        return render_template('error.html', msg='Too many requests. Please try again later.')
     else:
         logger.info('Successfully added price predictions for id %s to the model_outputs table.',
                     record_id)
@@ -161,6 +317,136 @@ def predict_price():
     return redirect(url_for('show_prediction', record_id=record_id))
 
 
+def predict_uncached(model_inputs: list) -> list:
+    """Predict the price curves of many model inputs by stacking their horizons into one matrix
+
+    Args:
+        model_inputs (:obj:`list` of `tuple`): the normalized model inputs
+
+    Returns:
+        curves (:obj:`list` of :obj:`numpy.ndarray`): predicted prices of every input, one per day left
+    """
+    # The compiled forest evaluates the whole days left curve of every input at once
+    if isinstance(model, CompiledForest):
+        logger.info('Predicted the price curves of %s itineraries in one batch.', len(model_inputs))
+        return [price_curve(model_input, encoder, model) for model_input in model_inputs]
+    matrix, offsets = build_horizons(model_inputs, encoder)
+    prices = model.predict(matrix) if len(matrix) else np.zeros(0)
+    logger.info('Predicted %s prices of %s itineraries in one batch.', len(matrix), len(model_inputs))
+    return split_curves(prices, offsets)
+
+
+# Optionally group the predictions of concurrent requests into one call of the model
+predict_batcher = None
+if app.config['PREDICT_BATCH_WINDOW_MS']:
+    predict_batcher = MicroBatcher(predict_uncached,
+                                   window=app.config['PREDICT_BATCH_WINDOW_MS'] / 1000,
+                                   max_requests=app.config['PREDICT_BATCH_MAX_REQUESTS'],
+                                   max_rows=app.config['PREDICT_BATCH_MAX_ROWS'])
+
+
+def predict_curves(model_inputs: list) -> list:
+    """Predict the price curves of many model inputs with a single encode and predict
+
+    Curves found in the prediction cache are reused, the horizons of all other inputs are
+    stacked into one matrix.
+
+    Args:
+        model_inputs (:obj:`list` of `tuple`): the normalized model inputs
+
+    Returns:
+        curves (:obj:`list` of :obj:`numpy.ndarray`): predicted prices of every input, one per day left
+    """
+    curves = [prediction_cache.get(model_input) if prediction_cache is not None else None
+              for model_input in model_inputs]
+    # Predict every distinct input that is not cached once
+    missing = list(dict.fromkeys(model_input for model_input, curve in zip(model_inputs, curves) if curve is None))
+    if missing:
+        if predict_batcher is not None:
+            rows = sum(int(model_input[-1]) for model_input in missing)
+            predicted = dict(zip(missing, predict_batcher.submit(missing, rows).result()))
+        else:
+            predicted = dict(zip(missing, predict_uncached(missing)))
+        for model_input, curve in predicted.items():
+            if prediction_cache is not None:
+                curve.flags.writeable = False
+                prediction_cache.put(model_input, curve)
+        curves = [predicted[model_input] if curve is None else curve
+                  for model_input, curve in zip(model_inputs, curves)]
+    return curves
+
+
+def api_error(msg: str, status: int):
+    """JSON error response of the API"""
+    return jsonify({'error': msg}), status
+
+
+@app.route('/api/v1/predict', methods=['POST'])
+def api_predict():
+    """Predict the price curves of a batch of itineraries posted as JSON
+
+    The body is `{"itineraries": [...], "persist": false}`, every itinerary having the same
+    fields as the form of `/predict`, `cur_price` being optional. The itineraries are saved to
+    the database like the form inputs if `persist` is true.
+
+    Returns:
+        json with the price curve, cheapest day and record id of every itinerary
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('itineraries'), list):
+        return api_error('Expected a JSON object with a list of itineraries.', 400)
+    # Only a JSON boolean, the string "false" would otherwise be truthy
+    persist = payload.get('persist', False)
+    if not isinstance(persist, bool):
+        return api_error('Expected persist to be true or false.', 400)
+    itineraries = payload['itineraries']
+    if len(itineraries) > app.config['API_MAX_ITINERARIES']:
+        return api_error(f'At most {app.config["API_MAX_ITINERARIES"]} itineraries per request.', 413)
+    try:
+        model_inputs = [normalize_input([itinerary['airline'], itinerary['source'],
+                                         time_of_day(str(itinerary['depart_time'])), itinerary['stops'],
+                                         itinerary['destination'], itinerary['flight_class'],
+                                         itinerary['duration'], itinerary['days_left']])
+                        for itinerary in itineraries]
+    except (KeyError, TypeError, ValueError) as e:
+        logger.error('Unable to parse the itineraries. %s', e)
+        return api_error('Unable to process the itineraries. Check input.', 400)
+    if any(model_input[-1] < 0 for model_input in model_inputs):
+        return api_error('Days left must not be negative.', 400)
+    if sum(model_input[-1] for model_input in model_inputs) > app.config['API_MAX_HORIZON_ROWS']:
+        return api_error('Too many days left in total.', 413)
+
+    try:
+        curves = predict_curves(model_inputs)
+    except ValueError as e:
+        logger.error('Unable to predict the itineraries. %s', e)
+        return api_error('Unable to process the itineraries. Check input.', 400)
+
+    record_ids = [None] * len(itineraries)
+    if persist:
+        fields = ['airline', 'source', 'depart_time', 'stops', 'destination', 'flight_class', 'duration', 'days_left']
+        records = [(dict({field: itinerary[field] for field in fields}, cur_price=itinerary.get('cur_price')), curve)
+                   for itinerary, curve in zip(itineraries, curves)]
+        try:
+            # Save all itineraries and their outputs in one transaction, so a failed request saves nothing
+            record_ids = record_manager.add_users_with_outputs(records)
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            logger.error('Unable to save the itineraries to the database.')
+            logger.error(e)
+            return api_error('Unable to access to the database.', 503)
+        except queue.Full:
+            return api_error('Too many requests. Please try again later.', 503)
+
+    predictions = []
+    for curve, record_id in zip(curves, record_ids):
+        day, price = cheapest_day(curve)
+        predictions.append({'prices': curve.tolist(),
+                            'cheapest_day': day,
+                            'cheapest_price': price,
+                            'record_id': record_id})
+    return jsonify({'predictions': predictions})
+
+
 if __name__ == '__main__':
     # Start the app
     app.run(debug=app.config['DEBUG'], port=app.config['PORT'],
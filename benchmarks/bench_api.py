@@ -0,0 +1,111 @@
+"""Benchmark the latency of /api/v1/predict for batches of itineraries against one call per itinerary"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.preprocessing import OneHotEncoder
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from src.app_util import time_of_day  # noqa: E402
+
+AIRLINES = ['SpiceJet', 'AirAsia', 'Vistara', 'GO_FIRST', 'Indigo', 'Air_India']
+CITIES = ['Delhi', 'Mumbai', 'Bangalore', 'Kolkata', 'Hyderabad', 'Chennai']
+CLASSES = ['Economy', 'Business']
+
+
+def synthetic_itineraries(n_rows: int, seed: int = 123) -> list:
+    """Make itineraries with the fields of the API"""
+    rng = np.random.default_rng(seed)
+    return [{'airline': str(rng.choice(AIRLINES)),
+             'source': str(rng.choice(CITIES)),
+             'depart_time': f'{rng.integers(0, 24)}:{rng.integers(0, 60):02d}',
+             'stops': int(rng.integers(0, 3)),
+             'destination': str(rng.choice(CITIES)),
+             'flight_class': str(rng.choice(CLASSES)),
+             'duration': round(float(rng.uniform(1, 40)), 2),
+             'days_left': int(rng.integers(1, 50)),
+             'cur_price': int(rng.integers(2000, 50000))} for _ in range(n_rows)]
+
+
+def train_models(directory: str, n_rows: int) -> tuple:
+    """Fit an encoder and a model on synthetic itineraries and save them"""
+    df = pd.DataFrame(synthetic_itineraries(n_rows))
+    df['depart_time'] = df['depart_time'].map(time_of_day)
+    x = df[['airline', 'source', 'depart_time', 'stops', 'destination', 'flight_class', 'duration', 'days_left']]
+    y = (df['flight_class'] == 'Business') * 40000 + 5000 - df['days_left'] * 50 + df['duration'] * 100
+    encoder = ColumnTransformer([('encoder', OneHotEncoder(), [0, 1, 2, 4, 5])],
+                                remainder='passthrough', sparse_threshold=0).fit(x)
+    model = RandomForestRegressor(n_estimators=30, random_state=123, n_jobs=-1)
+    model.fit(encoder.transform(x).astype(np.float32), y)
+    model_path, encoder_path = os.path.join(directory, 'model.joblib'), os.path.join(directory, 'encoder.joblib')
+    joblib.dump(model, model_path)
+    joblib.dump(encoder, encoder_path)
+    return model_path, encoder_path
+
+
+def best_of(func, repeats: int) -> float:
+    """Return the fastest wall time in seconds of several calls"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark the batch prediction API')
+    parser.add_argument('--model-path', default=None,
+                        help='Path to a trained model, a synthetic model is trained if not provided')
+    parser.add_argument('--encoder-path', default=None,
+                        help='Path to the fitted encoder of the model')
+    parser.add_argument('--train-rows', type=int, default=100000)
+    parser.add_argument('--engine', default='sklearn', choices=['sklearn', 'compiled'])
+    parser.add_argument('--persist', action='store_true', help='Also save the itineraries to a SQLite database')
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    if args.model_path:
+        model_path, encoder_path = args.model_path, args.encoder_path
+    else:
+        model_path, encoder_path = train_models(workdir, args.train_rows)
+    os.environ['MODEL_PATH'] = model_path
+    os.environ['ENCODER_PATH'] = encoder_path
+    os.environ['INFERENCE_ENGINE'] = args.engine
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{workdir}/flight.db'
+    os.chdir(ROOT)
+
+    from src.sql_util import create_db  # noqa: E402
+    create_db(os.environ['SQLALCHEMY_DATABASE_URI'])
+    import app  # noqa: E402
+    logging.disable(logging.INFO)
+    warnings.filterwarnings('ignore', message='X does not have valid feature names')
+    # Measure the prediction itself, not cache hits
+    app.prediction_cache = None
+    client = app.app.test_client()
+
+    def post(batch: list) -> None:
+        """Post a batch and check the response"""
+        response = client.post('/api/v1/predict', json={'itineraries': batch, 'persist': args.persist})
+        assert response.status_code == 200, response.json
+
+    print(f'{"batch":>8} {"batched (ms)":>14} {"per itinerary (ms)":>19} {"one call each (ms)":>19} {"speedup":>8}')
+    for size in (1, 100, 1000):
+        itineraries = synthetic_itineraries(size, seed=size)
+        batched = best_of(lambda: post(itineraries), args.repeats)
+        single = best_of(lambda: [post([itinerary]) for itinerary in itineraries], 1 if size > 1 else args.repeats)
+        print(f'{size:>8} {batched * 1000:>14.2f} {batched * 1000 / size:>19.3f} {single * 1000:>19.2f} '
+              f'{single / batched:>7.1f}x')
@@ -0,0 +1,77 @@
+"""Compare load time and memory of object-dtype and typed memory-mapped feature arrays"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.io_util import load_features  # noqa: E402
+
+
+def rss_mb() -> float:
+    """Return the resident set size of this process in MB"""
+    with open('/proc/self/statm', encoding='utf-8') as file:
+        pages = int(file.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def synthetic_features(n_rows: int, seed: int = 123) -> np.ndarray:
+    """Make onehot columns followed by stops, duration and days left"""
+    rng = np.random.default_rng(seed)
+    onehot = np.zeros((n_rows, 35), dtype=np.float32)
+    for start, width in ((0, 6), (6, 6), (12, 6), (18, 6), (24, 6), (30, 2)):
+        onehot[np.arange(n_rows), start + rng.integers(0, width, n_rows)] = 1
+    numeric = np.column_stack([rng.integers(0, 3, n_rows), rng.uniform(1, 40, n_rows).round(2),
+                               rng.integers(1, 50, n_rows)]).astype(np.float32)
+    return np.hstack([onehot, numeric])
+
+
+def load_and_touch(path: str, touch_rows: int) -> dict:
+    """Load an array, read a slice of it and report timings and memory growth"""
+    before = rss_mb()
+    start = time.perf_counter()
+    data = load_features(path)
+    load_time = time.perf_counter() - start
+    loaded = rss_mb()
+    start = time.perf_counter()
+    np.asarray(data[:touch_rows], dtype=np.float32).sum()
+    touch_time = time.perf_counter() - start
+    return {'load_s': load_time, 'touch_s': touch_time,
+            'rss_load_mb': loaded - before, 'rss_touch_mb': rss_mb() - before}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='compare object and typed feature artifacts')
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--touch-rows', type=int, default=10000,
+                        help='Number of rows read after loading, like a stage working on a shard')
+    parser.add_argument('--load', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.load:
+        print(json.dumps(load_and_touch(args.load, args.touch_rows)))
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        typed = synthetic_features(args.rows)
+        paths = {'object': os.path.join(tmp, 'object.npy'), 'float32': os.path.join(tmp, 'float32.npy')}
+        np.save(paths['float32'], typed)
+        np.save(paths['object'], typed.astype(object))
+        del typed
+
+        print(f'{"format":>8} {"file (MB)":>10} {"load (s)":>9} {"RSS after load (MB)":>20} '
+              f'{"read rows (s)":>14} {"RSS after read (MB)":>20}')
+        for name, path in paths.items():
+            # Every format is measured in a fresh process so that freed memory does not hide growth
+            result = json.loads(subprocess.run(
+                [sys.executable, __file__, '--load', path, '--touch-rows', str(args.touch_rows)],
+                check=True, capture_output=True, text=True).stdout)
+            print(f'{name:>8} {os.path.getsize(path) / 2 ** 20:>10.1f} {result["load_s"]:>9.3f} '
+                  f'{result["rss_load_mb"]:>20.1f} {result["touch_s"]:>14.4f} {result["rss_touch_mb"]:>20.1f}')
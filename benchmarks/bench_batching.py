@@ -0,0 +1,70 @@
+"""Benchmark concurrent single itinerary requests to /api/v1/predict with and without micro-batching"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from bench_api import synthetic_itineraries, train_models  # noqa: E402
+from src.batching_util import MicroBatcher  # noqa: E402
+
+
+def load_test(client_factory, itineraries: list, threads: int) -> tuple:
+    """Post every itinerary alone from several threads, return requests per second and latencies"""
+    latencies, chunks = [], np.array_split(np.arange(len(itineraries)), threads)
+
+    def post(indices) -> None:
+        client = client_factory()
+        for i in indices:
+            start = time.perf_counter()
+            response = client.post('/api/v1/predict', json={'itineraries': [itineraries[i]]})
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.json
+
+    workers = [threading.Thread(target=post, args=(chunk,)) for chunk in chunks]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    return len(itineraries) / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark micro-batching of concurrent predictions')
+    parser.add_argument('--train-rows', type=int, default=100000)
+    parser.add_argument('--requests', type=int, default=800)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--windows', type=float, nargs='+', default=[2, 5], help='windows to compare in ms')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ['MODEL_PATH'], os.environ['ENCODER_PATH'] = train_models(workdir, args.train_rows)
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{workdir}/flight.db'
+    os.chdir(ROOT)
+    import app  # noqa: E402
+    logging.disable(logging.INFO)
+    warnings.filterwarnings('ignore', message='X does not have valid feature names')
+    # Measure the prediction itself, not cache hits
+    app.prediction_cache = None
+    itineraries = synthetic_itineraries(args.requests, seed=7)
+
+    print(f'{args.threads} threads posting {args.requests} single itinerary requests')
+    print(f'{"window (ms)":>12} {"requests/s":>11} {"p50 (ms)":>9} {"p99 (ms)":>9} {"mean batch":>11}')
+    for window in [0] + args.windows:
+        app.predict_batcher = MicroBatcher(app.predict_uncached, window=window / 1000) if window else None
+        throughput, p50, p99 = load_test(app.app.test_client, itineraries, args.threads)
+        mean_batch = app.predict_batcher.stats()['mean_batch_requests'] if window else 1
+        print(f'{window:>12} {throughput:>11.1f} {p50 * 1000:>9.2f} {p99 * 1000:>9.2f} {mean_batch:>11.1f}')
+        if app.predict_batcher is not None:
+            app.predict_batcher.close()
@@ -0,0 +1,71 @@
+"""Benchmark the compiled encoder against the sklearn ColumnTransformer"""
+import argparse
+import sys
+import time
+import warnings
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.preprocessing import OneHotEncoder
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.inference_util import CompiledEncoder  # noqa: E402
+
+AIRLINES = ['SpiceJet', 'AirAsia', 'Vistara', 'GO_FIRST', 'Indigo', 'Air_India']
+CITIES = ['Delhi', 'Mumbai', 'Bangalore', 'Kolkata', 'Hyderabad', 'Chennai']
+SEGMENTS = ['Early_Morning', 'Morning', 'Afternoon', 'Evening', 'Night', 'Late_Night']
+
+
+def synthetic_rows(n_rows: int, seed: int = 123) -> np.ndarray:
+    """Make raw model inputs as the app receives them"""
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.choice(AIRLINES, n_rows), rng.choice(CITIES, n_rows),
+                            rng.choice(SEGMENTS, n_rows), rng.integers(0, 3, n_rows).astype(str),
+                            rng.choice(CITIES, n_rows), rng.choice(['Economy', 'Business'], n_rows),
+                            rng.uniform(1, 40, n_rows).round(2).astype(str),
+                            rng.integers(1, 50, n_rows).astype(str)])
+
+
+def best_of(func, repeats: int) -> float:
+    """Return the fastest wall time in seconds of several calls"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark sklearn and compiled onehot encoding')
+    parser.add_argument('--encoder-path', default=None,
+                        help='Path to a fitted encoder, a synthetic encoder is fitted if not provided')
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+    warnings.filterwarnings('ignore', category=UserWarning)
+
+    if args.encoder_path:
+        transformer = joblib.load(args.encoder_path)
+    else:
+        train = pd.DataFrame(synthetic_rows(10000), columns=[
+            'airline', 'source_city', 'departure_time', 'stops',
+            'destination_city', 'class', 'duration', 'days_left']).astype(
+                {'stops': int, 'duration': float, 'days_left': int})
+        transformer = ColumnTransformer([('encoder', OneHotEncoder(sparse=False), [0, 1, 2, 4, 5])],
+                                        remainder='passthrough').fit(train)
+    encoder = CompiledEncoder.from_transformer(transformer)
+
+    print(f'{"rows":>8} {"sklearn (ms)":>14} {"compiled (ms)":>14} {"speedup":>8} {"identical":>10}')
+    for n_rows in (1, 50, 10000):
+        rows = synthetic_rows(n_rows, seed=n_rows)
+        buffer = np.empty((n_rows, encoder.n_outputs), dtype=np.float32)
+        sklearn_time = best_of(lambda: transformer.transform(rows).astype('float'), args.repeats)
+        compiled_time = best_of(lambda: encoder.transform(rows, out=buffer), args.repeats)
+        identical = (encoder.transform(rows).tobytes()
+                     == transformer.transform(rows).astype('float').astype(np.float32).tobytes())
+        print(f'{n_rows:>8} {sklearn_time * 1000:>14.3f} {compiled_time * 1000:>14.3f} '
+              f'{sklearn_time / compiled_time:>7.1f}x {identical!s:>10}')
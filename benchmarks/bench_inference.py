@@ -0,0 +1,77 @@
+"""Benchmark the compiled forest and its price curve against sklearn's RandomForestRegressor.predict"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.inference_util import CompiledForest  # noqa: E402
+
+
+def synthetic_data(n_rows: int, seed: int = 123) -> tuple:
+    """Make onehot-like features with stops, duration and days left appended"""
+    rng = np.random.default_rng(seed)
+    onehot = rng.integers(0, 2, (n_rows, 35)).astype(np.float32)
+    numeric = np.column_stack([rng.integers(0, 3, n_rows),
+                               rng.uniform(1, 40, n_rows),
+                               rng.integers(1, 50, n_rows)]).astype(np.float32)
+    x = np.hstack([onehot, numeric])
+    y = onehot[:, :6] @ rng.uniform(1000, 20000, 6) + numeric[:, 1] * 150 - numeric[:, 2] * 80
+    return x, y + rng.normal(0, 500, n_rows)
+
+
+def best_of(func, repeats: int) -> float:
+    """Return the fastest wall time in seconds of several calls"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark sklearn and compiled forest inference')
+    parser.add_argument('--model-path', default=None,
+                        help='Path to a trained model, a synthetic model is trained if not provided')
+    parser.add_argument('--train-rows', type=int, default=100000)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.model_path:
+        model = joblib.load(args.model_path)
+    else:
+        x_train, y_train = synthetic_data(args.train_rows)
+        model = RandomForestRegressor(n_estimators=30, random_state=123, n_jobs=-1).fit(x_train, y_train)
+    start = time.perf_counter()
+    forest = CompiledForest.from_model(model)
+    print(f'compile: {time.perf_counter() - start:.3f}s, '
+          f'{forest.value.size} nodes, max depth {forest.max_depth}')
+
+    print(f'{"batch":>8} {"sklearn (ms)":>14} {"compiled (ms)":>14} {"speedup":>8} {"max abs diff":>13}')
+    for batch in (1, 50, 10000):
+        x_test, _ = synthetic_data(batch, seed=batch)
+        x_test = x_test[:, :model.n_features_in_]
+        sklearn_time = best_of(lambda: model.predict(x_test), args.repeats)
+        compiled_time = best_of(lambda: forest.predict(x_test), args.repeats)
+        diff = np.abs(model.predict(x_test) - forest.predict(x_test)).max()
+        print(f'{batch:>8} {sklearn_time * 1000:>14.3f} {compiled_time * 1000:>14.3f} '
+              f'{sklearn_time / compiled_time:>7.1f}x {diff:>13.2e}')
+
+    print(f'{"days":>8} {"sklearn (ms)":>14} {"compiled (ms)":>14} {"curve (ms)":>14} {"max abs diff":>13}')
+    days_column = model.n_features_in_ - 1
+    for days in (10, 50, 200, 1000):
+        x_row, _ = synthetic_data(1, seed=days)
+        x_horizon = np.repeat(x_row[:, :model.n_features_in_], days, axis=0)
+        x_horizon[:, days_column] = np.arange(days)
+        sklearn_time = best_of(lambda: model.predict(x_horizon), args.repeats)
+        compiled_time = best_of(lambda: forest.predict(x_horizon), args.repeats)
+        curve_time = best_of(lambda: forest.predict_curve(x_horizon[0], days_column, days), args.repeats)
+        diff = np.abs(model.predict(x_horizon) - forest.predict_curve(x_horizon[0], days_column, days)).max()
+        print(f'{days:>8} {sklearn_time * 1000:>14.3f} {compiled_time * 1000:>14.3f} '
+              f'{curve_time * 1000:>14.3f} {diff:>13.2e}')
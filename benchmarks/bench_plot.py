@@ -0,0 +1,39 @@
+"""Benchmark building the prediction plot with plain dicts against plotly express"""
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.app_util import plot_json, plot_json_express  # noqa: E402
+
+
+def best_of(func, repeats: int) -> float:
+    """Return the fastest wall time in seconds of several calls"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark building the prediction plot')
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    rng = np.random.default_rng(123)
+    print(f'{"days":>6} {"plotly express (ms)":>20} {"plain dicts (ms)":>17} {"speedup":>8}')
+    for n_days in (1, 10, 50):
+        days, price = list(range(n_days)), rng.uniform(2000, 50000, n_days).round(2).tolist()
+        # Build the cached template before timing
+        plot_json(days, price)
+        express_time = best_of(lambda: plot_json_express(days, price), args.repeats)
+        dict_time = best_of(lambda: plot_json(days, price), args.repeats)
+        print(f'{n_days:>6} {express_time * 1000:>20.2f} {dict_time * 1000:>17.3f} {express_time / dict_time:>7.0f}x')
@@ -0,0 +1,84 @@
+"""Compare peak memory and file size of dense and sparse encoded features"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.feature_generation_util import encode_and_save  # noqa: E402
+from src.io_util import load_features, resolve_path  # noqa: E402
+from src.model_util import train_and_save  # noqa: E402
+from src.prediction_util import predict_and_save  # noqa: E402
+
+AIRLINES = ['SpiceJet', 'AirAsia', 'Vistara', 'GO_FIRST', 'Indigo', 'Air_India']
+CITIES = ['Delhi', 'Mumbai', 'Bangalore', 'Kolkata', 'Hyderabad', 'Chennai']
+SEGMENTS = ['Early_Morning', 'Morning', 'Afternoon', 'Evening', 'Night', 'Late_Night']
+FEATURES = ['airline', 'source_city', 'departure_time', 'destination_city', 'class']
+
+
+def synthetic_features(n_rows: int, seed: int = 123) -> pd.DataFrame:
+    """Make a features table shaped like data/clean/features.csv"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'airline': rng.choice(AIRLINES, n_rows),
+                         'source_city': rng.choice(CITIES, n_rows),
+                         'departure_time': rng.choice(SEGMENTS, n_rows),
+                         'stops': rng.integers(0, 3, n_rows),
+                         'destination_city': rng.choice(CITIES, n_rows),
+                         'class': rng.choice(['Economy', 'Business'], n_rows),
+                         'duration': rng.uniform(1, 40, n_rows).round(2),
+                         'days_left': rng.integers(1, 50, n_rows)})
+
+
+def measure(func) -> tuple:
+    """Return the wall time in seconds and the peak traced memory in MB of a call"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 2 ** 20
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='compare the dense and sparse feature pipeline')
+    parser.add_argument('--rows', type=int, default=300000)
+    parser.add_argument('--n-estimators', type=int, default=5)
+    args = parser.parse_args()
+    warnings.filterwarnings('ignore')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        features_path = os.path.join(tmp, 'features.csv')
+        synthetic_features(args.rows).to_csv(features_path, index=False)
+        target = np.random.default_rng(0).uniform(2000, 50000, args.rows)
+        target_path = os.path.join(tmp, 'target.npy')
+        np.save(target_path, target)
+
+        print(f'{"mode":>7} {"stage":>8} {"time (s)":>9} {"peak (MB)":>10} {"file (MB)":>10}')
+        for sparse in (False, True):
+            mode = 'sparse' if sparse else 'dense'
+            encoded_path = os.path.join(tmp, f'{mode}_features.npy')
+            model_path = os.path.join(tmp, f'{mode}_model.joblib')
+            prediction_path = os.path.join(tmp, f'{mode}_prediction.npy')
+            stages = [
+                ('encode', lambda: encode_and_save(features_path, encoded_path,
+                                                   os.path.join(tmp, 'encoder.joblib'), FEATURES, sparse)),
+                ('load', lambda: load_features(encoded_path)),
+                ('train', lambda: train_and_save(RandomForestRegressor(n_estimators=args.n_estimators,
+                                                                       random_state=123),
+                                                 encoded_path, target_path, model_path)),
+                ('score', lambda: predict_and_save(model_path, encoded_path, prediction_path)),
+            ]
+            for stage, func in stages:
+                elapsed, peak = measure(func)
+                size = os.path.getsize(resolve_path(encoded_path)) / 2 ** 20
+                print(f'{mode:>7} {stage:>8} {elapsed:>9.2f} {peak:>10.1f} {size:>10.1f}')
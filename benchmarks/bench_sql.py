@@ -0,0 +1,89 @@
+"""Benchmark inserting model outputs one ORM object per row against the bulk insert of RecordManager,
+and allocating user record ids by scanning the table against the block allocator"""
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.sql_util import ModelOutputs, RecordManager, UserRecords, create_db  # noqa: E402
+
+
+def orm_insert(record_manager: RecordManager, record_id: int, prices: np.ndarray) -> None:
+    """Insert the outputs the way add_all_output used to, one ORM object per day"""
+    session = record_manager.session
+    for day in range(len(prices)):
+        session.add(ModelOutputs(record_id=record_id, days_left=day, price=prices[day]))
+    session.commit()
+
+
+def scan_unique_id(record_manager: RecordManager) -> int:
+    """Draw a random id not in the user_records table the way unique_id used to"""
+    existing_ids = set(record_manager.get_ids())
+    record_id = random.randint(1, 10 ** 9)
+    while record_id in existing_ids:
+        record_id = random.randint(1, 10 ** 9)
+    return record_id
+
+
+def best_of(func, repeats: int) -> float:
+    """Return the fastest wall time in seconds of several calls"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark inserting model outputs')
+    parser.add_argument('--engine-string', default=None,
+                        help='SQLAlchemy engine string of the database, e.g. mysql+pymysql://user:pw@127.0.0.1/flight, '
+                             'a temporary SQLite file if not provided')
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    engine_string = args.engine_string or f'sqlite:///{tempfile.mkdtemp()}/flight.db'
+    create_db(engine_string)
+    record_manager = RecordManager(engine_string=engine_string)
+    rng = np.random.default_rng(123)
+    # The records do not need to exist on SQLite, which does not enforce foreign keys by default
+    record_ids = iter(range(1, 10 ** 9))
+
+    print(f'{"rows":>8} {"ORM rows (ms)":>14} {"bulk (ms)":>10} {"speedup":>8}')
+    for rows in (10, 100, 1000):
+        prices = rng.uniform(2000, 50000, rows)
+        orm_time = best_of(lambda: orm_insert(record_manager, next(record_ids), prices), args.repeats)
+        bulk_time = best_of(lambda: record_manager.add_all_output(next(record_ids), rows, prices), args.repeats)
+        print(f'{rows:>8} {orm_time * 1000:>14.2f} {bulk_time * 1000:>10.2f} {orm_time / bulk_time:>7.1f}x')
+
+    print(f'{"records":>8} {"rows":>6} {"one call each (ms)":>19} {"add_outputs (ms)":>17} {"speedup":>8}')
+    for n_records in (10, 100):
+        outputs = [(next(record_ids), rng.uniform(2000, 50000, 30)) for _ in range(n_records)]
+        single_time = best_of(lambda: [record_manager.add_all_output(record_id, len(prices), prices)
+                                       for record_id, prices in outputs], args.repeats)
+        batch_time = best_of(lambda: record_manager.add_outputs(outputs), args.repeats)
+        print(f'{n_records:>8} {n_records * 30:>6} {single_time * 1000:>19.2f} {batch_time * 1000:>17.2f} '
+              f'{single_time / batch_time:>7.1f}x')
+
+    user = {'airline': 'Vistara', 'departure_time': '13:15', 'source_city': 'Delhi', 'destination': 'Mumbai',
+            'stops': 1, 'flight_class': 'Economy', 'duration': 8, 'days_left': 3, 'cur_price': 5000}
+    print(f'{"users":>8} {"table scan (ms)":>16} {"allocator (ms)":>15} {"speedup":>8}')
+    for n_users in (1000, 10000):
+        # Grow the table to n_users records
+        while len(record_manager.get_ids()) < n_users:
+            record_manager.session.execute(UserRecords.__table__.insert(),
+                                           [dict(user, id=record_manager.unique_id())
+                                            for _ in range(n_users - len(record_manager.get_ids()))])
+            record_manager.session.commit()
+        scan_time = best_of(lambda: scan_unique_id(record_manager), args.repeats)
+        allocate_time = best_of(lambda: [record_manager.unique_id() for _ in range(100)], args.repeats) / 100
+        print(f'{n_users:>8} {scan_time * 1000:>16.3f} {allocate_time * 1000:>15.4f} '
+              f'{scan_time / allocate_time:>7.0f}x')
+    record_manager.close()
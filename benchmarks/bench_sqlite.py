@@ -0,0 +1,81 @@
+"""Load test the SQLite database with concurrent writers and readers, with and without the tuning pragmas"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import sqlalchemy
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.sql_util import RecordManager, create_db  # noqa: E402
+
+PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 5000, 'cache_size': -20000}
+USER = {'airline': 'Vistara', 'depart_time': '13:15', 'source': 'Delhi', 'destination': 'Mumbai',
+        'stops': 1, 'flight_class': 'Economy', 'duration': 8, 'days_left': 30, 'cur_price': 5000}
+
+
+def load_test(engine_string: str, pragmas, writers: int, readers: int, seconds: float) -> tuple:
+    """Write predictions and read them back from several threads, return writes and reads per second"""
+    create_db(engine_string, pragmas)
+    record_manager = RecordManager(engine_string=engine_string, sqlite_pragmas=pragmas, retry_backoff=0.01)
+    written, counts, failures = [], {'writes': 0, 'reads': 0}, {'writes': 0, 'reads': 0}
+    deadline = time.monotonic() + seconds
+    prices = np.random.default_rng(123).uniform(2000, 50000, USER['days_left'])
+
+    def write() -> None:
+        while time.monotonic() < deadline:
+            try:
+                record_id = record_manager.add_user(**USER)
+                record_manager.add_all_output(record_id, USER['days_left'], prices)
+            except sqlalchemy.exc.OperationalError:
+                failures['writes'] += 1
+            else:
+                written.append(record_id)
+                counts['writes'] += 1
+        record_manager.session.remove()
+
+    def read() -> None:
+        rng = np.random.default_rng()
+        while time.monotonic() < deadline:
+            if not written:
+                time.sleep(0.001)
+                continue
+            try:
+                record_manager.get_outputs(written[rng.integers(len(written))])
+            except sqlalchemy.exc.OperationalError:
+                failures['reads'] += 1
+            else:
+                counts['reads'] += 1
+        record_manager.session.remove()
+
+    threads = ([threading.Thread(target=write) for _ in range(writers)]
+               + [threading.Thread(target=read) for _ in range(readers)])
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    record_manager.close()
+    return counts['writes'] / seconds, counts['reads'] / seconds, failures['writes'] + failures['reads']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='load test SQLite with and without the tuning pragmas')
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    workdir = tempfile.mkdtemp()
+    print(f'{args.writers} writer and {args.readers} reader threads for {args.seconds} seconds')
+    print(f'{"profile":>8} {"writes/s":>9} {"reads/s":>9} {"failures":>9}')
+    for name, pragmas in (('off', None), ('on', PRAGMAS)):
+        path = os.path.join(workdir, f'{name}.db')
+        writes, reads, failures = load_test(f'sqlite:///{path}', pragmas, args.writers, args.readers, args.seconds)
+        print(f'{name:>8} {writes:>9.1f} {reads:>9.1f} {failures:>9}')
@@ -0,0 +1,56 @@
+"""Benchmark the size and read latency of model outputs stored one row per day against packed price curves"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import sqlalchemy
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.sql_util import RecordManager, create_db  # noqa: E402
+
+
+def fill(engine_string: str, storage: str, curves: list) -> RecordManager:
+    """Create a SQLite database and store the price curves in the given layout"""
+    create_db(engine_string)
+    record_manager = RecordManager(engine_string=engine_string, output_storage=storage)
+    for start in range(0, len(curves), 1000):
+        record_manager.add_outputs(curves[start:start + 1000])
+    with record_manager.engine.connect() as connection:
+        connection.execute(sqlalchemy.text('VACUUM'))
+    return record_manager
+
+
+def mean_read(record_manager: RecordManager, record_ids: np.ndarray) -> float:
+    """Return the mean wall time in seconds of reading the outputs of a record"""
+    start = time.perf_counter()
+    for record_id in record_ids:
+        record_manager.get_outputs(int(record_id))
+    return (time.perf_counter() - start) / len(record_ids)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark the storage layouts of the model outputs')
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--max-days', type=int, default=50)
+    parser.add_argument('--reads', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(123)
+    curves = [(record_id, rng.uniform(2000, 50000, rng.integers(1, args.max_days)))
+              for record_id in range(1, args.records + 1)]
+    record_ids = rng.integers(1, args.records + 1, args.reads)
+    workdir = tempfile.mkdtemp()
+
+    print(f'{args.records} records, {sum(len(prices) for _, prices in curves)} prices')
+    print(f'{"storage":>8} {"file size (MB)":>15} {"read (ms)":>10}')
+    for storage in ('rows', 'packed'):
+        path = os.path.join(workdir, f'{storage}.db')
+        record_manager = fill(f'sqlite:///{path}', storage, curves)
+        read_time = mean_read(record_manager, record_ids)
+        print(f'{storage:>8} {os.path.getsize(path) / 2 ** 20:>15.2f} {read_time * 1000:>10.3f}')
+        record_manager.close()
@@ -10,3 +10,49 @@ SQLALCHEMY_ECHO = False  # If true, SQL for queries made will be printed
 SQLALCHEMY_DATABASE_URI = os.environ.get('SQLALCHEMY_DATABASE_URI')
 if SQLALCHEMY_DATABASE_URI is None:
     SQLALCHEMY_DATABASE_URI = 'sqlite:///data/flight.db'
+
+# Opt-in tuning of SQLite for concurrent requests: the write-ahead log lets reads run during a write,
+# synchronous NORMAL only syncs the log at checkpoints, writers wait up to busy_timeout milliseconds
+# for the lock, and cache_size is in KiB when negative
+SQLITE_PRAGMAS = None
+if os.environ.get('SQLITE_TUNING', 'false').lower() == 'true':
+    SQLITE_PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 5000, 'cache_size': -20000}
+
+# Connection pool of the database, checked out connections are pinged so stale RDS connections are replaced
+SQLALCHEMY_ENGINE_OPTIONS = {'pool_pre_ping': True}
+if not SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+    SQLALCHEMY_ENGINE_OPTIONS.update({
+        'pool_size': 10,  # Connections kept open
+        'max_overflow': 20,  # Connections opened on top of the pool under load
+        'pool_recycle': 1800,  # Seconds before a connection is replaced, below the server's wait_timeout
+        'pool_timeout': 10  # Seconds to wait for a free connection
+    })
+
+MODEL_PATH = os.environ.get('MODEL_PATH', 'models/model.joblib')
+ENCODER_PATH = os.environ.get('ENCODER_PATH', 'models/encoder.joblib')
+INFERENCE_ENGINE = os.environ.get('INFERENCE_ENGINE', 'sklearn')  # `sklearn` or `compiled` to encode and predict with flat arrays
+
+PREDICTION_CACHE_MAX_ENTRIES = 4096  # Maximum number of price curves kept in memory, 0 disables the cache
+PREDICTION_CACHE_TTL = 3600  # Seconds before a cached price curve expires, None to never expire
+
+PAGE_CACHE_MAX_BYTES = 64 * 2 ** 20  # Maximum bytes of rendered prediction pages kept in memory, 0 disables the cache
+PAGE_CACHE_MAX_ENTRIES = 100000  # Maximum number of rendered prediction pages kept in memory
+PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR')  # Directory to also keep the rendered pages in, None to keep them in memory only
+PAGE_CACHE_DISK_MAX_BYTES = 512 * 2 ** 20  # Maximum bytes of rendered prediction pages kept on disk
+
+PREDICT_BATCH_WINDOW_MS = float(os.environ.get('PREDICT_BATCH_WINDOW_MS', 0))  # Milliseconds to group concurrent predictions, 0 disables batching
+PREDICT_BATCH_MAX_REQUESTS = 64  # Maximum number of requests predicted in one batch
+PREDICT_BATCH_MAX_ROWS = 50000  # Maximum number of days left predicted in one batch
+
+API_MAX_ITINERARIES = 1000  # Maximum number of itineraries per request to /api/v1/predict
+API_MAX_HORIZON_ROWS = 1000000  # Maximum total days left per request to /api/v1/predict
+
+RECORD_WRITE_BEHIND = os.environ.get('RECORD_WRITE_BEHIND', 'false').lower() == 'true'  # Write records from a background thread
+RECORD_QUEUE_SIZE = 10000  # Maximum number of records waiting to be written in write-behind mode
+RECORD_BATCH_SIZE = 200  # Maximum number of records written in one transaction
+RECORD_FLUSH_INTERVAL = 0.2  # Seconds the writer waits to group more records in a transaction
+RECORD_PUT_TIMEOUT = 5  # Seconds a request waits for room in a full queue before failing
+RECORD_ID_BLOCK_SIZE = 100  # Number of record ids each process reserves from the database at once
+RECORD_OUTPUT_STORAGE = os.environ.get('RECORD_OUTPUT_STORAGE', 'rows')  # `rows` for one row per day, `packed` for one curve per record
+RECORD_DB_RETRIES = 3  # Times a statement failing with a transient database error is retried
+RECORD_DB_RETRY_BACKOFF = 0.1  # Seconds before the first retry, doubled on every retry
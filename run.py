@@ -1,14 +1,15 @@
 import argparse
 import logging.config
 
-import pandas as pd
 import yaml
 
 from src.evaluation_util import evaluate_model
-from src.feature_generation_util import generate_feature
+from src.feature_generation_util import featurize, generate_feature
+from src.io_util import configure_storage, log_io_stats, read_frame
 from src.model_util import train_model
-from src.prediction_util import score_model
-from src.preprocess_util import preprocess_data
+from src.pipeline_util import Manifest, log_timings, run_pipeline, stage_dependencies
+from src.prediction_util import batch_score, score_model
+from src.preprocess_util import preprocess_data, preprocess_data_chunked
 
 logging.config.fileConfig('config/logging/local.conf')
 logger = logging.getLogger('model-pipeline')
@@ -20,13 +21,25 @@ if __name__ == '__main__':
     parser.add_argument('step',
                         default='acquire_data',
                         help='Choose which step to run',
-                        choices=['acquire_data', 'preprocess', 'generate_feature',
-                                 'train', 'score', 'evaluate'])
+                        choices=['acquire_data', 'preprocess', 'generate_feature', 'featurize',
+                                 'train', 'score', 'evaluate', 'all', 'batch_score'])
 
     parser.add_argument('--config',
                         default='config/model_config.yaml',
                         help='Path to configuration file')
 
+    parser.add_argument('--debug',
+                        action='store_true',
+                        help='Save the intermediate files of the featurize step')
+
+    parser.add_argument('--force',
+                        action='store_true',
+                        help='Run the step even if nothing it depends on changed')
+
+    parser.add_argument('--manifest',
+                        default='data/manifest.json',
+                        help='Path of the manifest of content hashes of the pipeline steps')
+
     args = parser.parse_args()
 
     try:
@@ -37,35 +50,64 @@ if __name__ == '__main__':
     else:
         logger.info('Successfully loaded configuration file from %s', args.config)
 
-    if args.step == 'preprocess':
-        try:
-            read_path = config['preprocess']['read_path']
-        except KeyError as e:
-            logger.error('Key not found.')
-            raise e
-
-        try:
-            df = pd.read_csv(read_path, index_col=0)
-        except FileNotFoundError as e:
-            logger.error('Could not find data in %s', read_path)
-            raise e
-        except Exception as e:
-            logger.error('Failed to load data.')
-            logger.error(e)
-            raise e
-        else:
-            logger.info('Successfully read the data from %s', read_path)
-
-        preprocess_data(df, config)
-
-    if args.step == 'generate_feature':
-        generate_feature(config)
-
-    if args.step == 'train':
-        train_model(config)
-
-    if args.step == 'score':
-        score_model(config)
-
-    if args.step == 'evaluate':
-        evaluate_model(config)
+    configure_storage(**config.get('storage', {}))
+
+    # Skip the step if its inputs, outputs and config sections hash the same as when it last succeeded
+    manifest = Manifest(args.manifest)
+    dependencies = stage_dependencies(args.step, config)
+    fresh = dependencies is not None and not args.force and manifest.is_fresh(args.step, dependencies, config)
+    if fresh:
+        logger.info('Nothing step %s depends on changed, skipping it. Use --force to run it anyway.', args.step)
+    else:
+        if args.step in ('preprocess', 'featurize'):
+            try:
+                read_path = config['preprocess']['read_path']
+            except KeyError as e:
+                logger.error('Key not found.')
+                raise e
+
+            # Stream the raw data in chunks to bound memory if a chunk size is configured
+            chunksize = config['preprocess'].get('chunksize')
+            if chunksize and args.step == 'preprocess':
+                preprocess_data_chunked(read_path, chunksize, config)
+            else:
+                try:
+                    df = read_frame(read_path, index_col=0)
+                except FileNotFoundError as e:
+                    logger.error('Could not find data in %s', read_path)
+                    raise e
+                except Exception as e:
+                    logger.error('Failed to load data.')
+                    logger.error(e)
+                    raise e
+                else:
+                    logger.info('Successfully read the data from %s', read_path)
+
+                if args.step == 'preprocess':
+                    preprocess_data(df, config)
+                else:
+                    featurize(df, config, args.debug)
+
+        if args.step == 'generate_feature':
+            generate_feature(config)
+
+        if args.step == 'train':
+            train_model(config)
+
+        if args.step == 'score':
+            score_model(config)
+
+        if args.step == 'evaluate':
+            evaluate_model(config)
+
+        if args.step == 'batch_score':
+            batch_score(config)
+
+        # Run every step in this process, only saving the artifacts configured in `pipeline`
+        if args.step == 'all':
+            log_timings(run_pipeline(config))
+
+        if dependencies is not None:
+            manifest.record(args.step, dependencies, config)
+
+    log_io_stats()
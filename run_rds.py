@@ -1,16 +1,29 @@
+import argparse
 import logging.config
 
 import sqlalchemy
 
-from config.flaskconfig import SQLALCHEMY_DATABASE_URI
-from src.sql_util import create_db
+from config.flaskconfig import SQLALCHEMY_DATABASE_URI, SQLITE_PRAGMAS
+from src.sql_util import convert_outputs, create_db, migrate_db
 
 logging.config.fileConfig('config/logging/local.conf')
 logger = logging.getLogger('create_sql_database')
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create or migrate the tables of the database')
+    parser.add_argument('--migrate', action='store_true',
+                        help='Add the tables and indexes missing in a database created by an older version')
+    parser.add_argument('--convert-outputs', action='store_true',
+                        help='Copy the model outputs stored one row per day into packed price curves')
+    args = parser.parse_args()
+
     try:
-        create_db(SQLALCHEMY_DATABASE_URI)
+        if args.migrate:
+            migrate_db(SQLALCHEMY_DATABASE_URI)
+        elif args.convert_outputs:
+            convert_outputs(SQLALCHEMY_DATABASE_URI)
+        else:
+            create_db(SQLALCHEMY_DATABASE_URI, SQLITE_PRAGMAS)
     except sqlalchemy.exc.ArgumentError as e:
         logger.error('Could not parse URL from the engine string. %s', e)
         raise e
@@ -18,4 +31,4 @@ if __name__ == '__main__':
         logger.error('Could not establish connection. Check engine string. %s', e)
         raise e
     else:
-        logger.info('Successfully created the tables')
+        logger.info('Successfully set up the tables')
@@ -1,3 +1,4 @@
+import functools
 import json
 import logging
 
@@ -5,6 +6,8 @@ import numpy as np
 import pandas as pd
 import plotly
 import plotly.express as px
+import plotly.graph_objects as go
+from scipy import sparse
 
 logger = logging.getLogger(__name__)
 
@@ -20,16 +23,200 @@ def count_down(start_row: list, days_index: int = 7) -> np.array:
         logger.error('Unable to convert non-integer string to int. %s', e)
         raise e
     start_row = np.array(start_row).reshape(1, -1)
-    full_matrix = None
-    for day in range(days):
-        record = start_row.copy()
-        record[0, days_index] = day
-        if full_matrix is not None:
-            full_matrix = np.vstack((full_matrix, record))
-        else:
-            full_matrix = record
+    # Repeat the row once for every day and overwrite the days column in a single pass
+    full_matrix = np.repeat(start_row, days, axis=0)
+    full_matrix[:, days_index] = np.arange(days)
 
-    return np.array(full_matrix)
+    return full_matrix
+
+
+def passthrough_columns(encoder) -> list:
+    """Get the passthrough input columns of a fitted `ColumnTransformer` in output order
+
+    Args:
+        encoder (:obj:`sklearn.compose.ColumnTransformer`): fitted transformer with `remainder='passthrough'`
+
+    Returns:
+        columns (:obj:`list` of `int`): indices of the passthrough columns in the raw model input
+    """
+    # Compiled encoders know their own output layout
+    if hasattr(encoder, 'passthrough'):
+        return sorted(encoder.passthrough, key=encoder.passthrough.get)
+    for name, trans, columns in encoder.transformers_:
+        if name == 'remainder' and trans == 'passthrough':
+            return np.arange(encoder.n_features_in_)[columns].tolist()
+    return []
+
+
+def passthrough_column(encoder, column: int) -> int:
+    """Find the output column of a passthrough input column of a fitted `ColumnTransformer`
+
+    Args:
+        encoder (:obj:`sklearn.compose.ColumnTransformer`): fitted transformer with `remainder='passthrough'`
+        column (int): index of the column in the raw model input
+
+    Returns:
+        index (int): index of the same column in the encoded output
+    """
+    if hasattr(encoder, 'output_column'):
+        return encoder.output_column(column)
+    remainder = passthrough_columns(encoder)
+    if column not in remainder:
+        logger.error('Column %s is not passed through by the encoder.', column)
+        raise ValueError('Column is not a passthrough column.')
+    return encoder.output_indices_['remainder'].start + remainder.index(column)
+
+
+def encode_rows(model_inputs: list, encoder, days_index: int = 7) -> np.ndarray:
+    """Onehot encode itineraries with the days left column set to 0
+
+    Args:
+        model_inputs (:obj:`list` of :obj:`list`): raw model inputs, one per itinerary
+        encoder (:obj:`sklearn.compose.ColumnTransformer`): fitted onehot encoder
+        days_index (int): index of the days left column in the raw model input
+
+    Returns:
+        rows (:obj:`numpy.ndarray`): float32 matrix with one encoded row per itinerary
+    """
+    rows = np.array(model_inputs, dtype=str).reshape(len(model_inputs), -1)
+    rows[:, days_index] = '0'
+    if hasattr(encoder, 'transformers_'):
+        # Sparse transformers only accept numeric passthrough columns
+        numeric = passthrough_columns(encoder)
+        rows = rows.astype(object)
+        rows[:, numeric] = rows[:, numeric].astype(np.float64)
+    encoded = encoder.transform(rows)
+    if sparse.issparse(encoded):
+        encoded = encoded.toarray()
+    return np.asarray(encoded).astype(np.float32, copy=False)
+
+
+def build_horizons(model_inputs: list,
+                   encoder,
+                   days_index: int = 7) -> tuple:
+    """Build the encoded days-left horizons of a batch of itineraries in one matrix
+
+    Every itinerary is encoded once with the days column set to 0, the encoded row is
+    broadcast over its horizon and only the days column is filled in numerically.
+
+    Args:
+        model_inputs (:obj:`list` of :obj:`list`): raw model inputs, one per itinerary
+        encoder (:obj:`sklearn.compose.ColumnTransformer`): fitted onehot encoder
+        days_index (int): index of the days left column in the raw model input
+
+    Returns:
+        matrix (:obj:`numpy.ndarray`): float32 matrix of all horizons stacked
+        offsets (:obj:`numpy.ndarray`): row offsets, rows of itinerary `i` are `offsets[i]:offsets[i + 1]`
+    """
+    try:
+        days = np.array([int(row[days_index]) for row in model_inputs], dtype=np.int64)
+    except IndexError as e:
+        logger.error('Index of days is out of range of provided list. %s', e)
+        raise e
+    except ValueError as e:
+        logger.error('Unable to convert non-integer string to int. %s', e)
+        raise e
+    if (days < 0).any():
+        logger.error('Days left must not be negative.')
+        raise ValueError('Negative days left.')
+    offsets = np.zeros(len(days) + 1, dtype=np.int64)
+    np.cumsum(days, out=offsets[1:])
+
+    # Encode the constant part of every itinerary once
+    base = encode_rows(model_inputs, encoder, days_index)
+    column = passthrough_column(encoder, days_index)
+
+    # Broadcast the encoded rows over the horizons and count the days up from 0
+    matrix = np.repeat(base, days, axis=0)
+    matrix[:, column] = np.arange(offsets[-1]) - np.repeat(offsets[:-1], days)
+
+    return matrix, offsets
+
+
+def build_horizon(model_input: list, encoder, days_index: int = 7) -> np.ndarray:
+    """Build the encoded days-left horizon of a single itinerary
+
+    Args:
+        model_input (list): raw model input of the itinerary
+        encoder (:obj:`sklearn.compose.ColumnTransformer`): fitted onehot encoder
+        days_index (int): index of the days left column in the raw model input
+
+    Returns:
+        matrix (:obj:`numpy.ndarray`): float32 matrix with one row per day left
+    """
+    matrix, _ = build_horizons([model_input], encoder, days_index)
+    return matrix
+
+
+def price_curve(model_input: list, encoder, forest, days_index: int = 7) -> np.ndarray:
+    """Predict the price of an itinerary for every day left without building its horizon
+
+    Args:
+        model_input (list): raw model input of the itinerary
+        encoder (:obj:`sklearn.compose.ColumnTransformer`): fitted onehot encoder
+        forest (:obj:`src.inference_util.CompiledForest`): compiled price model
+        days_index (int): index of the days left column in the raw model input
+
+    Returns:
+        price (:obj:`numpy.ndarray`): predicted prices, one per day left counting up from 0
+    """
+    try:
+        days = int(model_input[days_index])
+    except IndexError as e:
+        logger.error('Index of days is out of range of provided list. %s', e)
+        raise e
+    except ValueError as e:
+        logger.error('Unable to convert non-integer string to int. %s', e)
+        raise e
+    row = encode_rows([model_input], encoder, days_index)[0]
+    return forest.predict_curve(row, passthrough_column(encoder, days_index), days)
+
+
+def split_curves(prices: np.ndarray, offsets: np.ndarray) -> list:
+    """Split the predictions of stacked horizons into one price curve per itinerary
+
+    Args:
+        prices (:obj:`numpy.ndarray`): predictions of the matrix built by `build_horizons()`
+        offsets (:obj:`numpy.ndarray`): row offsets returned by `build_horizons()`
+
+    Returns:
+        curves (:obj:`list` of :obj:`numpy.ndarray`): predicted prices per itinerary, one per day left
+    """
+    return [prices[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+
+
+def cheapest_day(prices: np.ndarray) -> tuple:
+    """Find the days left with the lowest predicted price
+
+    Args:
+        prices (:obj:`numpy.ndarray`): predicted prices, one per day left counting up from 0
+
+    Returns:
+        day (int): the first day with the lowest price, None if there are no prices
+        price (float): the lowest price, None if there are no prices
+    """
+    if len(prices) == 0:
+        return None, None
+    day = int(np.argmin(prices))
+    return day, float(prices[day])
+
+
+def normalize_input(model_input: list) -> tuple:
+    """Normalize a raw model input into a hashable key
+
+    Args:
+        model_input (list): airline, source, time of day, stops, destination, class, duration and days left
+
+    Returns:
+        key (tuple): the input with stripped strings and numeric stops, duration and days left
+    """
+    airline, source, segment, stops, destination, flight_class, duration, days_left = model_input
+    try:
+        return (str(airline).strip(), str(source).strip(), str(segment).strip(), int(stops),
+                str(destination).strip(), str(flight_class).strip(), float(duration), int(days_left))
+    except ValueError as e:
+        logger.error('Unable to convert stops, duration or days left to a number. %s', e)
+        raise e
 
 
 def time_of_day(time: str) -> str:
@@ -62,9 +249,102 @@ def time_of_day(time: str) -> str:
     return segment
 
 
+def time_of_day_array(times) -> np.ndarray:
+    """Vectorized `time_of_day()` of many `hour:minute` strings
+
+    Args:
+        times (array-like): departure times
+
+    Returns:
+        segments (:obj:`numpy.ndarray`): time of day of every departure time
+    """
+    parts = pd.Series(np.asarray(times, dtype=str)).str.split(':', expand=True)
+    if parts.shape[1] != 2 or parts.isna().any(axis=None):
+        logger.error('Check format of the times, expected `hour:minute`.')
+        raise ValueError('Invalid time format.')
+    try:
+        hour = pd.to_numeric(parts[0].str.strip()).to_numpy()
+    except ValueError as e:
+        logger.error('Unable to convert non-integer hours to int. %s', e)
+        raise e
+    if (hour != np.floor(hour)).any():
+        logger.error('Unable to convert non-integer hours to int.')
+        raise ValueError('Invalid hour.')
+    # Same segments as time_of_day(), hours 8, 12 and 16 included in Night
+    conditions = [(0 <= hour) & (hour < 4), (4 <= hour) & (hour < 8), (9 <= hour) & (hour < 12),
+                  (13 <= hour) & (hour < 16), (17 <= hour) & (hour < 20)]
+    segments = ['Late_Night', 'Early_Morning', 'Morning', 'Afternoon', 'Evening']
+    return np.select(conditions, segments, default='Night')
+
+
+@functools.lru_cache(maxsize=8)
+def _template(name: str) -> dict:
+    """Get a plotly template as the plain dicts plotly express writes into the layout of a figure"""
+    figure = json.loads(plotly.io.to_json(go.Figure(layout={'template': name})))
+    return figure['layout']['template']
+
+
 def plot_json(days: list[int], price: list[int]) -> str:
     """Make a 2D line plot with x_axis reversed and min value annotated
 
+    Builds the same figure as :obj:`plot_json_express` directly as plain dicts and serializes
+    it with the standard json module, without pandas and plotly express.
+
+    Args:
+        days(:obj:`list` of `int`): a list of integers served as x of the plot
+        price(:obj:`list` of `int`): a list of integers served as y of the plot
+
+    Returns:
+        graph_pred(str): a string representation of a json object storing the plot
+    """
+    if len(days) != len(price):
+        logger.error('Length of the input lists are not equal.')
+        raise ValueError('Incompatible lists length')
+    days, price = np.asarray(days), np.asarray(price)
+    x, y = days.tolist(), price.tolist()
+    # Missing prices are skipped by the minimum and written as null, like pandas and plotly do
+    missing = np.isnan(price) if price.dtype.kind == 'f' else np.zeros(len(price), dtype=bool)
+    if missing.any():
+        y = [None if is_missing else value for value, is_missing in zip(y, missing)]
+
+    template = _template(plotly.io.templates.default)
+    colorway = template.get('layout', {}).get('colorway') or px.colors.qualitative.Plotly
+    layout = {'template': template,
+              'xaxis': {'anchor': 'y', 'domain': [0.0, 1.0], 'title': {'text': 'Days Left'},
+                        'autorange': 'reversed', 'tickformat': 'd'},
+              'yaxis': {'anchor': 'x', 'domain': [0.0, 1.0], 'title': {'text': 'Price'}},
+              'legend': {'tracegroupgap': 0},
+              'title': {'text': 'Forecast'}}
+    if not missing.all():
+        min_value = price[~missing].min()
+        layout['annotations'] = [{'text': str(min_value), 'x': day, 'y': min_value.item()}
+                                 for day in days[price == min_value].tolist()]
+    trace = {'hovertemplate': 'Days Left=%{x}<br>Price=%{y}<extra></extra>',
+             'legendgroup': '',
+             'line': {'color': colorway[0], 'dash': 'solid'},
+             'marker': {'symbol': 'circle'},
+             'mode': 'lines+markers',
+             'name': '',
+             'orientation': 'v',
+             'showlegend': False,
+             'x': x,
+             'xaxis': 'x',
+             'y': y,
+             'yaxis': 'y',
+             'type': 'scatter'}
+    # Plotly express draws no trace without data
+    figure = {'data': [trace] if x else [], 'layout': layout}
+    graph_pred = json.dumps(figure)
+    logger.info('Successfully stored the graph in a json object.')
+
+    return graph_pred
+
+
+def plot_json_express(days: list[int], price: list[int]) -> str:
+    """Make a 2D line plot with x_axis reversed and min value annotated with plotly express
+
+    The reference implementation of :obj:`plot_json`.
+
     Args:
         days(:obj:`list` of `int`): a list of integers served as x of the plot
         price(:obj:`list` of `int`): a list of integers served as y of the plot
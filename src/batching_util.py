@@ -0,0 +1,165 @@
+import logging
+import threading
+import time
+import typing
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+def _bucket(size: int) -> str:
+    """Get the histogram bucket of a size, the smallest power of two not below it"""
+    return str(1 << max(size - 1, 0).bit_length())
+
+
+class MicroBatcher:
+    """Groups the items submitted by concurrent callers into one call of a batch function.
+
+    A background thread waits for the first submission, keeps collecting submissions for up to
+    `window` seconds or until `max_requests` submissions or `max_rows` rows are collected, calls
+    the batch function once on all their items and hands every caller its part of the results.
+    If the batch function raises, the submissions are retried one by one so only the callers
+    with bad items get the error.
+
+    Args:
+        batch_function (callable): takes a list of items and returns a list with one result per item
+        window (float): seconds to wait for more submissions after the first one
+        max_requests (int): maximum number of submissions grouped in one call
+        max_rows (int): maximum number of rows, as counted by the callers, grouped in one call
+    """
+    def __init__(self,
+                 batch_function: typing.Callable[[list], list],
+                 window: float = 0.003,
+                 max_requests: int = 64,
+                 max_rows: typing.Optional[int] = None):
+        if window < 0 or max_requests < 1:
+            raise ValueError('window must not be negative and max_requests must be positive.')
+        self.batch_function = batch_function
+        self.window = window
+        self.max_requests = max_requests
+        self.max_rows = max_rows
+        self.batches = 0
+        self.requests = 0
+        self.failed_batches = 0
+        self.batch_requests: dict = {}
+        self.batch_rows: dict = {}
+        self.total_delay = 0.0
+        self.max_delay = 0.0
+        # The counters are updated by the background thread and read by stats() from request threads
+        self._stats_lock = threading.Lock()
+        self._pending: list = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, items: list, rows: int = 1) -> Future:
+        """Queue items for the next batch
+
+        Args:
+            items (list): items passed to the batch function
+            rows (int): size of the items counted against `max_rows`
+
+        Returns:
+            future (:obj:`concurrent.futures.Future`): resolves to the list of results of the items
+        """
+        future: Future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('The batcher is closed.')
+            self._pending.append((items, rows, future, time.monotonic()))
+            self._condition.notify()
+        return future
+
+    def close(self) -> None:
+        """Run the pending submissions and stop the background thread"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._worker.join()
+
+    def _collect(self) -> list:
+        """Wait for submissions and take the next batch of them, empty once closed"""
+        with self._condition:
+            while not self._pending and not self._closed:
+                self._condition.wait()
+            # Keep collecting until the window of the oldest submission ends or the batch is full
+            deadline = self._pending[0][3] + self.window if self._pending else 0
+            while not self._closed and not self._full() and time.monotonic() < deadline:
+                self._condition.wait(deadline - time.monotonic())
+            batch, rows = [], 0
+            while self._pending and len(batch) < self.max_requests:
+                if batch and self.max_rows is not None and rows + self._pending[0][1] > self.max_rows:
+                    break
+                rows += self._pending[0][1]
+                batch.append(self._pending.pop(0))
+            return batch
+
+    def _full(self) -> bool:
+        """Check whether the pending submissions fill a batch, must be called with the lock held"""
+        if len(self._pending) >= self.max_requests:
+            return True
+        return self.max_rows is not None and sum(rows for _, rows, _, _ in self._pending) >= self.max_rows
+
+    def _run(self) -> None:
+        """Run batches until closed"""
+        while True:
+            batch = self._collect()
+            if not batch:
+                return
+            self._record(batch)
+            try:
+                results = self.batch_function([item for items, _, _, _ in batch for item in items])
+            except Exception as e:  # pylint: disable=broad-except
+                with self._stats_lock:
+                    self.failed_batches += 1
+                if len(batch) == 1:
+                    batch[0][2].set_exception(e)
+                    continue
+                logger.warning('Batch of %s requests failed, running them one by one. %s', len(batch), e)
+                for items, _, future, _ in batch:
+                    try:
+                        future.set_result(self.batch_function(items))
+                    except Exception as error:  # pylint: disable=broad-except
+                        future.set_exception(error)
+                continue
+            start = 0
+            for items, _, future, _ in batch:
+                future.set_result(results[start:start + len(items)])
+                start += len(items)
+
+    def _record(self, batch: list) -> None:
+        """Count a batch in the histograms and the queueing delay"""
+        now = time.monotonic()
+        delays = [now - submitted for _, _, _, submitted in batch]
+        rows = sum(rows for _, rows, _, _ in batch)
+        with self._stats_lock:
+            self.batches += 1
+            self.requests += len(batch)
+            self.batch_requests[_bucket(len(batch))] = self.batch_requests.get(_bucket(len(batch)), 0) + 1
+            self.batch_rows[_bucket(rows)] = self.batch_rows.get(_bucket(rows), 0) + 1
+            self.total_delay += sum(delays)
+            self.max_delay = max(self.max_delay, *delays)
+
+    def stats(self) -> dict:
+        """Get the counters of the batcher
+
+        Returns:
+            stats (dict): number of batches and requests, histograms of the requests and rows per
+                batch keyed by the upper bound of their power of two bucket, and the mean and
+                maximum milliseconds requests waited before their batch ran
+        """
+        # Snapshot the counters together so they are consistent with each other
+        with self._stats_lock:
+            batches, requests, failed_batches = self.batches, self.requests, self.failed_batches
+            batch_requests, batch_rows = dict(self.batch_requests), dict(self.batch_rows)
+            total_delay, max_delay = self.total_delay, self.max_delay
+        return {'window_ms': self.window * 1000,
+                'batches': batches,
+                'requests': requests,
+                'failed_batches': failed_batches,
+                'mean_batch_requests': requests / batches if batches else 0.0,
+                'batch_requests': dict(sorted(batch_requests.items(), key=lambda item: int(item[0]))),
+                'batch_rows': dict(sorted(batch_rows.items(), key=lambda item: int(item[0]))),
+                'mean_queue_delay_ms': total_delay / requests * 1000 if requests else 0.0,
+                'max_queue_delay_ms': max_delay * 1000}
@@ -0,0 +1,258 @@
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+import typing
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """A bounded, thread-safe in-process cache with least-recently-used eviction.
+
+    Args:
+        max_entries (int): maximum number of entries kept in the cache
+        ttl (float): seconds an entry stays valid, entries never expire if not provided
+        watch_paths (:obj:`list` of `str`): files the cached values depend on, the cache
+            is cleared whenever one of them is modified, created or removed
+        max_bytes (int): maximum total size of the cached values, unbounded if not provided
+        sizeof (callable): size of a value in bytes, `len` if not provided
+        disk (:obj:`DiskCache`): second tier the values are also written to and looked up in
+            when they are not in memory, entries in it do not expire or get invalidated
+    """
+    def __init__(self,
+                 max_entries: int = 1024,
+                 ttl: typing.Optional[float] = None,
+                 watch_paths: typing.Optional[list] = None,
+                 max_bytes: typing.Optional[int] = None,
+                 sizeof: typing.Optional[typing.Callable] = None,
+                 disk: typing.Optional['DiskCache'] = None):
+        if max_entries < 1:
+            raise ValueError('max_entries must be positive.')
+        if max_bytes is not None and max_bytes < 1:
+            raise ValueError('max_bytes must be positive.')
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.watch_paths = list(watch_paths or [])
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or len
+        self.disk = disk
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.bytes = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._signature = self._watch_signature()
+
+    def _watch_signature(self) -> tuple:
+        """Get the modification time and size of every watched file"""
+        signature = []
+        for path in self.watch_paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                signature.append(None)
+            else:
+                signature.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def _check_watched(self) -> None:
+        """Clear the cache if any watched file changed, must be called with the lock held"""
+        if not self.watch_paths:
+            return
+        signature = self._watch_signature()
+        if signature != self._signature:
+            logger.info('Watched files changed, clearing %s cached entries.', len(self._entries))
+            self._entries.clear()
+            self.bytes = 0
+            self._signature = signature
+            self.invalidations += 1
+
+    def get(self, key: typing.Hashable, default: typing.Any = None) -> typing.Any:
+        """Get the value cached under the key and mark it as recently used
+
+        Args:
+            key (hashable): key of the entry
+            default: value returned if the key is not cached
+
+        Returns:
+            value: the cached value or the default
+        """
+        with self._lock:
+            self._check_watched()
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                self.bytes -= entry[2]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+        value = self.disk.get(key) if self.disk is not None else None
+        if value is None:
+            with self._lock:
+                self.misses += 1
+            return default
+        # Promote the value read from disk to memory
+        with self._lock:
+            self.disk_hits += 1
+            self._store(key, value)
+        return value
+
+    def put(self, key: typing.Hashable, value: typing.Any) -> None:
+        """Cache the value under the key, evicting the least recently used entries if full
+
+        Args:
+            key (hashable): key of the entry
+            value: value to be cached
+        """
+        with self._lock:
+            self._check_watched()
+            self._store(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def _store(self, key: typing.Hashable, value: typing.Any) -> None:
+        """Cache the value in memory and evict down to the limits, must be called with the lock held"""
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old[2]
+        if self.max_bytes is not None and size > self.max_bytes:
+            logger.debug('Value of %s bytes does not fit in the cache.', size)
+            return
+        self._entries[key] = (value, time.monotonic(), size)
+        self.bytes += size
+        while len(self._entries) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= evicted[2]
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """Remove all entries from the cache"""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """Get the counters of the cache
+
+        Returns:
+            stats (dict): number of entries, hits, misses, evictions and invalidations, and the
+                bytes and disk hits if bounded by size or backed by disk
+        """
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            stats = {'entries': len(self._entries),
+                     'max_entries': self.max_entries,
+                     'hits': self.hits,
+                     'misses': self.misses,
+                     'hit_rate': self.hits / lookups if lookups else 0.0,
+                     'evictions': self.evictions,
+                     'invalidations': self.invalidations}
+            if self.max_bytes is not None:
+                stats.update({'bytes': self.bytes, 'max_bytes': self.max_bytes})
+            if self.disk is not None:
+                stats.update({'disk_hits': self.disk_hits, 'disk': self.disk.stats()})
+            return stats
+
+
+class DiskCache:
+    """A bounded cache of pickled values in files of a directory, shared by processes and restarts.
+
+    The least recently written files are removed once the files take more than `max_bytes`.
+
+    Args:
+        directory (str): directory of the cache files, created if it does not exist
+        max_bytes (int): maximum total size of the cache files
+    """
+    def __init__(self, directory: str, max_bytes: int = 256 * 2 ** 20):
+        if max_bytes < 1:
+            raise ValueError('max_bytes must be positive.')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.name.endswith('.pkl'))
+
+    def _path(self, key: typing.Hashable) -> str:
+        """Get the file of a key"""
+        return os.path.join(self.directory, hashlib.sha256(repr(key).encode()).hexdigest() + '.pkl')
+
+    def get(self, key: typing.Hashable) -> typing.Any:
+        """Get the value cached under the key
+
+        Args:
+            key (hashable): key of the entry, identified by its repr
+
+        Returns:
+            value: the cached value, None if the key is not cached or its file is unreadable
+        """
+        try:
+            with open(self._path(key), 'rb') as file:
+                cached_key, value = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            logger.warning('Unable to read the cache file of %s. %s', key, e)
+            return None
+        return value if cached_key == key else None
+
+    def put(self, key: typing.Hashable, value: typing.Any) -> None:
+        """Write the value to the file of the key, evicting the oldest files if full
+
+        Args:
+            key (hashable): key of the entry, identified by its repr
+            value: picklable value to be cached
+        """
+        path = self._path(key)
+        # Write to a temporary file first so readers never see a partial file
+        temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(temporary, 'wb') as file:
+                pickle.dump((key, value), file, protocol=pickle.HIGHEST_PROTOCOL)
+            size = os.path.getsize(temporary)
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(temporary, path)
+        except OSError as e:
+            logger.warning('Unable to write the cache file of %s. %s', key, e)
+            return
+        with self._lock:
+            self.bytes += size - old_size
+            if self.bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Remove the least recently written files down to 90% of the limit, must be called with the lock held"""
+        entries = sorted((entry for entry in os.scandir(self.directory) if entry.name.endswith('.pkl')),
+                         key=lambda entry: entry.stat().st_mtime_ns)
+        self.bytes = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self.bytes <= 0.9 * self.max_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            self.bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        """Get the counters of the cache
+
+        Returns:
+            stats (dict): bytes taken by the files, limit and number of evicted files
+        """
+        return {'bytes': self.bytes, 'max_bytes': self.max_bytes, 'evictions': self.evictions}
@@ -1,30 +1,22 @@
 import logging
 
-import numpy as np
 from sklearn.metrics import mean_squared_error, mean_absolute_error, mean_absolute_percentage_error
 
+from src.io_util import load_features
+
 logger = logging.getLogger(__name__)
 
 
-def evaluate_and_save(prediction_path: str,
-                      ytrue_path: str,
-                      save_path: str) -> None:
-    """Evaluate the given predictions based on true labels, save the evaluations to specified path
+def evaluation_report(y_true, y_pred) -> str:
+    """Calculate the evaluation metrics of the predictions
 
     Args:
-        prediction_path (str): path to load the predictions
-        ytrue_path (str): path to load the true labels
-        save_path (str): path to save the evaluation metrics
+        y_true (:obj:`numpy.ndarray`): the true labels
+        y_pred (:obj:`numpy.ndarray`): the predictions
+
+    Returns:
+        report (str): the MSE, MAE and MAPE of the predictions, one per line
     """
-    try:
-        y_true = np.load(ytrue_path, allow_pickle=True)
-        y_pred = np.load(prediction_path, allow_pickle=True)
-    except FileNotFoundError as e:
-        logger.error('Invalid path provided for np.load(). '
-                     'Failed to load prediction and true label.')
-        raise e
-    else:
-        logger.info('Successfully loaded predictions and true labels.')
     try:
         mse = mean_squared_error(y_true, y_pred)
         mae = mean_absolute_error(y_true, y_pred)
@@ -42,12 +34,33 @@ def evaluate_and_save(prediction_path: str,
     logger.info(mse_str)
     logger.info(mae_str)
     logger.info(mape_str)
+    return mse_str + '\n' + mae_str + '\n' + mape_str + '\n'
+
+
+def evaluate_and_save(prediction_path: str,
+                      ytrue_path: str,
+                      save_path: str) -> None:
+    """Evaluate the given predictions based on true labels, save the evaluations to specified path
+
+    Args:
+        prediction_path (str): path to load the predictions
+        ytrue_path (str): path to load the true labels
+        save_path (str): path to save the evaluation metrics
+    """
+    try:
+        y_true = load_features(ytrue_path)
+        y_pred = load_features(prediction_path)
+    except FileNotFoundError as e:
+        logger.error('Invalid path provided for load_features(). '
+                     'Failed to load prediction and true label.')
+        raise e
+    else:
+        logger.info('Successfully loaded predictions and true labels.')
+    report = evaluation_report(y_true, y_pred)
     # Write the report to a txt file
     try:
         with open(save_path, 'w', encoding='utf-8') as file:
-            file.write(mse_str + '\n')
-            file.write(mae_str + '\n')
-            file.write(mape_str + '\n')
+            file.write(report)
     except FileNotFoundError as e:
         logger.error('Path %s does not exist. Failed to save the report.', save_path)
         raise e
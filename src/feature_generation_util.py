@@ -6,31 +6,25 @@ import pandas as pd
 from sklearn.compose import ColumnTransformer
 from sklearn.preprocessing import OneHotEncoder
 
+from src.io_util import read_frame, save_features, write_frame
+from src.preprocess_util import process_data
+
 logger = logging.getLogger(__name__)
 
 
-def extract_features(read_path: str, save_path: str, target_name: str, feature_names: list = None) -> None:
-    """Get the features and target from the dataframe and save them separately
+def split_target(df: pd.DataFrame, target_name: str, feature_names: list = None) -> tuple:
+    """Get the features and target from the dataframe
 
     Args:
-        read_path (str): the path to read the dataframe
-        save_path (str): the path to save the dataframe
+        df (:obj:`pandas.DataFrame`): the dataframe holding features and target
         target_name (str): the name of the target column
         feature_names (:obj: `list` of `str`): a list of feature names to be extracted,
                       if not provided, all columns besides the target will be used
-    """
-    try:
-        df = pd.read_csv(read_path)
-    except FileNotFoundError as e:
-        logger.error('Path %s does not exist.', read_path)
-        raise e
-    except pd.errors.ParserError as e:
-        logger.error('Wrong file type in %s', read_path)
-        raise e
-    else:
-        logger.info('Successfully read the csv from %s', read_path)
-        logger.debug('The shape of the loaded dataframe is: %s', df.shape)
 
+    Returns:
+        features (:obj:`pandas.DataFrame`): the features
+        target (:obj:`numpy.ndarray`): the target
+    """
     # Make sure the dataframe contains all the columns in feature_names and target
     target_set = set([target_name])
     if feature_names:
@@ -48,13 +42,46 @@ def extract_features(read_path: str, save_path: str, target_name: str, feature_n
         features = df[feature_names]
     else:
         features = df.drop(target_name, axis=1)
+    return features, target
+
+
+def extract_features(read_path: str,
+                     save_path: str,
+                     target_name: str,
+                     feature_names: list = None,
+                     features_file: str = 'features.csv') -> None:
+    """Get the features and target from the dataframe and save them separately
+
+    Args:
+        read_path (str): the path to read the dataframe, csv or Parquet
+        save_path (str): the path to save the dataframe
+        target_name (str): the name of the target column
+        feature_names (:obj: `list` of `str`): a list of feature names to be extracted,
+                      if not provided, all columns besides the target will be used
+        features_file (str): file name of the saved features, saved as Parquet if it ends with `.parquet`
+    """
+    # Only parse the columns that are extracted
+    columns = list(feature_names) + [target_name] if feature_names else None
+    try:
+        df = read_frame(read_path, columns=columns)
+    except FileNotFoundError as e:
+        logger.error('Path %s does not exist.', read_path)
+        raise e
+    except ValueError as e:
+        logger.error('Wrong file type in %s, or it does not contain all the provided columns.', read_path)
+        raise e
+    else:
+        logger.info('Successfully read the data from %s', read_path)
+        logger.debug('The shape of the loaded dataframe is: %s', df.shape)
+
+    features, target = split_target(df, target_name, feature_names)
     # Assemble the full path to save the files
     target_path = save_path + '/target.npy'
-    features_path = save_path + '/features.csv'
-    # Save the target as npy and features as csv
+    features_path = save_path + '/' + features_file
+    # Save the target as npy and features as a table
     try:
         np.save(target_path, target)
-        features.to_csv(features_path, index=False)
+        write_frame(features, features_path)
     except FileNotFoundError as e:
         logger.error('Path does not exist, %s', e)
         raise e
@@ -62,54 +89,79 @@ def extract_features(read_path: str, save_path: str, target_name: str, feature_n
         logger.info('Successfully saved the features and targets.')
 
 
+def fit_encoder(data: pd.DataFrame, features: list, sparse: bool = False) -> tuple:
+    """Fit the onehot encoder and encode the features
+
+    Args:
+        data (:obj:`pandas.DataFrame`): the features
+        features (:obj:`list` of `str`): feature names that need onehot encoding
+        sparse (bool): encode into a CSR matrix instead of a dense array
+
+    Returns:
+        transformer (:obj:`sklearn.compose.ColumnTransformer`): the fitted encoder
+        data (:obj:`numpy.ndarray` or :obj:`scipy.sparse.csr_matrix`): the encoded features
+    """
+    column_names = np.array(data.columns)
+    feature_set = set(features)
+    column_set = set(column_names)
+    if not feature_set.issubset(column_set):
+        logger.error('The columns of the dataframe does not contain all the provided features')
+        raise KeyError('Invalid feature names.')
+
+    # Get the column index of the features to be encoded
+    feature_indices = np.where(np.isin(column_names, features))[0]
+    # Initialize the ColumnTransformer
+    transformer = ColumnTransformer([('encoder', OneHotEncoder(sparse=sparse), feature_indices)],
+                                    remainder='passthrough',
+                                    sparse_threshold=1 if sparse else 0)
+
+    data = transformer.fit_transform(data)
+    logger.info('Fit and transformed the data successfully.')
+    logger.debug('The shape of the transformed data is %s', data.shape)
+    return transformer, data
+
+
 def encode_and_save(read_path: str,
                     encoded_path: str,
                     encoder_path: str,
-                    features: list) -> None:
+                    features: list,
+                    sparse: bool = False,
+                    dtype: str = 'float32') -> None:
     """Encode the features, save the encoded features and the encoder model
 
     Args:
-        read_path (str): path to read the features file
+        read_path (str): path to read the features file, csv or Parquet
         encoded_path (str): path to save the encoded features
         encoder_path (str): path to save the encoder model object
         features (:obj:`list` of `str`): feature names that need onehot encoding
+        sparse (bool): keep the encoded features as a CSR matrix saved as `.npz` instead of
+            a dense array saved as `.npy`
+        dtype (str): numeric type of the saved features, float32 is what the trees split on
     """
     try:
-        data = pd.read_csv(read_path)
+        data = read_frame(read_path)
     except FileNotFoundError as e:
         logger.error('Path %s does not exist.', read_path)
         raise e
-    except pd.errors.ParserError as e:
+    except ValueError as e:
         logger.error('Wrong file type in %s', read_path)
         raise e
     else:
-        logger.info('Successfully read the csv from %s', read_path)
+        logger.info('Successfully read the data from %s', read_path)
         logger.debug('The shape of the loaded dataframe is: %s', data.shape)
 
-    column_names = np.array(data.columns)
-    feature_set = set(features)
-    column_set = set(column_names)
-    if not feature_set.issubset(column_set):
-        logger.error('The columns of the dataframe does not contain all the provided features')
-        raise KeyError('Invalid feature names.')
-
-    # Get the column index of the features to be encoded
-    feature_indices = np.where(np.isin(column_names, features))[0]
-    # Initialize the ColumnTransformer
-    transformer = ColumnTransformer([('encoder', OneHotEncoder(sparse=False), feature_indices)],
-                                    remainder='passthrough')
-
-    data = transformer.fit_transform(data)
-    logger.info('Fit and transformed the data successfully.')
-    logger.debug('The shape of the transformed data is %s', data.shape)
+    transformer, data = fit_encoder(data, features, sparse)
     try:
-        np.save(encoded_path, data)
+        encoded_path = save_features(encoded_path, data, dtype)
         joblib.dump(transformer, encoder_path)
     except FileNotFoundError as e:
         logger.error('Path does not exist, %s', e)
         raise e
+    except ValueError as e:
+        logger.error('Unable to save the encoded features as %s.', dtype)
+        raise e
     else:
-        logger.info('Successfully saved the encoded features and encoder.')
+        logger.info('Successfully saved the encoded features to %s and the encoder.', encoded_path)
 
 
 def generate_feature(config: dict) -> None:
@@ -137,4 +189,52 @@ def generate_feature(config: dict) -> None:
     except Exception as e:
         raise e
     else:
-        logger.info('Successfully saved the encoded data and the encoder.')
\ No newline at end of file
+        logger.info('Successfully saved the encoded data and the encoder.')
+
+
+def featurize(df: pd.DataFrame, config: dict, debug: bool = False) -> None:
+    """Go from the raw dataframe to the encoded features, target and encoder in memory
+
+    Runs the same steps as the `preprocess` and `generate_feature` stages without writing and
+    re-reading the intermediate csv files, which are only saved in debug mode.
+
+    Args:
+        df (:obj:`pandas.DataFrame`): the raw data
+        config (dict): the configuration with `preprocess` and `generate_feature` sections
+        debug (bool): also save the processed data and the extracted features
+    """
+    try:
+        process_param = dict(config['preprocess']['process_param'])
+        extract_config = dict(config['generate_feature']['extract_features'])
+        encode_config = dict(config['generate_feature']['encode'])
+    except KeyError as e:
+        logger.error('Key not found.')
+        raise e
+    clean_path = process_param.pop('save_path')
+    save_path = extract_config.pop('save_path')
+    features_file = extract_config.pop('features_file', 'features.csv')
+    extract_config.pop('read_path', None)
+
+    try:
+        df = process_data(df, **process_param)
+        features, target = split_target(df, **extract_config)
+        transformer, data = fit_encoder(features, encode_config['features'], encode_config.get('sparse', False))
+    except TypeError as e:
+        logger.error('Unexpected keyword argument.')
+        raise e
+    else:
+        logger.info('Successfully encoded the raw data in memory.')
+
+    try:
+        if debug:
+            write_frame(df, clean_path)
+            write_frame(features, save_path + '/' + features_file)
+            logger.debug('Saved the intermediate data to %s and %s', clean_path, save_path)
+        np.save(save_path + '/target.npy', target)
+        encoded_path = save_features(encode_config['encoded_path'], data, encode_config.get('dtype', 'float32'))
+        joblib.dump(transformer, encode_config['encoder_path'])
+    except FileNotFoundError as e:
+        logger.error('Path does not exist, %s', e)
+        raise e
+    else:
+        logger.info('Successfully saved the encoded features to %s, the target and the encoder.', encoded_path)
@@ -0,0 +1,319 @@
+import logging
+
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+
+class CompiledForest:
+    """A tree ensemble compiled into flat arrays for vectorized inference.
+
+    The nodes of all trees are concatenated into contiguous arrays. Leaves point back to
+    themselves, so every tree can be walked for a fixed number of steps over a whole batch.
+
+    Args:
+        feature (:obj:`numpy.ndarray`): feature index split on by every node
+        threshold (:obj:`numpy.ndarray`): threshold of every node, go left if `x <= threshold`
+        left (:obj:`numpy.ndarray`): global index of the left child of every node
+        right (:obj:`numpy.ndarray`): global index of the right child of every node
+        value (:obj:`numpy.ndarray`): predicted value of every node
+        roots (:obj:`numpy.ndarray`): global index of the root of every tree
+        max_depth (int): depth of the deepest tree
+        n_features (int): number of features the forest was fitted on
+    """
+    def __init__(self,
+                 feature: np.ndarray,
+                 threshold: np.ndarray,
+                 left: np.ndarray,
+                 right: np.ndarray,
+                 value: np.ndarray,
+                 roots: np.ndarray,
+                 max_depth: int,
+                 n_features: int):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.max_depth = max_depth
+        self.n_features = n_features
+        self.is_leaf = left == np.arange(len(left))
+
+    @classmethod
+    def from_model(cls, model) -> 'CompiledForest':
+        """Compile the fitted trees of a forest
+
+        Args:
+            model (:obj:`sklearn.ensemble.RandomForestRegressor`): fitted single-output forest
+
+        Returns:
+            forest (:obj:`CompiledForest`): the compiled forest
+        """
+        try:
+            trees = [estimator.tree_ for estimator in model.estimators_]
+        except AttributeError as e:
+            logger.error('The model is not a fitted tree ensemble.')
+            raise e
+        if any(tree.n_outputs != 1 for tree in trees):
+            logger.error('Only single-output forests can be compiled.')
+            raise ValueError('Multi-output forests are not supported.')
+
+        sizes = np.array([tree.node_count for tree in trees], dtype=np.int64)
+        roots = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        feature, threshold, left, right, value = [], [], [], [], []
+        for root, tree in zip(roots, trees):
+            nodes = np.arange(tree.node_count)
+            is_leaf = tree.children_left == -1
+            # Leaves loop back to themselves so that extra steps are no-ops
+            feature.append(np.where(is_leaf, 0, tree.feature))
+            threshold.append(np.where(is_leaf, np.inf, tree.threshold))
+            left.append(np.where(is_leaf, nodes, tree.children_left) + root)
+            right.append(np.where(is_leaf, nodes, tree.children_right) + root)
+            value.append(tree.value[:, 0, 0])
+
+        forest = cls(feature=np.concatenate(feature).astype(np.intp),
+                     threshold=np.concatenate(threshold).astype(np.float64),
+                     left=np.concatenate(left).astype(np.intp),
+                     right=np.concatenate(right).astype(np.intp),
+                     value=np.concatenate(value).astype(np.float64),
+                     roots=roots.astype(np.intp),
+                     max_depth=max(tree.max_depth for tree in trees),
+                     n_features=model.n_features_in_)
+        logger.info('Compiled %s trees with %s nodes in total.', len(trees), sizes.sum())
+        return forest
+
+    def apply(self, x: np.ndarray) -> np.ndarray:
+        """Find the leaf reached by every sample in every tree
+
+        Args:
+            x (:obj:`numpy.ndarray`): 2D array of samples
+
+        Returns:
+            leaves (:obj:`numpy.ndarray`): global leaf indices of shape (n_trees, n_samples)
+        """
+        # Trees compare float32 features against float64 thresholds, like sklearn does
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        if x.ndim != 2 or x.shape[1] != self.n_features:
+            logger.error('Expected a 2D array with %s features, got shape %s.', self.n_features, x.shape)
+            raise ValueError('Input has incorrect number of features.')
+        # Walk on the flattened batch, every step moves all trees one level down
+        flat = x.ravel()
+        offsets = np.arange(x.shape[0]) * x.shape[1]
+        nodes = np.repeat(self.roots[:, np.newaxis], x.shape[0], axis=1)
+        for _ in range(self.max_depth):
+            values = flat.take(offsets + self.feature.take(nodes))
+            nodes = np.where(values <= self.threshold.take(nodes), self.left.take(nodes), self.right.take(nodes))
+        return nodes
+
+    def predict(self, x: np.ndarray, chunk_rows: int = 4096) -> np.ndarray:
+        """Predict with the mean of all trees, equivalent to `RandomForestRegressor.predict`
+
+        Args:
+            x (:obj:`numpy.ndarray` or :obj:`scipy.sparse.csr_matrix`): 2D array of samples
+            chunk_rows (int): number of samples walked at once to bound memory
+
+        Returns:
+            y_pred (:obj:`numpy.ndarray`): predictions of shape (n_samples,)
+        """
+        is_sparse = sparse.issparse(x)
+        x = sparse.csr_matrix(x) if is_sparse else np.asarray(x)
+        y_pred = np.empty(x.shape[0], dtype=np.float64)
+        for start in range(0, x.shape[0], chunk_rows):
+            chunk = x[start:start + chunk_rows]
+            leaves = self.apply(chunk.toarray() if is_sparse else chunk)
+            y_pred[start:start + chunk_rows] = self.value[leaves].mean(axis=0)
+        return y_pred
+
+    def predict_curve(self, x: np.ndarray, column: int, n_values: int) -> np.ndarray:
+        """Predict a sample for every integer value 0 to `n_values - 1` of one feature
+
+        For a fixed sample every tree is a piecewise-constant function of the varying
+        feature. The trees are walked once for the fixed features, splitting the range of
+        the varying feature at its thresholds, and the constant pieces are summed up with a
+        difference array instead of walking the trees once per value.
+
+        Args:
+            x (:obj:`numpy.ndarray`): 1D sample, the value of the varying feature is ignored
+            column (int): index of the varying feature
+            n_values (int): number of values of the varying feature, counting up from 0
+
+        Returns:
+            y_pred (:obj:`numpy.ndarray`): predictions of shape (n_values,)
+        """
+        x = np.asarray(x, dtype=np.float32).ravel()
+        if x.shape[0] != self.n_features:
+            logger.error('Expected a sample with %s features, got %s.', self.n_features, x.shape[0])
+            raise ValueError('Input has incorrect number of features.')
+        if not 0 <= column < self.n_features:
+            logger.error('Column %s is out of range of the features.', column)
+            raise IndexError('Invalid column index.')
+        if n_values <= 0:
+            return np.empty(0, dtype=np.float64)
+
+        diff = np.zeros(n_values + 1, dtype=np.float64)
+        # Every frontier entry is a node together with the range of values [low, high] reaching it
+        nodes = self.roots.copy()
+        low = np.zeros(len(nodes), dtype=np.int64)
+        high = np.full(len(nodes), n_values - 1, dtype=np.int64)
+        while len(nodes):
+            leaf = self.is_leaf[nodes]
+            np.add.at(diff, low[leaf], self.value[nodes[leaf]])
+            np.add.at(diff, high[leaf] + 1, -self.value[nodes[leaf]])
+            nodes, low, high = nodes[~leaf], low[~leaf], high[~leaf]
+
+            varying = self.feature[nodes] == column
+            # Fixed features send the whole range down one side
+            fixed = nodes[~varying]
+            fixed_next = np.where(x[self.feature[fixed]] <= self.threshold[fixed],
+                                  self.left[fixed], self.right[fixed])
+            # The varying feature splits the range at the threshold, integer v goes left if v <= floor(t)
+            split = nodes[varying]
+            cut = np.floor(self.threshold[split]).astype(np.int64)
+            split_low, split_high = low[varying], high[varying]
+            left_high = np.minimum(split_high, cut)
+            right_low = np.maximum(split_low, cut + 1)
+            keep_left = split_low <= left_high
+            keep_right = right_low <= split_high
+
+            nodes = np.concatenate((fixed_next, self.left[split][keep_left], self.right[split][keep_right]))
+            low = np.concatenate((low[~varying], split_low[keep_left], right_low[keep_right]))
+            high = np.concatenate((high[~varying], left_high[keep_left], split_high[keep_right]))
+
+        return np.cumsum(diff[:-1]) / len(self.roots)
+
+
+class CompiledEncoder:
+    """A fitted onehot `ColumnTransformer` compiled into array lookup tables.
+
+    Every onehot encoded input column holds its categories sorted as strings together with
+    the output column of each category, passthrough columns hold their output position.
+    Rows are written straight into a float32 buffer.
+
+    Args:
+        n_features (int): number of raw input columns
+        n_outputs (int): number of encoded output columns
+        onehot (:obj:`list` of `tuple`): input column, sorted category strings, output column of
+            every sorted category, whether unknown categories are ignored and the column index
+            within its `OneHotEncoder`, per encoded column
+        passthrough (dict): output column of every passthrough input column
+    """
+    def __init__(self, n_features: int, n_outputs: int, onehot: list, passthrough: dict):
+        self.n_features = n_features
+        self.n_outputs = n_outputs
+        self.onehot = onehot
+        self.passthrough = passthrough
+
+    @classmethod
+    def from_transformer(cls, transformer) -> 'CompiledEncoder':
+        """Compile a fitted `ColumnTransformer` of `OneHotEncoder` and passthrough columns
+
+        Args:
+            transformer (:obj:`sklearn.compose.ColumnTransformer`): the fitted transformer
+
+        Returns:
+            encoder (:obj:`CompiledEncoder`): the compiled encoder
+        """
+        try:
+            n_features = transformer.n_features_in_
+            fitted = transformer.transformers_
+            output_indices = transformer.output_indices_
+        except AttributeError as e:
+            logger.error('The encoder is not a fitted ColumnTransformer.')
+            raise e
+        onehot, passthrough = [], {}
+        for name, trans, columns in fitted:
+            columns = np.arange(n_features)[columns].tolist()
+            start = output_indices[name].start
+            if trans == 'drop' or not columns:
+                continue
+            if trans == 'passthrough':
+                for i, column in enumerate(columns):
+                    passthrough[column] = start + i
+                continue
+            if (not hasattr(trans, 'categories_') or trans.drop_idx_ is not None
+                    or getattr(trans, '_infrequent_enabled', False)):
+                logger.error('Transformer `%s` is not a plain OneHotEncoder.', name)
+                raise ValueError('Unsupported transformer.')
+            for i, (column, categories) in enumerate(zip(columns, trans.categories_)):
+                keys = np.array([str(category) for category in categories])
+                order = np.argsort(keys, kind='stable')
+                onehot.append((column, keys[order], start + order, trans.handle_unknown == 'ignore', i))
+                start += len(categories)
+        encoder = cls(n_features=n_features,
+                      n_outputs=max(indices.stop for indices in output_indices.values()),
+                      onehot=onehot,
+                      passthrough=passthrough)
+        logger.info('Compiled encoder with %s onehot and %s passthrough columns.', len(onehot), len(passthrough))
+        return encoder
+
+    def output_column(self, column: int) -> int:
+        """Get the output column of a passthrough input column
+
+        Args:
+            column (int): index of the column in the raw input
+
+        Returns:
+            index (int): index of the same column in the encoded output
+        """
+        try:
+            return self.passthrough[column]
+        except KeyError as e:
+            logger.error('Column %s is not passed through by the encoder.', column)
+            raise ValueError('Column is not a passthrough column.') from e
+
+    def _check_input(self, x) -> np.ndarray:
+        """Convert the input to a 2D string array with the right number of columns"""
+        x = np.asarray(x, dtype=str)
+        if x.ndim != 2 or x.shape[1] != self.n_features:
+            logger.error('Expected a 2D array with %s columns, got shape %s.', self.n_features, x.shape)
+            raise ValueError('Input has incorrect number of columns.')
+        return x
+
+    def codes(self, x) -> np.ndarray:
+        """Integer encode the onehot encoded columns
+
+        Args:
+            x (array-like): 2D array of raw input rows
+
+        Returns:
+            codes (:obj:`numpy.ndarray`): output column of every encoded value, -1 for ignored unknowns
+        """
+        x = self._check_input(x)
+        codes = np.empty((x.shape[0], len(self.onehot)), dtype=np.int64)
+        for i, (column, keys, outputs, ignore, index) in enumerate(self.onehot):
+            values = x[:, column]
+            position = np.searchsorted(keys, values).clip(max=len(keys) - 1)
+            known = keys[position] == values
+            if not known.all() and not ignore:
+                # Same message as OneHotEncoder
+                diff = sorted(set(values[~known].tolist()))
+                raise ValueError(f'Found unknown categories {diff} in column {index} during transform')
+            codes[:, i] = np.where(known, outputs[position], -1)
+        return codes
+
+    def transform(self, x, out: np.ndarray = None) -> np.ndarray:
+        """Onehot encode raw input rows, equivalent to `transformer.transform(x).astype('float')`
+
+        Args:
+            x (array-like): 2D array of raw input rows
+            out (:obj:`numpy.ndarray`): preallocated float32 buffer of shape (n_rows, n_outputs)
+
+        Returns:
+            out (:obj:`numpy.ndarray`): the encoded rows
+        """
+        x = self._check_input(x)
+        if out is None:
+            out = np.zeros((x.shape[0], self.n_outputs), dtype=np.float32)
+        elif out.shape != (x.shape[0], self.n_outputs) or out.dtype != np.float32:
+            logger.error('Expected a float32 buffer of shape %s.', (x.shape[0], self.n_outputs))
+            raise ValueError('Invalid output buffer.')
+        else:
+            out[:] = 0
+        codes = self.codes(x)
+        rows, encoded = np.nonzero(codes >= 0)
+        out[rows, codes[rows, encoded]] = 1
+        for column, output in self.passthrough.items():
+            out[:, output] = x[:, column].astype(np.float64)
+        return out
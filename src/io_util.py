@@ -0,0 +1,267 @@
+import logging
+import os
+import time
+import typing
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+DENSE_SUFFIX = '.npy'
+SPARSE_SUFFIX = '.npz'
+PARQUET_SUFFIXES = ('.parquet', '.pq')
+
+# Settings of the tabular storage, set from the `storage` section of the model config
+STORAGE = {'categorical_columns': [], 'compression': 'snappy'}
+# Bytes read and seconds spent parsing per storage backend
+IO_STATS: dict = {}
+
+
+def resolve_path(path: str) -> str:
+    """Find the saved features file of a path, which may have been saved with the other format
+
+    Dense features are saved as `.npy` and sparse features as `.npz`, so the configured
+    path is tried first and then the same path with the other suffix.
+
+    Args:
+        path (str): configured path of the features
+
+    Returns:
+        path (str): the existing path, or the configured path if neither exists
+    """
+    if os.path.exists(path):
+        return path
+    stem, suffix = os.path.splitext(path)
+    if suffix in (DENSE_SUFFIX, SPARSE_SUFFIX):
+        other = stem + (SPARSE_SUFFIX if suffix == DENSE_SUFFIX else DENSE_SUFFIX)
+        if os.path.exists(other):
+            return other
+    return path
+
+
+def save_features(path: str, data, dtype: typing.Optional[str] = None) -> str:
+    """Save a dense array as `.npy` or a sparse matrix as CSR `.npz`
+
+    Args:
+        path (str): path to save the features, the suffix is replaced according to the format
+        data (:obj:`numpy.ndarray` or :obj:`scipy.sparse.spmatrix`): features to be saved
+        dtype (str): numeric type to cast the features to before saving, kept as is if None
+
+    Returns:
+        path (str): the path the features were saved to
+    """
+    if dtype is not None:
+        try:
+            data = data.astype(dtype, copy=False)
+        except (TypeError, ValueError) as e:
+            logger.error('Unable to cast the features to %s, check for non-numeric columns.', dtype)
+            raise e
+    stem, suffix = os.path.splitext(path)
+    if suffix not in (DENSE_SUFFIX, SPARSE_SUFFIX):
+        stem = path
+    if sparse.issparse(data):
+        path = stem + SPARSE_SUFFIX
+        sparse.save_npz(path, sparse.csr_matrix(data))
+    else:
+        path = stem + DENSE_SUFFIX
+        np.save(path, data)
+    logger.debug('Saved features of shape %s to %s', data.shape, path)
+    return path
+
+
+def load_features(path: str, mmap_mode: typing.Optional[str] = 'r'):
+    """Load features saved by `save_features()`
+
+    Numeric `.npy` arrays are memory-mapped, so large stages start without reading the whole
+    array into memory and processes share its pages. Object arrays saved by older versions of
+    the pipeline cannot be memory-mapped and are unpickled instead.
+
+    Args:
+        path (str): path of the features, `.npz` files are loaded as CSR matrices
+        mmap_mode (str): mode to memory-map `.npy` arrays with, loaded into memory if None
+
+    Returns:
+        data (:obj:`numpy.ndarray` or :obj:`scipy.sparse.csr_matrix`): the loaded features
+    """
+    path = resolve_path(path)
+    if path.endswith(SPARSE_SUFFIX):
+        return sparse.load_npz(path).tocsr()
+    try:
+        return np.load(path, mmap_mode=mmap_mode)
+    except ValueError:
+        logger.warning('%s holds Python objects, unpickling it. Regenerate it to get a typed array.', path)
+        return np.load(path, allow_pickle=True)
+
+
+def configure_storage(categorical_columns: typing.Optional[list] = None,
+                      compression: str = 'snappy') -> None:
+    """Set how tables are written by `write_frame()`
+
+    Args:
+        categorical_columns (:obj:`list` of `str`): columns stored with a categorical dtype in Parquet
+        compression (str): compression codec of Parquet files
+    """
+    STORAGE['categorical_columns'] = list(categorical_columns or [])
+    STORAGE['compression'] = compression
+
+
+def frame_backend(path: str) -> str:
+    """Get the storage backend of a table from its path, `parquet` for `.parquet` files and `csv` otherwise"""
+    return 'parquet' if path.endswith(PARQUET_SUFFIXES) else 'csv'
+
+
+def _record_read(backend: str, n_bytes: int, seconds: float) -> None:
+    """Add a read to the statistics of its backend"""
+    stats = IO_STATS.setdefault(backend, {'files': 0, 'bytes': 0, 'seconds': 0.0})
+    stats['files'] += 1
+    stats['bytes'] += n_bytes
+    stats['seconds'] += seconds
+
+
+def _parquet_bytes(path: str, columns: typing.Optional[list]) -> int:
+    """Get the compressed size of the column chunks that are read from a Parquet file"""
+    import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+    metadata = pq.ParquetFile(path).metadata
+    n_bytes = 0
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        for j in range(row_group.num_columns):
+            chunk = row_group.column(j)
+            if columns is None or chunk.path_in_schema in columns:
+                n_bytes += chunk.total_compressed_size
+    return n_bytes
+
+
+def read_frame(path: str,
+               columns: typing.Optional[list] = None,
+               index_col: typing.Optional[int] = None) -> pd.DataFrame:
+    """Read a table from csv or Parquet, only parsing the requested columns
+
+    Args:
+        path (str): path of the table, Parquet is used for `.parquet` files
+        columns (:obj:`list` of `str`): columns to read, all columns if not provided
+        index_col (int): column of a csv file to use as the index, csv files only and
+            counted within the read columns
+
+    Returns:
+        df (:obj:`pandas.DataFrame`): the table
+    """
+    backend = frame_backend(path)
+    start = time.perf_counter()
+    if backend == 'parquet':
+        df = pd.read_parquet(path, columns=columns)
+        n_bytes = _parquet_bytes(path, columns)
+    else:
+        df = pd.read_csv(path, usecols=columns, index_col=index_col)
+        n_bytes = os.path.getsize(path)
+    if columns is not None:
+        df = df[columns]
+    elapsed = time.perf_counter() - start
+    _record_read(backend, n_bytes, elapsed)
+    logger.debug('Read %s bytes from %s with %s in %.3fs', n_bytes, path, backend, elapsed)
+    return df
+
+
+def iter_frames(path: str, chunksize: int, index_col: typing.Optional[int] = None) -> typing.Iterator:
+    """Read a table from csv or Parquet in chunks of rows
+
+    Args:
+        path (str): path of the table, Parquet is used for `.parquet` files
+        chunksize (int): number of rows per chunk
+        index_col (int): column of a csv file to use as the index, csv files only
+
+    Returns:
+        chunks (iterator of :obj:`pandas.DataFrame`): the chunks of the table
+    """
+    backend = frame_backend(path)
+    if backend == 'parquet':
+        import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+        chunks = (batch.to_pandas() for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize))
+        n_bytes = _parquet_bytes(path, None)
+    else:
+        chunks = pd.read_csv(path, index_col=index_col, chunksize=chunksize)
+        n_bytes = os.path.getsize(path)
+    # Only the time spent parsing counts, not the time the caller spends on every chunk
+    elapsed = 0.0
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        elapsed += time.perf_counter() - start
+        if chunk is None:
+            break
+        yield chunk
+    _record_read(backend, n_bytes, elapsed)
+
+
+def _categorize(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert the configured categorical columns of a table"""
+    columns = [column for column in STORAGE['categorical_columns'] if column in df.columns]
+    if not columns:
+        return df
+    return df.astype({column: 'category' for column in columns})
+
+
+def write_frame(df: pd.DataFrame, path: str) -> None:
+    """Write a table without its index to csv, or to compressed Parquet with categorical columns
+
+    Args:
+        df (:obj:`pandas.DataFrame`): the table
+        path (str): path of the table, Parquet is used for `.parquet` files
+    """
+    if frame_backend(path) == 'parquet':
+        _categorize(df).to_parquet(path, index=False, compression=STORAGE['compression'])
+    else:
+        df.to_csv(path, index=False)
+
+
+class FrameWriter:
+    """Append chunks of a table to a csv or Parquet file
+
+    Args:
+        path (str): path of the table, Parquet is used for `.parquet` files
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.backend = frame_backend(path)
+        self._writer = None
+        self._schema = None
+        self._first = True
+
+    def write(self, df: pd.DataFrame) -> None:
+        """Append a chunk to the table
+
+        Args:
+            df (:obj:`pandas.DataFrame`): the chunk, must have the same columns as the first one
+        """
+        if self.backend == 'parquet':
+            import pyarrow as pa  # pylint: disable=import-outside-toplevel
+            import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+            table = pa.Table.from_pandas(_categorize(df), schema=self._schema, preserve_index=False)
+            if self._writer is None:
+                self._schema = table.schema
+                self._writer = pq.ParquetWriter(self.path, self._schema, compression=STORAGE['compression'])
+            self._writer.write_table(table)
+        else:
+            df.to_csv(self.path, index=False, mode='w' if self._first else 'a', header=self._first)
+        self._first = False
+
+    def close(self) -> None:
+        """Finish writing the table"""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self) -> 'FrameWriter':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def log_io_stats() -> None:
+    """Log the bytes read and the time spent parsing tables per storage backend"""
+    for backend, stats in sorted(IO_STATS.items()):
+        logger.info('%s: read %s files, %.1f MB in %.3fs of parsing.', backend, stats['files'],
+                    stats['bytes'] / 2 ** 20, stats['seconds'])
@@ -6,6 +6,8 @@ import sklearn
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.model_selection import train_test_split
 
+from src.io_util import load_features, save_features
+
 logger = logging.getLogger(__name__)
 
 
@@ -18,16 +20,33 @@ def df_split(feature_path: str, target_path: str, test_size: float, random_state
         random_state (int): seed to reproduce the split
     Returns:
         x_train, x_test, y_train, y_test (:obj:`list`of`pd.DataFrame`/`np.array`):
-            the list containing the x_train, x_test, y_train, y_test.
+            the list containing the x_train, x_test, y_train, y_test. Sparse features are
+            split by row index and stay CSR matrices.
     """
     try:
-        features = np.load(feature_path, allow_pickle=True)
-        target = np.load(target_path, allow_pickle=True)
+        features = load_features(feature_path)
+        target = load_features(target_path)
     except FileNotFoundError as e:
         logger.error('Invalid path when loading the features and target, %s', e)
         raise e
     else:
         logger.info('Successfully loaded the features and target.')
+    return split_arrays(features, target, test_size, random_state)
+
+
+def split_arrays(features, target, test_size: float, random_state: int) -> list:
+    """Split features and target that are already in memory into train and test
+
+    Args:
+        features (:obj:`numpy.ndarray` or :obj:`scipy.sparse.csr_matrix`): the features
+        target (:obj:`numpy.ndarray`): the target
+        test_size (float): proportion of test set relative to the whole dataset
+        random_state (int): seed to reproduce the split
+
+    Returns:
+        x_train, x_test, y_train, y_test (:obj:`list`of`np.array`): the split data, the test
+            parts are None if test_size is 0
+    """
     # return the full features and target as x_train and y_train if test_size == 0
     if test_size == 0:
         return features, None, target, None
@@ -62,13 +81,13 @@ def split_save(feature_path: str,
     else:
         logger.info('Successfully split the data into train and test using df_split().')
     # Assemble the complete path to save all the files
-    x_train_path = train_path + '/x_train.npy'
+    x_train_path = train_path + '/X_train.npy'
     y_train_path = train_path + '/y_train.npy'
-    x_test_path = test_path + '/x_test.npy'
+    x_test_path = test_path + '/X_test.npy'
     y_test_path = test_path + '/y_test.npy'
     try:
-        np.save(x_train_path, x_train)
-        np.save(x_test_path, x_test)
+        save_features(x_train_path, x_train)
+        save_features(x_test_path, x_test)
         np.save(y_train_path, y_train)
         np.save(y_test_path, y_test)
     except FileNotFoundError as e:
@@ -92,8 +111,8 @@ def train_and_save(model: sklearn.base.BaseEstimator,
     """
     # Load the data
     try:
-        x_train = np.load(x_train_path, allow_pickle=True)
-        y_train = np.load(y_train_path, allow_pickle=True)
+        x_train = load_features(x_train_path)
+        y_train = load_features(y_train_path)
     except FileNotFoundError as e:
         logger.error('Invalid path when loading the training data, %s', e)
         raise e
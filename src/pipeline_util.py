@@ -0,0 +1,401 @@
+import hashlib
+import json
+import logging
+import os
+import resource
+import time
+import typing
+
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+
+from src.evaluation_util import evaluation_report
+from src.feature_generation_util import fit_encoder, split_target
+from src.io_util import read_frame, resolve_path, save_features, write_frame
+from src.model_util import split_arrays
+from src.prediction_util import inference_model
+from src.preprocess_util import process_data
+
+logger = logging.getLogger(__name__)
+
+
+def stage_dependencies(step: str, config: dict) -> typing.Optional[dict]:
+    """Get the input files, output files and config sections a pipeline step depends on
+
+    Args:
+        step (str): name of the step in `run.py`
+        config (dict): the model configuration
+
+    Returns:
+        dependencies (dict): `inputs`, `outputs` and `sections` of the step, None for unknown steps
+    """
+    try:
+        if step == 'preprocess':
+            return {'inputs': [config['preprocess']['read_path']],
+                    'outputs': [config['preprocess']['process_param']['save_path']],
+                    'sections': ['preprocess', 'storage']}
+        if step in ('generate_feature', 'featurize'):
+            extract = config['generate_feature']['extract_features']
+            encode = config['generate_feature']['encode']
+            outputs = [extract['save_path'] + '/target.npy', encode['encoded_path'], encode['encoder_path']]
+            if step == 'featurize':
+                return {'inputs': [config['preprocess']['read_path']],
+                        'outputs': outputs,
+                        'sections': ['preprocess', 'generate_feature', 'storage']}
+            return {'inputs': [extract['read_path']],
+                    'outputs': outputs + [extract['save_path'] + '/' + extract.get('features_file', 'features.csv')],
+                    'sections': ['generate_feature', 'storage']}
+        if step == 'train':
+            split = config['split_data']
+            return {'inputs': [split['feature_path'], split['target_path']],
+                    'outputs': [split['train_path'] + '/X_train.npy', split['train_path'] + '/y_train.npy',
+                                split['test_path'] + '/X_test.npy', split['test_path'] + '/y_test.npy',
+                                config['train']['save_path']],
+                    'sections': ['split_data', 'train', 'model']}
+        if step == 'score':
+            return {'inputs': [config['score']['model_path'], config['score']['x_test_path']],
+                    'outputs': [config['score']['save_path']],
+                    'sections': ['score']}
+        if step == 'batch_score':
+            batch = config['batch_score']
+            return {'inputs': [batch['read_path'], batch['model_path'], batch['encoder_path']],
+                    'outputs': [batch['save_path']],
+                    'sections': ['batch_score', 'storage']}
+        if step == 'evaluate':
+            return {'inputs': [config['evaluate']['prediction_path'], config['evaluate']['ytrue_path']],
+                    'outputs': [config['evaluate']['save_path']],
+                    'sections': ['evaluate']}
+    except KeyError as e:
+        logger.error('Key not found.')
+        raise e
+    return None
+
+
+def config_digest(config: dict, sections: list) -> str:
+    """Hash the given sections of the configuration
+
+    Args:
+        config (dict): the model configuration
+        sections (:obj:`list` of `str`): names of the sections to hash, missing sections hash as empty
+
+    Returns:
+        digest (str): sha256 hex digest of the sections
+    """
+    selected = {section: config.get(section) for section in sections}
+    return hashlib.sha256(json.dumps(selected, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def file_digest(path: str, chunk_size: int = 2 ** 20) -> str:
+    """Hash the content of a file
+
+    Args:
+        path (str): path of the file
+        chunk_size (int): number of bytes read at once
+
+    Returns:
+        digest (str): sha256 hex digest of the file
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """Content hashes of the inputs, outputs and configuration of every pipeline step.
+
+    A step is fresh when all of its files and config sections hash the same as when it last
+    succeeded. Files whose size and modification time did not change are not hashed again,
+    and touching a file without changing it does not make a step dirty.
+
+    Args:
+        path (str): path of the json file holding the manifest
+    """
+    def __init__(self, path: str):
+        self.path = path
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                self.entries = json.load(file)
+        except FileNotFoundError:
+            self.entries = {}
+        except json.JSONDecodeError:
+            logger.warning('Manifest %s is corrupted, all steps will run.', path)
+            self.entries = {}
+
+    def _file_state(self, path: str) -> typing.Optional[dict]:
+        """Get the size, modification time and content hash of a file, None if it does not exist"""
+        path = resolve_path(path)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        state = {'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        # Reuse the hash recorded by any step if the file did not change on disk
+        for entry in self.entries.values():
+            for known in entry.get('files', {}).values():
+                if known and all(known.get(key) == state[key] for key in ('path', 'size', 'mtime_ns')):
+                    state['sha256'] = known['sha256']
+                    return state
+        state['sha256'] = file_digest(path)
+        return state
+
+    def _state(self, dependencies: dict, config: dict) -> dict:
+        """Get the current state of everything a step depends on"""
+        return {'config': config_digest(config, dependencies['sections']),
+                'files': {path: self._file_state(path)
+                          for path in dependencies['inputs'] + dependencies['outputs']}}
+
+    def is_fresh(self, step: str, dependencies: dict, config: dict) -> bool:
+        """Check whether a step can be skipped
+
+        Args:
+            step (str): name of the step
+            dependencies (dict): `inputs`, `outputs` and `sections` of the step
+            config (dict): the model configuration
+
+        Returns:
+            fresh (bool): True if nothing the step depends on changed since it last succeeded
+        """
+        entry = self.entries.get(step)
+        if entry is None:
+            return False
+        state = self._state(dependencies, config)
+        if state['config'] != entry['config']:
+            logger.info('Configuration of step %s changed.', step)
+            return False
+        for path, current in state['files'].items():
+            recorded = entry['files'].get(path)
+            if current is None or recorded is None or current['sha256'] != recorded['sha256']:
+                logger.info('File %s of step %s changed.', path, step)
+                return False
+        return True
+
+    def record(self, step: str, dependencies: dict, config: dict) -> None:
+        """Record the state of a step that just succeeded and save the manifest
+
+        Args:
+            step (str): name of the step
+            dependencies (dict): `inputs`, `outputs` and `sections` of the step
+            config (dict): the model configuration
+        """
+        self.entries[step] = self._state(dependencies, config)
+        try:
+            with open(self.path, 'w', encoding='utf-8') as file:
+                json.dump(self.entries, file, indent=2, sort_keys=True)
+        except FileNotFoundError as e:
+            logger.error('Path %s does not exist. Failed to save the manifest.', self.path)
+            raise e
+        else:
+            logger.debug('Recorded step %s in the manifest %s', step, self.path)
+
+
+class Stage(typing.NamedTuple):
+    """A step of the in-process pipeline
+
+    Args:
+        name (str): name of the step
+        run (callable): function of the config and the required artifacts returning the provided artifacts
+        requires (:obj:`tuple` of `str`): names of the artifacts the step reads
+        provides (:obj:`tuple` of `str`): names of the artifacts the step returns
+    """
+    name: str
+    run: typing.Callable
+    requires: tuple
+    provides: tuple
+
+
+def _preprocess(config: dict) -> dict:
+    """Read and clean the raw data"""
+    read_path = config['preprocess']['read_path']
+    process_param = dict(config['preprocess']['process_param'])
+    process_param.pop('save_path')
+    try:
+        raw = read_frame(read_path, index_col=0)
+    except FileNotFoundError as e:
+        logger.error('Could not find data in %s', read_path)
+        raise e
+    return {'clean_data': process_data(raw, **process_param)}
+
+
+def _generate_feature(config: dict, clean_data) -> dict:
+    """Split the target from the clean data and one-hot encode the features"""
+    extract_config = config['generate_feature']['extract_features']
+    encode_config = config['generate_feature']['encode']
+    features, target = split_target(clean_data, extract_config['target_name'], extract_config.get('feature_names'))
+    encoder, encoded = fit_encoder(features, encode_config['features'], encode_config.get('sparse', False))
+    # Cast like save_features() so the later stages see the same values as when reading the file
+    encoded = encoded.astype(encode_config.get('dtype', 'float32'), copy=False)
+    return {'features': features, 'target': target, 'encoded': encoded, 'encoder': encoder}
+
+
+def _train(config: dict, encoded, target) -> dict:
+    """Split the encoded features and train the model"""
+    split_config = config['split_data']
+    x_train, x_test, y_train, y_test = split_arrays(encoded, target, split_config['test_size'],
+                                                    split_config['random_state'])
+    model = RandomForestRegressor(**config['model'])
+    model.fit(x_train, y_train)
+    logger.info('Successfully trained the RandomForest model.')
+    return {'split': (x_train, x_test, y_train, y_test), 'model': model}
+
+
+def _score(config: dict, model, split) -> dict:
+    """Predict the test set"""
+    predictions = inference_model(model, config['score'].get('engine', 'sklearn')).predict(split[1])
+    return {'predictions': predictions}
+
+
+def _evaluate(config: dict, split, predictions) -> dict:  # pylint: disable=unused-argument
+    """Calculate the evaluation metrics of the predictions"""
+    return {'report': evaluation_report(split[3], predictions)}
+
+
+PIPELINE = (
+    Stage('preprocess', _preprocess, (), ('clean_data',)),
+    Stage('generate_feature', _generate_feature, ('clean_data',), ('features', 'target', 'encoded', 'encoder')),
+    Stage('train', _train, ('encoded', 'target'), ('split', 'model')),
+    Stage('score', _score, ('model', 'split'), ('predictions',)),
+    Stage('evaluate', _evaluate, ('split', 'predictions'), ('report',)),
+)
+
+
+def _write_report(report: str, path: str) -> None:
+    """Write the evaluation report"""
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(report)
+
+
+def _write_split(split: tuple, config: dict) -> None:
+    """Write the train and test data where `run.py train` saves them"""
+    x_train, x_test, y_train, y_test = split
+    save_features(config['split_data']['train_path'] + '/X_train.npy', x_train)
+    save_features(config['split_data']['test_path'] + '/X_test.npy', x_test)
+    np.save(config['split_data']['train_path'] + '/y_train.npy', y_train)
+    np.save(config['split_data']['test_path'] + '/y_test.npy', y_test)
+
+
+# Write every artifact to the path its step saves it to when run on its own
+WRITERS = {
+    'clean_data': lambda df, config: write_frame(df, config['preprocess']['process_param']['save_path']),
+    'features': lambda df, config: write_frame(
+        df, config['generate_feature']['extract_features']['save_path'] + '/'
+        + config['generate_feature']['extract_features'].get('features_file', 'features.csv')),
+    'target': lambda target, config: np.save(
+        config['generate_feature']['extract_features']['save_path'] + '/target.npy', target),
+    'encoded': lambda data, config: save_features(config['generate_feature']['encode']['encoded_path'], data),
+    'encoder': lambda encoder, config: joblib.dump(encoder, config['generate_feature']['encode']['encoder_path']),
+    'split': _write_split,
+    'model': lambda model, config: joblib.dump(model, config['train']['save_path']),
+    'predictions': lambda predictions, config: np.save(config['score']['save_path'], predictions),
+    'report': lambda report, config: _write_report(report, config['evaluate']['save_path']),
+}
+
+
+def reset_peak_rss() -> bool:
+    """Reset the peak resident set size of the process, only possible on Linux
+
+    Returns:
+        reset (bool): whether the peak was reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w', encoding='utf-8') as file:
+            file.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def peak_rss() -> int:
+    """Get the peak resident set size of the process in bytes
+
+    Returns:
+        peak (int): the peak since the last `reset_peak_rss()`, or since the process started
+            if it cannot be reset
+    """
+    try:
+        with open('/proc/self/status', 'r', encoding='utf-8') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _schedule(stages: typing.Sequence) -> list:
+    """Order the stages so that every stage runs after the stages providing its artifacts"""
+    ordered, available, pending = [], set(), list(stages)
+    while pending:
+        ready = [stage for stage in pending if available.issuperset(stage.requires)]
+        if not ready:
+            missing = {stage.name: sorted(set(stage.requires) - available) for stage in pending}
+            logger.error('Stages cannot be scheduled, missing artifacts: %s', missing)
+            raise ValueError('Invalid pipeline.')
+        for stage in ready:
+            ordered.append(stage)
+            available.update(stage.provides)
+            pending.remove(stage)
+    return ordered
+
+
+def run_pipeline(config: dict, stages: typing.Sequence = PIPELINE) -> list:
+    """Run the pipeline in this process, handing the artifacts between stages in memory
+
+    Artifacts listed in `persist` of the `pipeline` section of the config are also written
+    to the paths their steps save them to, the others are dropped once no later stage needs them.
+
+    Args:
+        config (dict): the model configuration
+        stages (:obj:`list` of :obj:`Stage`): the stages to run
+
+    Returns:
+        timings (:obj:`list` of `dict`): name, wall time in seconds and peak RSS in bytes of every stage
+    """
+    persist = set(config.get('pipeline', {}).get('persist', []))
+    unknown = persist - set(WRITERS)
+    if unknown:
+        logger.error('Unknown artifacts to persist: %s', sorted(unknown))
+        raise ValueError('Invalid pipeline config.')
+
+    ordered = _schedule(stages)
+    artifacts: dict = {}
+    timings = []
+    for i, stage in enumerate(ordered):
+        can_reset = reset_peak_rss()
+        start = time.perf_counter()
+        try:
+            outputs = stage.run(config, *(artifacts[name] for name in stage.requires))
+            for name in stage.provides:
+                if name in persist:
+                    WRITERS[name](outputs[name], config)
+                    logger.info('Saved the %s of step %s.', name, stage.name)
+        except KeyError as e:
+            logger.error('Key not found in step %s.', stage.name)
+            raise e
+        except FileNotFoundError as e:
+            logger.error('Path does not exist in step %s, %s', stage.name, e)
+            raise e
+        artifacts.update(outputs)
+        # Free the artifacts no remaining stage reads
+        needed = {name for later in ordered[i + 1:] for name in later.requires}
+        for name in list(artifacts):
+            if name not in needed:
+                del artifacts[name]
+        timings.append({'stage': stage.name,
+                        'seconds': time.perf_counter() - start,
+                        'peak_rss': peak_rss(),
+                        'peak_reset': can_reset})
+    return timings
+
+
+def log_timings(timings: list) -> None:
+    """Log the wall time and peak RSS of every stage run by `run_pipeline()`"""
+    logger.info('%-18s %10s %14s', 'stage', 'seconds', 'peak RSS (MB)')
+    for timing in timings:
+        # Without a reset the peak covers everything the process did before the stage too
+        logger.info('%-18s %10.3f %14.1f%s', timing['stage'], timing['seconds'], timing['peak_rss'] / 2 ** 20,
+                    '' if timing['peak_reset'] else ' (process peak)')
+    logger.info('%-18s %10.3f', 'total', sum(timing['seconds'] for timing in timings))
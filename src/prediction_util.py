@@ -1,23 +1,143 @@
+import collections
 import logging
+import multiprocessing
+import time
+import typing
 
 import joblib
 import numpy as np
+import pandas as pd
+
+from src.app_util import time_of_day_array
+from src.inference_util import CompiledEncoder, CompiledForest
+from src.io_util import FrameWriter, iter_frames, load_features
 
 logger = logging.getLogger(__name__)
 
+# Columns of the raw itineraries scored by `batch_score_and_save()`
+RAW_COLUMNS = ['airline', 'depart_time', 'source', 'stops', 'destination', 'class', 'duration', 'days_left']
+# Encoder and model of the batch scoring process, inherited by forked workers
+_SCORER: dict = {}
+# Model, memory-mapped input and output of a sharded scoring worker
+_SHARD: dict = {}
+
+
+def _pool_context():
+    """Get the multiprocessing context of the worker pools, fork where available so workers share memory"""
+    return multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+
+
+def inference_model(model, engine: str = 'sklearn'):
+    """Get the model that makes the predictions with the given engine
+
+    Args:
+        model (:obj:`sklearn.ensemble.RandomForestRegressor`): the trained model
+        engine (str): `sklearn` to predict with the model itself, `compiled` to predict with
+            the trees compiled into flat arrays
+
+    Returns:
+        model: an object with a `predict()` method
+    """
+    if engine == 'compiled':
+        return CompiledForest.from_model(model)
+    if engine != 'sklearn':
+        logger.error('Unknown inference engine `%s`.', engine)
+        raise ValueError('Invalid inference engine.')
+    return model
+
+
+def _init_shard_worker(model_path: str, x_test_path: str, save_path: str, engine: str) -> None:
+    """Load the model once and open the memory-mapped input and output in a sharded scoring worker"""
+    model = joblib.load(model_path)
+    if hasattr(model, 'n_jobs'):
+        # Parallelism comes from the workers
+        model.n_jobs = 1
+    _SHARD['model'] = inference_model(model, engine)
+    _SHARD['x'] = load_features(x_test_path)
+    _SHARD['out'] = np.load(save_path, mmap_mode='r+')
+
+
+def _score_shard(bounds: tuple) -> int:
+    """Predict rows `start:stop` of the input straight into the output, returns the number of rows"""
+    start, stop = bounds
+    _SHARD['out'][start:stop] = _SHARD['model'].predict(_SHARD['x'][start:stop])
+    return stop - start
+
+
+def predict_sharded(model_path: str,
+                    x_test_path: str,
+                    save_path: str,
+                    engine: str = 'sklearn',
+                    n_workers: int = 1,
+                    chunk_rows: int = 100000) -> None:
+    """Make predictions on shards of a test set in parallel workers, writing into a memory-mapped `.npy`
+
+    The test set is memory-mapped and the predictions are written into a preallocated
+    memory-mapped output, so neither is ever held in memory as a whole. Every row is predicted
+    by the same model as `predict_and_save()`, so the saved predictions are identical.
+
+    Args:
+        model_path (str): path to load the model, loaded once per worker
+        x_test_path (str): path to load the test set
+        save_path (str): path to save the predictions
+        engine (str): `sklearn` or `compiled`, see `inference_model()`
+        n_workers (int): number of worker processes, shards are scored in this process if 1
+        chunk_rows (int): number of rows per shard
+    """
+    try:
+        n_rows = load_features(x_test_path).shape[0]
+    except FileNotFoundError as e:
+        logger.error('Path %s does not exist. Failed to load the test data.', x_test_path)
+        raise e
+    try:
+        out = np.lib.format.open_memmap(save_path, mode='w+', dtype=np.float64, shape=(n_rows,))
+    except FileNotFoundError as e:
+        logger.error('Path %s does not exist. Failed to save the predictions.', save_path)
+        raise e
+    del out
+    shards = [(start, min(start + chunk_rows, n_rows)) for start in range(0, n_rows, chunk_rows)]
+    initargs = (model_path, x_test_path, save_path, engine)
+    try:
+        if n_workers <= 1:
+            _init_shard_worker(*initargs)
+            for shard in shards:
+                _score_shard(shard)
+            _SHARD['out'].flush()
+        else:
+            with _pool_context().Pool(n_workers, initializer=_init_shard_worker, initargs=initargs) as pool:
+                for _ in pool.imap_unordered(_score_shard, shards):
+                    pass
+    except ValueError as e:
+        logger.error('x_test does not have correct number of dimensions.')
+        raise e
+    finally:
+        _SHARD.clear()
+    logger.info('Successfully saved the predictions of %s rows in %s shards to %s.', n_rows, len(shards), save_path)
+
 
 def predict_and_save(model_path: str,
                      x_test_path: str,
-                     save_path: str) -> None:
+                     save_path: str,
+                     engine: str = 'sklearn',
+                     n_workers: int = 1,
+                     chunk_rows: typing.Optional[int] = None) -> None:
     """Make predictions on a given test set with a given model, and save the predictions to specified path
 
     Args:
         model_path (str): path to load the model
         x_test_path (str): path to load the test set
         save_path (str): path to save the predictions
+        engine (str): `sklearn` to predict with the model itself, `compiled` to predict with
+            the trees compiled into flat arrays
+        n_workers (int): number of worker processes to score shards of the test set with
+        chunk_rows (int): number of rows per shard, the whole test set is scored at once if
+            not provided and there is a single worker
     """
+    if n_workers > 1 or chunk_rows:
+        predict_sharded(model_path, x_test_path, save_path, engine, n_workers, chunk_rows or 100000)
+        return
     try:
-        x_test = np.load(x_test_path, allow_pickle=True)
+        x_test = load_features(x_test_path)
     except FileNotFoundError as e:
         logger.error('Path %s does not exist. Failed to load the test data.', x_test_path)
         raise e
@@ -30,6 +150,7 @@ def predict_and_save(model_path: str,
         raise e
     else:
         logger.info('Successfully loaded the model from %s', model_path)
+    model = inference_model(model, engine)
 
     try:
         y_pred = model.predict(x_test)
@@ -65,4 +186,148 @@ def score_model(config: dict) -> None:
         logger.error('Invalid path provided in config.')
         raise e
     else:
-        logger.info('Successfully saved the price predictions.')
\ No newline at end of file
+        logger.info('Successfully saved the price predictions.')
+
+
+def model_inputs(df: pd.DataFrame) -> np.ndarray:
+    """Convert raw itineraries into the model input columns used by the app
+
+    Args:
+        df (:obj:`pandas.DataFrame`): itineraries with the columns of `RAW_COLUMNS`
+
+    Returns:
+        rows (:obj:`numpy.ndarray`): airline, source, time of day, stops, destination, class,
+            duration and days left of every itinerary
+    """
+    missing = [column for column in RAW_COLUMNS if column not in df.columns]
+    if missing:
+        logger.error('The itineraries do not contain the columns %s.', missing)
+        raise KeyError('Invalid key for the columns.')
+    text = {column: df[column].astype(str).str.strip().to_numpy()
+            for column in ['airline', 'source', 'depart_time', 'destination', 'class']}
+    try:
+        return np.column_stack([text['airline'], text['source'], time_of_day_array(text['depart_time']),
+                                df['stops'].astype(int).to_numpy(), text['destination'], text['class'],
+                                df['duration'].astype(float).to_numpy(), df['days_left'].astype(int).to_numpy()])
+    except ValueError as e:
+        logger.error('Unable to convert stops, duration or days left to a number. %s', e)
+        raise e
+
+
+def load_scorer(model_path: str,
+                encoder_path: str,
+                engine: str = 'sklearn',
+                n_jobs: typing.Optional[int] = None) -> None:
+    """Load the encoder and model used by `score_itineraries()` into this process
+
+    Args:
+        model_path (str): path to load the model
+        encoder_path (str): path to load the fitted onehot encoder, compiled into lookup tables
+        engine (str): `sklearn` or `compiled`, see `inference_model()`
+        n_jobs (int): number of threads of a sklearn model, kept as trained if None
+    """
+    try:
+        model = joblib.load(model_path)
+        encoder = joblib.load(encoder_path)
+    except FileNotFoundError as e:
+        logger.error('Path does not exist. Failed to load the model or encoder, %s', e)
+        raise e
+    if n_jobs is not None and hasattr(model, 'n_jobs'):
+        model.n_jobs = n_jobs
+    _SCORER['encoder'] = CompiledEncoder.from_transformer(encoder)
+    _SCORER['model'] = inference_model(model, engine)
+
+
+def _init_worker(*args) -> None:
+    """Load the scorer in a worker unless it was inherited from the parent process"""
+    if not _SCORER:
+        load_scorer(*args)
+
+
+def score_itineraries(df: pd.DataFrame) -> np.ndarray:
+    """Predict the price of raw itineraries with the scorer loaded by `load_scorer()`
+
+    Args:
+        df (:obj:`pandas.DataFrame`): itineraries with the columns of `RAW_COLUMNS`
+
+    Returns:
+        price (:obj:`numpy.ndarray`): predicted price of every itinerary
+    """
+    return _SCORER['model'].predict(_SCORER['encoder'].transform(model_inputs(df)))
+
+
+def batch_score_and_save(read_path: str,
+                         save_path: str,
+                         model_path: str,
+                         encoder_path: str,
+                         engine: str = 'sklearn',
+                         chunksize: int = 100000,
+                         n_workers: int = 1) -> dict:
+    """Price a csv or Parquet file of raw itineraries in chunks across a pool of processes
+
+    The model is loaded once before the workers are forked, so they share its memory. At most
+    two chunks per worker are in flight and the chunks are written in input order.
+
+    Args:
+        read_path (str): path of the itineraries, with the columns of `RAW_COLUMNS`
+        save_path (str): path to save the itineraries with a `price` column, Parquet if it ends with `.parquet`
+        model_path (str): path to load the model
+        encoder_path (str): path to load the fitted onehot encoder
+        engine (str): `sklearn` or `compiled`, see `inference_model()`
+        chunksize (int): number of itineraries per chunk
+        n_workers (int): number of worker processes, chunks are scored in this process if 1
+
+    Returns:
+        stats (dict): number of rows, seconds and rows per second
+    """
+    start = time.perf_counter()
+    # Every worker predicts with a single thread
+    load_scorer(model_path, encoder_path, engine, n_jobs=1 if n_workers > 1 else None)
+    n_rows = 0
+    try:
+        chunks = iter_frames(read_path, chunksize)
+        with FrameWriter(save_path) as writer:
+            if n_workers <= 1:
+                for chunk in chunks:
+                    writer.write(chunk.assign(price=score_itineraries(chunk)))
+                    n_rows += len(chunk)
+            else:
+                with _pool_context().Pool(n_workers, initializer=_init_worker,
+                                  initargs=(model_path, encoder_path, engine, 1)) as pool:
+                    pending = collections.deque()
+                    for chunk in chunks:
+                        pending.append((chunk, pool.apply_async(score_itineraries, (chunk,))))
+                        while len(pending) >= 2 * n_workers:
+                            done, result = pending.popleft()
+                            writer.write(done.assign(price=result.get()))
+                            n_rows += len(done)
+                    while pending:
+                        done, result = pending.popleft()
+                        writer.write(done.assign(price=result.get()))
+                        n_rows += len(done)
+    except FileNotFoundError as e:
+        logger.error('Path does not exist, %s', e)
+        raise e
+    finally:
+        _SCORER.clear()
+    seconds = time.perf_counter() - start
+    stats = {'rows': n_rows, 'seconds': seconds, 'rows_per_second': n_rows / seconds if seconds else 0.0}
+    logger.info('Scored %s itineraries in %.2fs, %.0f rows/s with %s workers.',
+                n_rows, seconds, stats['rows_per_second'], n_workers)
+    return stats
+
+
+def batch_score(config: dict) -> None:
+    try:
+        batch_config = config['batch_score']
+    except KeyError as e:
+        logger.error('Key not found.')
+        raise e
+
+    try:
+        batch_score_and_save(**batch_config)
+    except TypeError as e:
+        logger.error('Unexpected keyword argument.')
+        raise e
+    else:
+        logger.info('Successfully saved the prices of the itineraries.')
@@ -1,9 +1,26 @@
 import logging
+
+import numpy as np
 import pandas as pd
 
+from src.io_util import FrameWriter, iter_frames, write_frame
+
 logger = logging.getLogger(__name__)
 
 
+def find_unmapped(values: pd.Series, lookup_map: dict) -> np.ndarray:
+    """Get the unique values that are not keys of the lookup map
+
+    Args:
+        values (:obj: `pandas.Series`): values to be mapped
+        lookup_map (`dict`): dictionary mapping the original value to the modified value
+
+    Returns:
+        unmapped (:obj: `numpy.ndarray`): unique values without a mapping, including missing values
+    """
+    return pd.unique(values[~values.isin(list(lookup_map))])
+
+
 def convert_column(df: pd.DataFrame, col_name: str, lookup_map: dict) -> pd.DataFrame:
     """Return a dataframe with a certain column modified according to the provided dictionary
 
@@ -21,31 +38,28 @@ def convert_column(df: pd.DataFrame, col_name: str, lookup_map: dict) -> pd.Data
         raise KeyError('Invalid column name.')
     # Create a copy of the provided dataframe
     data = df.copy()
-    # Get all unique values in that value
-    col_set = set(data[col_name])
-    # Get all keys in the provided map
-    dict_set = set(lookup_map)
     # Check whether there is unmapped values
-    if not col_set.issubset(dict_set):
+    if len(find_unmapped(data[col_name], lookup_map)):
         logger.warning('The values in %s column is not a subset of the keys in the lookup_map.', col_name)
     # Convert the column
     data[col_name] = data[col_name].map(lookup_map)
     return data
 
 
-def process_and_save(df: pd.DataFrame,
-                     column_to_modify: str,
-                     column_to_drop: list ,
-                     lookup_map: dict,
-                     save_path: str) -> None:
-    """Processed the dataframe by modifying and dropping some columns
+def process_data(df: pd.DataFrame,
+                 column_to_modify: str,
+                 column_to_drop: list,
+                 lookup_map: dict) -> pd.DataFrame:
+    """Process the dataframe by modifying and dropping some columns
 
     Args:
         df (:obj: `pandas.DataFrame`): a provided dataframe to be modified
         column_to_modify (`str`): name of the column to be modified
         column_to_drop (`str`): name of the column to be dropped
         lookup_map (`dict`): dictionary mapping the original value to the modified value
-        save_path (`str`): path to save the processed dataframe
+
+    Returns:
+        processed_df (:obj: `pandas.DataFrame`): the processed dataframe
     """
     # Modify columns
     try:
@@ -63,9 +77,27 @@ def process_and_save(df: pd.DataFrame,
         raise e
     else:
         logger.debug('Successfully dropped the columns: %s', column_to_drop)
+    return processed_df
+
+
+def process_and_save(df: pd.DataFrame,
+                     column_to_modify: str,
+                     column_to_drop: list ,
+                     lookup_map: dict,
+                     save_path: str) -> None:
+    """Processed the dataframe by modifying and dropping some columns
+
+    Args:
+        df (:obj: `pandas.DataFrame`): a provided dataframe to be modified
+        column_to_modify (`str`): name of the column to be modified
+        column_to_drop (`str`): name of the column to be dropped
+        lookup_map (`dict`): dictionary mapping the original value to the modified value
+        save_path (`str`): path to save the processed dataframe
+    """
+    processed_df = process_data(df, column_to_modify, column_to_drop, lookup_map)
     # Save the processed data
     try:
-        processed_df.to_csv(save_path, index=False)
+        write_frame(processed_df, save_path)
     except FileNotFoundError as e:
         logger.error('Path %s does not exist.', save_path)
         raise e
@@ -87,4 +119,96 @@ def preprocess_data(df: pd.DataFrame, config: dict) -> None:
     except Exception as e:
         raise e
     else:
-        logger.info('Successfully saved the cleaned data.')
\ No newline at end of file
+        logger.info('Successfully saved the cleaned data.')
+
+
+def common_dtype(first: np.dtype, second: np.dtype) -> np.dtype:
+    """Get the dtype pandas would infer for a column holding values of both dtypes
+
+    Args:
+        first (:obj: `numpy.dtype`): dtype of the column in one chunk
+        second (:obj: `numpy.dtype`): dtype of the column in another chunk
+
+    Returns:
+        dtype (:obj: `numpy.dtype`): int and float widen to float, anything else mixed is object
+    """
+    if first == second:
+        return first
+    if first.kind in 'iuf' and second.kind in 'iuf':
+        return np.result_type(first, second)
+    return np.dtype(object)
+
+
+def process_and_save_chunked(read_path: str,
+                             chunksize: int,
+                             column_to_modify: str,
+                             column_to_drop: list,
+                             lookup_map: dict,
+                             save_path: str) -> None:
+    """Process the raw data chunk by chunk and append every chunk to the saved file
+
+    A first pass over the chunks collects the unmapped values and the dtype every column
+    would have in the whole dataframe, so that the output is identical to `process_and_save()`
+    on the whole file while only one chunk is held in memory at a time.
+
+    Args:
+        read_path (`str`): path to read the raw data, csv or Parquet
+        chunksize (`int`): number of rows per chunk
+        column_to_modify (`str`): name of the column to be modified
+        column_to_drop (`str`): name of the column to be dropped
+        lookup_map (`dict`): dictionary mapping the original value to the modified value
+        save_path (`str`): path to save the processed dataframe
+    """
+    dtypes = {}
+    unmapped = set()
+    try:
+        for chunk in iter_frames(read_path, chunksize, index_col=0):
+            if column_to_modify not in chunk.columns:
+                logger.error('The provided dataframe does not have column `%s`.', column_to_modify)
+                raise KeyError('Invalid column name.')
+            for name, dtype in chunk.dtypes.items():
+                dtypes[name] = common_dtype(dtypes.get(name, dtype), dtype)
+            unmapped.update(find_unmapped(chunk[column_to_modify], lookup_map).tolist())
+    except FileNotFoundError as e:
+        logger.error('Could not find data in %s', read_path)
+        raise e
+    if unmapped:
+        logger.warning('The values in %s column is not a subset of the keys in the lookup_map.', column_to_modify)
+    # Unmapped values become missing, which turns the whole converted column into float
+    del dtypes[column_to_modify]
+
+    n_rows = 0
+    try:
+        with FrameWriter(save_path) as writer:
+            for chunk in iter_frames(read_path, chunksize, index_col=0):
+                chunk = chunk.astype(dtypes)
+                chunk[column_to_modify] = chunk[column_to_modify].map(lookup_map)
+                if unmapped:
+                    chunk[column_to_modify] = chunk[column_to_modify].astype(float)
+                try:
+                    chunk = chunk.drop(column_to_drop, axis=1)
+                except KeyError as e:
+                    logger.error('Dataframe does not contain a provided column, `%s`.', e)
+                    raise e
+                writer.write(chunk)
+                n_rows += len(chunk)
+                logger.debug('Processed %s rows.', n_rows)
+    except FileNotFoundError as e:
+        logger.error('Path %s does not exist.', save_path)
+        raise e
+    logger.info('Successfully saved the processed data to %s', save_path)
+
+
+def preprocess_data_chunked(read_path: str, chunksize: int, config: dict) -> None:
+    try:
+        process_param = config['preprocess']['process_param']
+    except KeyError as e:
+        logger.error('Key not found.')
+        raise e
+    try:
+        process_and_save_chunked(read_path, chunksize, **process_param)
+    except TypeError as e:
+        logger.error('Unexpected keyword argument.')
+        raise e
+    else:
+        logger.info('Successfully saved the cleaned data.')
@@ -1,9 +1,16 @@
 """Interaction with rds"""
+import atexit
+import datetime
+import itertools
 import logging.config
+import queue
+import threading
+import time
 import typing
-from random import randint
+import uuid
 
 import flask
+import numpy as np
 import sqlalchemy
 import sqlalchemy.orm
 from flask_sqlalchemy import SQLAlchemy
@@ -47,6 +54,8 @@ class ModelOutputs(Base):
     """Creates a data model for the database to be set up for capturing model outputs.
     """
     __tablename__ = 'model_outputs'
+    # The prediction page reads the outputs of one record ordered by days left
+    __table_args__ = (sqlalchemy.Index('ix_model_outputs_record_id_days_left', 'record_id', 'days_left'),)
 
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
 
@@ -60,6 +69,199 @@ class ModelOutputs(Base):
         return f'<Model_output {self.id}>'
 
 
+class PriceCurves(Base):
+    """Creates a data model for storing the model outputs of a record as one packed price curve."""
+    __tablename__ = 'price_curves'
+
+    record_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("user_records.id"), primary_key=True)
+    horizon = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+    # Little-endian float32 price of every day left counting up from 0
+    prices = sqlalchemy.Column(sqlalchemy.LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return f'<Price_curve {self.record_id}>'
+
+
+class IdAllocations(Base):
+    """Creates a data model for the next free id of every table whose ids are allocated by :obj:`IdAllocator`."""
+    __tablename__ = 'id_allocator'
+
+    name = sqlalchemy.Column(sqlalchemy.String(100), primary_key=True)
+    next_id = sqlalchemy.Column(sqlalchemy.BigInteger, nullable=False)
+
+    def __repr__(self):
+        return f'<Id_allocation {self.name}>'
+
+
+class DatabaseInfo(Base):
+    """Creates a data model for the identity of the database, a single row written when it is created."""
+    __tablename__ = 'database_info'
+
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    # Random token telling databases apart, also a database recreated at the same URI
+    token = sqlalchemy.Column(sqlalchemy.String(32), nullable=False)
+    created_at = sqlalchemy.Column(sqlalchemy.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<Database_info {self.token}>'
+
+
+class IdAllocator:
+    """Hands out unique ids of a table from blocks reserved in the database.
+
+    A block is reserved by a single `UPDATE ... SET next_id = next_id + block_size`, which the
+    database serializes, so processes sharing the database never get the same id. Ids are then
+    handed out from the block in memory, so allocating costs one round-trip per block. Ids left
+    in a block when the process exits are never used.
+
+    Args:
+        engine (:obj:`sqlalchemy.engine.Engine`): engine of the database
+        name (str): name of the table the ids are allocated for
+        block_size (int): number of ids reserved at once
+    """
+    def __init__(self, engine: sqlalchemy.engine.Engine, name: str = 'user_records', block_size: int = 100):
+        if block_size < 1:
+            raise ValueError('block_size must be positive.')
+        self.engine = engine
+        self.name = name
+        self.block_size = block_size
+        self.reservations = 0
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> None:
+        """Reserve the next block of ids, must be called with the lock held"""
+        table = IdAllocations.__table__
+        for attempt in range(2):
+            try:
+                with self.engine.begin() as connection:
+                    result = connection.execute(table.update()
+                                                .where(table.c.name == self.name)
+                                                .values(next_id=table.c.next_id + self.block_size))
+                    if result.rowcount == 0:
+                        # Databases created before the allocator existed start after their largest id
+                        seed_id_allocator(connection, self.name)
+                        connection.execute(table.update()
+                                           .where(table.c.name == self.name)
+                                           .values(next_id=table.c.next_id + self.block_size))
+                    end = connection.execute(select(table.c.next_id).where(table.c.name == self.name)).scalar()
+            except sqlalchemy.exc.IntegrityError as e:
+                # Another process seeded the row first, the transaction is rolled back and the
+                # reservation retried on its row
+                if attempt == 0:
+                    logger.info('The id allocation of %s was seeded concurrently, retrying.', self.name)
+                    continue
+                logger.error('Unable to reserve ids of %s.', self.name)
+                raise e
+            except sqlalchemy.exc.SQLAlchemyError as e:
+                logger.error('Unable to reserve ids of %s. Run create_db() if the id_allocator table is missing.',
+                             self.name)
+                raise e
+            break
+        self._next, self._end = end - self.block_size, end
+        self.reservations += 1
+        logger.debug('Reserved ids %s to %s of %s.', self._next, end - 1, self.name)
+
+    def allocate(self) -> int:
+        """Get an id that was never handed out before
+
+        Returns:
+            _id (int): the id
+        """
+        with self._lock:
+            if self._next >= self._end:
+                self._reserve()
+            _id = self._next
+            self._next += 1
+        return _id
+
+
+def seed_id_allocator(connection, name: str = 'user_records') -> None:
+    """Start the id allocation of a table after its largest id, unless it is already seeded
+
+    Args:
+        connection (:obj:`sqlalchemy.engine.Connection`): connection in a transaction
+        name (str): name of the table
+    """
+    table = IdAllocations.__table__
+    if connection.execute(select(table.c.next_id).where(table.c.name == name)).first() is None:
+        max_id = connection.execute(select(sqlalchemy.func.max(Base.metadata.tables[name].c.id))).scalar()
+        connection.execute(table.insert(), {'name': name, 'next_id': (max_id or 0) + 1})
+        logger.info('Seeded the id allocation of %s from id %s.', name, (max_id or 0) + 1)
+
+
+def ensure_id_allocator(engine: sqlalchemy.engine.Engine, name: str = 'user_records') -> None:
+    """Seed the id allocation of a table in its own transaction, tolerating a concurrent seed
+
+    Args:
+        engine (:obj:`sqlalchemy.engine.Engine`): engine of the database
+        name (str): name of the table
+    """
+    try:
+        with engine.begin() as connection:
+            seed_id_allocator(connection, name)
+    except sqlalchemy.exc.IntegrityError:
+        # Another process inserted the row between the read and the insert, which is just as good
+        logger.info('The id allocation of %s was seeded concurrently.', name)
+
+
+def ensure_database_info(engine: sqlalchemy.engine.Engine) -> None:
+    """Write the token and creation time of the database unless written already, tolerating a concurrent write
+
+    Args:
+        engine (:obj:`sqlalchemy.engine.Engine`): engine of the database
+    """
+    table = DatabaseInfo.__table__
+    try:
+        with engine.begin() as connection:
+            if connection.execute(select(table.c.id)).first() is None:
+                # Whole seconds, like the HTTP dates the creation time is compared with
+                connection.execute(table.insert(), {'id': 1, 'token': uuid.uuid4().hex,
+                                                    'created_at': datetime.datetime.utcnow().replace(microsecond=0)})
+    except sqlalchemy.exc.IntegrityError:
+        # Another process wrote the row between the read and the insert, which is just as good
+        logger.info('The database info was written concurrently.')
+
+
+def apply_sqlite_pragmas(engine: sqlalchemy.engine.Engine, pragmas: typing.Optional[dict]) -> None:
+    """Set the pragmas on every new connection of a SQLite engine, other databases are left as is
+
+    Args:
+        engine (:obj:`sqlalchemy.engine.Engine`): engine of the database
+        pragmas (dict): value of every pragma, such as `{'journal_mode': 'WAL'}`, nothing is set if None
+    """
+    if not pragmas or engine.dialect.name != 'sqlite':
+        return
+
+    @sqlalchemy.event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+    logger.debug('SQLite connections are opened with %s', pragmas)
+
+
+class PendingOutput(typing.NamedTuple):
+    """A model output queued in write-behind mode, read like a :obj:`ModelOutputs` row"""
+    days_left: int
+    price: float
+
+
+class QueuedRecords(typing.NamedTuple):
+    """User records and model outputs queued together in write-behind mode, written in the same transaction"""
+    user_ids: tuple
+    output_ids: tuple
+    users: list
+    outputs: list
+
+
+# Longest wait in seconds between two attempts of the writer to reach an unavailable database
+WRITER_MAX_BACKOFF = 5.0
+
+
 class RecordManager:
     """Creates a SQLAlchemy connection to the flight_db database.
 
@@ -68,32 +270,397 @@ class RecordManager:
             within a Flask app. Optional.
         engine_string (str): SQLAlchemy engine string specifying which database
             to write to. Follows the format
+        write_behind (bool): queue the user records and model outputs and write them in
+            batches from a background thread instead of committing them right away
+        queue_size (int): maximum number of queued records in write-behind mode
+        batch_size (int): maximum number of queued records written in one transaction
+        flush_interval (float): seconds the writer waits for more records to group in a transaction
+        put_timeout (float): seconds to wait for room in a full queue before raising
+            `queue.Full`, wait forever if None
+        id_block_size (int): number of user record ids reserved from the database at once
+        output_storage (str): `rows` to store the model outputs one row per day in model_outputs,
+            `packed` to store them one curve per record in price_curves
+        engine_options (dict): keyword arguments of `sqlalchemy.create_engine` when connecting with
+            an engine string, such as the pool settings. A Flask app takes them from its
+            `SQLALCHEMY_ENGINE_OPTIONS` config
+        retries (int): number of times a statement failing with a transient `OperationalError`,
+            such as a dropped connection, is retried
+        retry_backoff (float): seconds to wait before the first retry, doubled on every retry
+        sqlite_pragmas (dict): pragmas set on every new connection to a SQLite database, such as
+            `{'journal_mode': 'WAL', 'busy_timeout': 5000}`
     """
     def __init__(self, app: typing.Optional[flask.app.Flask] = None,
-                 engine_string: typing.Optional[str] = None):
+                 engine_string: typing.Optional[str] = None,
+                 write_behind: bool = False,
+                 queue_size: int = 10000,
+                 batch_size: int = 200,
+                 flush_interval: float = 0.2,
+                 put_timeout: typing.Optional[float] = 5.0,
+                 id_block_size: int = 100,
+                 output_storage: str = 'rows',
+                 engine_options: typing.Optional[dict] = None,
+                 retries: int = 3,
+                 retry_backoff: float = 0.1,
+                 sqlite_pragmas: typing.Optional[dict] = None):
+        if output_storage not in ('rows', 'packed'):
+            logger.error('Unknown output storage %s, use `rows` or `packed`.', output_storage)
+            raise ValueError('Unknown output storage.')
+        # Both sessions are scoped, every thread (and request of the Flask app) gets its own
         if app:
             self.database = SQLAlchemy(app)
             self.session = self.database.session
+            self.engine = self.database.engine
         elif engine_string:
-            engine = sqlalchemy.create_engine(engine_string)
-            session_maker = sqlalchemy.orm.sessionmaker(bind=engine)
-            self.session = session_maker()
+            self.engine = sqlalchemy.create_engine(engine_string, **(engine_options or {}))
+            session_maker = sqlalchemy.orm.sessionmaker(bind=self.engine)
+            self.session = sqlalchemy.orm.scoped_session(session_maker)
         else:
             raise ValueError(
                 "Need either an engine string or a Flask app to initialize")
+        apply_sqlite_pragmas(self.engine, sqlite_pragmas)
+
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.id_allocator = IdAllocator(self.engine, 'user_records', id_block_size)
+        self._database_info: typing.Optional[tuple] = None
+        self.output_storage = output_storage
+        if output_storage == 'packed':
+            self._output_table, self._output_rows = PriceCurves.__table__, curve_rows
+        else:
+            self._output_table, self._output_rows = ModelOutputs.__table__, output_rows
+
+        # Write-behind mode: records are queued and written in batches by a background thread
+        self.write_behind = write_behind
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.counters = {'queued': 0, 'rejected': 0, 'written_records': 0, 'written_outputs': 0,
+                         'batches': 0, 'failed_batches': 0, 'dropped_records': 0, 'max_queue_depth': 0}
+        # Counters are updated by the request threads and the writer
+        self._counters_lock = threading.Lock()
+        self._pending_users: set = set()
+        self._pending_outputs: dict = {}
+        self._pending_lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._writer = None
+        self._closing = False
+        if write_behind:
+            self._writer = threading.Thread(target=self._write_loop, name='record-writer', daemon=True)
+            self._writer.start()
+            atexit.register(self.close)
 
     def close(self) -> None:
-        """Closes SQLAlchemy session
+        """Flush the queued records and closes SQLAlchemy session
 
         Returns: None
         """
-        self.session.close()
+        if self._writer is not None:
+            # Wakes the writer up, which writes everything queued before exiting
+            self._closing = True
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+        self.session.remove()
+
+    def _retry(self, work: typing.Callable, action: str, commit: bool = False):
+        """Run `work(session)` in the session of the thread, retrying transient errors with backoff
+
+        Only failures before the commit are retried. A failed commit may still have been applied,
+        e.g. if the connection dropped before the reply, so it is rolled back and raised instead
+        of writing the rows a second time.
+
+        Args:
+            work (callable): statements to run given the session, without committing
+            action (str): what the statements do, for logging
+            commit (bool): whether to commit the statements once they ran
+
+        Returns:
+            result: what `work` returns
+        """
+        for attempt in range(self.retries + 1):
+            session = self.session
+            try:
+                result = work(session)
+            except sqlalchemy.exc.OperationalError as e:
+                session.rollback()
+                if attempt == self.retries:
+                    raise e
+                delay = self.retry_backoff * 2 ** attempt
+                logger.warning('Unable to %s, attempt %s, retrying in %.2f seconds. %s', action, attempt + 1, delay, e)
+                time.sleep(delay)
+                continue
+            except sqlalchemy.exc.SQLAlchemyError as e:
+                session.rollback()
+                raise e
+            if commit:
+                try:
+                    session.commit()
+                except sqlalchemy.exc.SQLAlchemyError as e:
+                    session.rollback()
+                    raise e
+            return result
+        return None
+
+    def _enqueue(self, item: QueuedRecords) -> None:
+        """Queue records for the writer, blocking up to `put_timeout` seconds if the queue is full"""
+        try:
+            self._queue.put(item, timeout=self.put_timeout)
+        except queue.Full as e:
+            with self._counters_lock:
+                self.counters['rejected'] += 1
+            logger.error('The record queue is full, the database is not keeping up.')
+            raise e
+        with self._counters_lock:
+            self.counters['queued'] += 1
+            self.counters['max_queue_depth'] = max(self.counters['max_queue_depth'], self._queue.qsize())
+
+    def _forget(self, item: QueuedRecords) -> None:
+        """Remove queued records from the pending records, once written or dropped"""
+        with self._pending_lock:
+            self._pending_users.difference_update(item.user_ids)
+            for record_id in item.output_ids:
+                self._pending_outputs.pop(record_id, None)
+
+    def _write_loop(self) -> None:
+        """Write the queued records in grouped transactions until `close()` queues None"""
+        while True:
+            batch = [self._queue.get()]
+            # Wait up to the flush interval for more records to group with the first one
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            records = [item for item in batch if item is not None]
+            if records:
+                self._write_batch(records)
+            for _ in batch:
+                self._queue.task_done()
+            if batch[-1] is None:
+                return
+
+    def _written(self, connection, users: list, outputs: list) -> bool:
+        """Check whether the records of a transaction whose commit failed were written"""
+        if users:
+            column, record_id = UserRecords.__table__.c.id, users[0]['id']
+        elif outputs:
+            column, record_id = self._output_table.c.record_id, outputs[0]['record_id']
+        else:
+            return True
+        return connection.execute(select(column).where(column == record_id).limit(1)).first() is not None
+
+    def _insert(self, items: list) -> typing.Optional[Exception]:
+        """Insert queued user records and model outputs in one transaction
+
+        Operational errors, such as a lost connection or a failover, are retried with a growing
+        backoff of at most `WRITER_MAX_BACKOFF` seconds until the database is back, while the full
+        queue holds new records back. Once closing, they are only retried `retries` times. If the commit
+        itself failed, the records are looked up before writing them again, as the commit may have
+        been applied.
+
+        Args:
+            items (:obj:`list` of :obj:`QueuedRecords`): queued records
+
+        Returns:
+            error (Exception): the error the transaction failed with, None if the records were written
+        """
+        users = [row for item in items for row in item.users]
+        outputs = [row for item in items for row in item.outputs]
+        committing, attempt = False, 0
+        while True:
+            try:
+                with self.engine.connect() as connection:
+                    if not (committing and self._written(connection, users, outputs)):
+                        committing = False
+                        with connection.begin():
+                            # Users first, the outputs reference them
+                            if users:
+                                connection.execute(UserRecords.__table__.insert(), users)
+                            if outputs:
+                                connection.execute(self._output_table.insert(), outputs)
+                            committing = True
+            except sqlalchemy.exc.OperationalError as e:
+                if self._closing and attempt >= self.retries:
+                    return e
+                delay = min(self.retry_backoff * 2 ** attempt, WRITER_MAX_BACKOFF)
+                logger.warning('Unable to write %s queued records, attempt %s, retrying in %.2f seconds. %s',
+                               len(items), attempt + 1, delay, e)
+                time.sleep(delay)
+                attempt += 1
+            except sqlalchemy.exc.SQLAlchemyError as e:
+                return e
+            else:
+                with self._counters_lock:
+                    self.counters['written_records'] += len(users)
+                    self.counters['written_outputs'] += len(outputs)
+                return None
+
+    def _write_batch(self, batch: list) -> None:
+        """Insert a batch of queued records in one transaction, one request at a time if it fails"""
+        error = self._insert(batch)
+        if error is None:
+            with self._counters_lock:
+                self.counters['batches'] += 1
+        elif isinstance(error, sqlalchemy.exc.OperationalError):
+            # Only given up on when closing
+            record_ids = sorted({record_id for item in batch for record_id in item.user_ids + item.output_ids})
+            with self._counters_lock:
+                self.counters['failed_batches'] += 1
+                self.counters['dropped_records'] += len(record_ids)
+            logger.error('Dropped the queued records %s, the database is unavailable. %s', record_ids, error)
+        else:
+            # A bad record fails the whole transaction, write the records of every request
+            # separately so only the bad one is dropped
+            logger.warning('Unable to write %s queued records, writing them one request at a time. %s',
+                           len(batch), error)
+            with self._counters_lock:
+                self.counters['failed_batches'] += 1
+            requests: dict = {}
+            for item in batch:
+                requests.setdefault(tuple(sorted(set(item.user_ids + item.output_ids))), []).append(item)
+            for record_ids, items in requests.items():
+                request_error = self._insert(items)
+                if request_error is not None:
+                    with self._counters_lock:
+                        self.counters['dropped_records'] += len(record_ids)
+                    logger.error('Dropped the queued user records and model outputs of ids %s. %s',
+                                 list(record_ids), request_error)
+        # Only forget the records once they can be read from the database
+        for item in batch:
+            self._forget(item)
+
+    def flush(self) -> None:
+        """Block until every queued record has been written"""
+        if self._writer is not None:
+            self._queue.join()
+
+    def pending_outputs(self, record_id: int) -> typing.Optional[list]:
+        """Get the model outputs of a record that is queued but not written yet
+
+        Args:
+            record_id (int): the record_id of the user record
+
+        Returns:
+            outputs (:obj:`list` of :obj:`PendingOutput`): days left and price of every output,
+                None if the record is not pending
+        """
+        with self._pending_lock:
+            prices = self._pending_outputs.get(record_id)
+        if prices is None:
+            return None
+        return [PendingOutput(day, price) for day, price in enumerate(prices)]
+
+    def get_outputs(self, record_id: int) -> tuple:
+        """Get the model outputs of a record ordered by days left, pending outputs included
+
+        Args:
+            record_id (int): the record_id of the user record
+
+        Returns:
+            days (:obj:`numpy.ndarray`): days left of every output
+            prices (:obj:`numpy.ndarray`): predicted price of every output
+        """
+        with self._pending_lock:
+            prices = self._pending_outputs.get(record_id)
+        if prices is not None:
+            return np.arange(len(prices)), np.asarray(prices)
+        if self.output_storage == 'packed':
+            prices = self.get_curve(record_id)
+            # Records saved before switching to packed storage are still read from model_outputs
+            if prices is not None:
+                # The shortest repr of every float32 price, so 5432.1 is read back as 5432.1
+                # and not as 5432.10009765625
+                return np.arange(len(prices)), prices.astype(str).astype(np.float64)
+
+        table = ModelOutputs.__table__
+        query = (select(table.c.days_left, table.c.price)
+                 .where(table.c.record_id == record_id)
+                 .order_by(table.c.days_left))
+        try:
+            rows = self._retry(lambda session: session.execute(query).fetchall(),
+                               'get outputs from model_outputs table')
+        except sqlalchemy.exc.OperationalError as e:
+            logger.error('Unable to get outputs from model_outputs table. Check network.')
+            raise e
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            logger.error('Unable to get outputs from model_outputs table')
+            raise e
+
+        days = np.array([row[0] for row in rows], dtype=np.int64)
+        prices = np.array([row[1] for row in rows])
+        return days, prices
+
+    def get_curve(self, record_id: int) -> typing.Optional[np.ndarray]:
+        """Get the packed price curve of a record from the price_curves table
+
+        Args:
+            record_id (int): the record_id of the user record
+
+        Returns:
+            prices (:obj:`numpy.ndarray`): predicted price of every day left counting up from 0,
+                None if the record has no curve
+        """
+        table = PriceCurves.__table__
+        try:
+            row = self._retry(lambda session: session.execute(select(table.c.horizon, table.c.prices)
+                                                              .where(table.c.record_id == record_id)).first(),
+                              'get the price curve from price_curves table')
+        except sqlalchemy.exc.OperationalError as e:
+            logger.error('Unable to get the price curve from price_curves table. Check network.')
+            raise e
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            logger.error('Unable to get the price curve from price_curves table')
+            raise e
+        if row is None:
+            return None
+        return unpack_curve(row[1], row[0])
+
+    def database_info(self) -> tuple:
+        """Get the token and creation time of the database, written on first use for older databases
+
+        Returns:
+            token (str): random token of the database
+            created_at (:obj:`datetime.datetime`): UTC time the database was created
+        """
+        if self._database_info is not None:
+            return self._database_info
+        table = DatabaseInfo.__table__
+        query = select(table.c.token, table.c.created_at).where(table.c.id == 1)
+        try:
+            row = self._retry(lambda session: session.execute(query).first(), 'get the database info')
+            if row is None:
+                ensure_database_info(self.engine)
+                row = self._retry(lambda session: session.execute(query).first(), 'get the database info')
+        except sqlalchemy.exc.OperationalError as e:
+            logger.error('Unable to get the database info. Run migrate_db() if the database_info table is missing.')
+            raise e
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            logger.error('Unable to get the database info.')
+            raise e
+        # The row never changes once written
+        self._database_info = (row[0], row[1])
+        return self._database_info
+
+    def stats(self) -> dict:
+        """Get the counters of the write-behind queue
+
+        Returns:
+            stats (dict): queue depth, number of pending user records and outputs, and the number of
+                queued, rejected and written records
+        """
+        with self._pending_lock:
+            pending_users, pending_outputs = len(self._pending_users), len(self._pending_outputs)
+        with self._counters_lock:
+            counters = dict(self.counters)
+        return dict(counters, enabled=self.write_behind, queue_depth=self._queue.qsize(),
+                    pending_users=pending_users, pending_outputs=pending_outputs)
 
     def get_ids(self):
         """Get all primary keys of the user_record table"""
-        session = self.session
         try:
-            result = session.execute(select(UserRecords.id)).fetchall()
+            result = self._retry(lambda session: session.execute(select(UserRecords.id)).fetchall(),
+                                 'get ids from user_records table')
         except sqlalchemy.exc.OperationalError as e:
             logger.error('Unable to get ids from user_records table. Check network.')
             raise e
@@ -105,19 +672,14 @@ class RecordManager:
         return ids
 
     def unique_id(self):
-        """Generate an id that does not exist in the user_record table
+        """Get an id that is not used in the user_record table and never handed out before
 
         Returns:
             record_id (int): a unique record_id not used yet
         """
-        existing_ids = self.get_ids()
-        record_id = randint(1, 10000)
-        while record_id in existing_ids:
-            record_id = randint(1, 10000)
-        return record_id
+        return self.id_allocator.allocate()
 
     def add_user(self,
-                 _id: int,
                  airline: str,
                  depart_time: str,
                  source: str,
@@ -127,11 +689,10 @@ class RecordManager:
                  duration: int,
                  days_left: int,
                  cur_price: int
-                 ) -> None:
-        """Adds user record to the user_record table.
+                 ) -> int:
+        """Adds user record to the user_record table under a new id, queued for the writer in write-behind mode.
 
         Args:
-            _id (int): primary key in the table
             airline (str): airline name
             depart_time (str): time of departure
             source (str): departure city name
@@ -142,23 +703,37 @@ class RecordManager:
             days_left (int): days before departure
             cur_price (int): price in Indian rupee
         Returns:
-            None
+            _id (int): primary key of the record, allocated with :obj:`unique_id`
         """
+        _id = self.unique_id()
+
+        if self.write_behind:
+            item = QueuedRecords((_id,), (), [user_row(_id, airline, depart_time, source, destination, stops,
+                                                       flight_class, duration, days_left, cur_price)], [])
+            with self._pending_lock:
+                self._pending_users.add(_id)
+            try:
+                self._enqueue(item)
+            except queue.Full as e:
+                self._forget(item)
+                raise e
+            return _id
+
+        def insert(session):
+            user_record = UserRecords(id=_id,
+                                      airline=airline,
+                                      departure_time=depart_time,
+                                      source_city=source,
+                                      destination=destination,
+                                      stops=stops,
+                                      flight_class=flight_class,
+                                      duration=duration,
+                                      days_left=days_left,
+                                      cur_price=cur_price)
+            session.add(user_record)
 
-        session = self.session
-        user_record = UserRecords(id=_id,
-                                  airline=airline,
-                                  departure_time=depart_time,
-                                  source_city=source,
-                                  destination=destination,
-                                  stops=stops,
-                                  flight_class=flight_class,
-                                  duration=duration,
-                                  days_left=days_left,
-                                  cur_price=cur_price)
-        session.add(user_record)
         try:
-            session.commit()
+            self._retry(insert, 'add user record to user_records table', commit=True)
         except sqlalchemy.exc.OperationalError as e:
             logger.error('Unable to add user record to user_records table. Check network.')
             raise e
@@ -167,6 +742,7 @@ class RecordManager:
             raise e
         else:
             logger.info(f'One user record with price {cur_price} added to database.')
+        return _id
 
     def add_output(self,
                    record_id: int,
@@ -179,13 +755,11 @@ class RecordManager:
             days_left (int): days left before departure
             price (int): predicted price of the flight
         """
-        session = self.session
-        model_output = ModelOutputs(record_id=record_id,
-                                    days_left=days_left,
-                                    price=price)
-        session.add(model_output)
+        def insert(session):
+            session.add(ModelOutputs(record_id=record_id, days_left=days_left, price=price))
+
         try:
-            session.commit()
+            self._retry(insert, 'add model output to model_outputs table', commit=True)
         except sqlalchemy.exc.OperationalError as e:
             logger.error('Unable to add model output to model_outputs table. Check network.')
             raise e
@@ -199,44 +773,301 @@ class RecordManager:
                        record_id: int,
                        days_left: int,
                        price_list: list):
-        """Add predicted prices of a flight from current day to last day
+        """Add predicted prices of a flight from current day to last day, queued in write-behind mode
 
         Args:
             record_id (int): the record_id associated to the user record
             days_left (int): days left before departure
             price_list (`list` of `int`): list of predicted price for all days up to the departure day
         """
-        # Get the db session
-        session = self.session
-        for day in range(days_left):
-            model_output = ModelOutputs(record_id=record_id,
-                                        days_left=day,
-                                        price=price_list[day])
-            session.add(model_output)
+        if len(price_list) < days_left:
+            logger.error('Only %s predicted prices for %s days left.', len(price_list), days_left)
+            raise IndexError('Not enough predicted prices.')
+        self.add_outputs([(record_id, price_list[:days_left])])
+
+    def add_outputs(self, outputs: list) -> None:
+        """Add the predicted prices of many records with a single bulk insert, queued in write-behind mode
+
+        The prices are stored one row per day in model_outputs, or one packed curve per record in
+        price_curves if `output_storage` is `packed`.
+
+        Args:
+            outputs (:obj:`list` of `tuple`): record_id and array of predicted prices, one per day
+                left counting up from 0, of every record
+        """
+        if self.write_behind:
+            item = QueuedRecords((), tuple(record_id for record_id, _ in outputs), [],
+                                 [row for record_id, prices in outputs for row in self._output_rows(record_id, prices)])
+            with self._pending_lock:
+                for record_id, prices in outputs:
+                    self._pending_outputs[record_id] = prices
+            try:
+                self._enqueue(item)
+            except queue.Full as e:
+                self._forget(item)
+                raise e
+            return
+
+        rows = [row for record_id, prices in outputs for row in self._output_rows(record_id, prices)]
+        if not rows:
+            return
+        table = self._output_table
+
+        def insert(session):
+            # One executemany of plain rows instead of an ORM object per row
+            session.execute(table.insert(), rows)
+
         try:
-            session.commit()
+            self._retry(insert, f'add model outputs to {table.name} table', commit=True)
         except sqlalchemy.exc.OperationalError as e:
-            logger.error('Unable to add all model outputs to model_outputs table')
+            logger.error('Unable to add all model outputs to %s table', table.name)
             raise e
         except sqlalchemy.exc.SQLAlchemyError as e:
-            logger.error('Unable to add model outputs to model_outputs table')
+            logger.error('Unable to add model outputs to %s table', table.name)
             raise e
         else:
-            logger.info(f'All model outputs of {record_id} added to database.')
+            logger.info('%s model outputs of %s records added to %s.', len(rows), len(outputs), table.name)
+
+    def add_users_with_outputs(self, records: list) -> list:
+        """Add the user records and predicted prices of many itineraries in a single transaction
+
+        Either all records are written or none, so a failed request can be retried without
+        duplicates. In write-behind mode the records are queued as one item, which the writer
+        writes in one transaction, and nothing is queued if the queue stays full.
+
+        Args:
+            records (:obj:`list` of `tuple`): the fields of :obj:`add_user` as a dict and the array
+                of predicted prices of every itinerary
+
+        Returns:
+            record_ids (:obj:`list` of `int`): primary keys of the records, allocated with :obj:`unique_id`
+        """
+        record_ids = [self.unique_id() for _ in records]
+        user_rows = [user_row(record_id, **user) for record_id, (user, _) in zip(record_ids, records)]
+        rows = [row for record_id, (_, prices) in zip(record_ids, records)
+                for row in self._output_rows(record_id, prices)]
+        if self.write_behind:
+            item = QueuedRecords(tuple(record_ids), tuple(record_ids), user_rows, rows)
+            with self._pending_lock:
+                self._pending_users.update(record_ids)
+                for record_id, (_, prices) in zip(record_ids, records):
+                    self._pending_outputs[record_id] = prices
+            try:
+                self._enqueue(item)
+            except queue.Full as e:
+                self._forget(item)
+                raise e
+            return record_ids
+
+        def insert(session):
+            # Users first, the outputs reference them
+            if user_rows:
+                session.execute(UserRecords.__table__.insert(), user_rows)
+            if rows:
+                session.execute(self._output_table.insert(), rows)
+
+        try:
+            self._retry(insert, 'add user records and model outputs to the database', commit=True)
+        except sqlalchemy.exc.OperationalError as e:
+            logger.error('Unable to add user records and model outputs to the database. Check network.')
+            raise e
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            logger.error('Unable to add user records and model outputs to the database.')
+            raise e
+        else:
+            logger.info('%s user records and %s model outputs added to database.', len(user_rows), len(rows))
+        return record_ids
+
+
+def user_row(_id: int,
+             airline: str,
+             depart_time: str,
+             source: str,
+             destination: str,
+             stops: int,
+             flight_class: str,
+             duration: int,
+             days_left: int,
+             cur_price: int) -> dict:
+    """Build the row of the user_records table of a record for a bulk insert
+
+    Args:
+        _id (int): primary key in the table
+        airline (str): airline name
+        depart_time (str): time of departure
+        source (str): departure city name
+        destination (str): destination city name
+        stops (int): number of stops
+        flight_class (str): flight class, economy or business
+        duration (int): duration of flight in hours
+        days_left (int): days before departure
+        cur_price (int): price in Indian rupee
+
+    Returns:
+        row (dict): the columns of the record
+    """
+    return {'id': _id, 'airline': airline, 'departure_time': depart_time, 'source_city': source,
+            'destination': destination, 'stops': stops, 'flight_class': flight_class,
+            'duration': duration, 'days_left': days_left, 'cur_price': cur_price}
+
+
+def output_rows(record_id: int, prices) -> list:
+    """Build the rows of the model_outputs table of a record for a bulk insert
+
+    Args:
+        record_id (int): the record_id associated to the user record
+        prices (:obj:`numpy.ndarray`): predicted prices, one per day left counting up from 0
+
+    Returns:
+        rows (:obj:`list` of `dict`): record_id, days_left and price of every day
+    """
+    # tolist() converts the whole array to Python numbers at once
+    prices = np.asarray(prices).tolist()
+    return [{'record_id': record_id, 'days_left': day, 'price': price} for day, price in enumerate(prices)]
+
+
+CURVE_DTYPE = np.dtype('<f4')
+
+
+def pack_curve(prices) -> bytes:
+    """Pack predicted prices into the little-endian float32 blob of the price_curves table
+
+    Args:
+        prices (:obj:`numpy.ndarray`): predicted prices, one per day left counting up from 0
+
+    Returns:
+        blob (bytes): the packed prices
+    """
+    return np.asarray(prices, dtype=CURVE_DTYPE).tobytes()
+
+
+def unpack_curve(blob: bytes, horizon: int) -> np.ndarray:
+    """Unpack a blob of the price_curves table into an array of prices
+
+    Args:
+        blob (bytes): the packed prices
+        horizon (int): number of days left in the curve
+
+    Returns:
+        prices (:obj:`numpy.ndarray`): predicted prices, one per day left counting up from 0
+    """
+    prices = np.frombuffer(blob, dtype=CURVE_DTYPE)
+    if len(prices) != horizon:
+        logger.error('The price curve holds %s prices for a horizon of %s days.', len(prices), horizon)
+        raise ValueError('Corrupt price curve.')
+    return prices
+
+
+def curve_rows(record_id: int, prices) -> list:
+    """Build the row of the price_curves table of a record for a bulk insert
+
+    Args:
+        record_id (int): the record_id associated to the user record
+        prices (:obj:`numpy.ndarray`): predicted prices, one per day left counting up from 0
+
+    Returns:
+        rows (:obj:`list` of `dict`): record_id, horizon and packed prices of the record
+    """
+    return [{'record_id': record_id, 'horizon': len(prices), 'prices': pack_curve(prices)}]
+
+
+def convert_outputs(engine_string: str, batch_records: int = 1000) -> int:
+    """Copy the model outputs stored one row per day into one packed curve per record.
+
+    Records already in price_curves are skipped, so the conversion can be resumed. Days
+    missing in model_outputs are stored as NaN. The model_outputs table is left as is.
+
+    Args:
+        engine_string (str): SQLAlchemy engine string specifying which database
+            to convert
+        batch_records (int): number of curves inserted per transaction
+
+    Returns:
+        converted (int): number of records converted
+    """
+    engine = sqlalchemy.create_engine(engine_string)
+    outputs, curves = ModelOutputs.__table__, PriceCurves.__table__
+    converted = 0
+    try:
+        curves.create(engine, checkfirst=True)
+        with engine.connect() as connection:
+            record_ids = sorted(set(connection.execute(select(outputs.c.record_id).distinct()
+                                                      .where(outputs.c.record_id.isnot(None))).scalars())
+                                - set(connection.execute(select(curves.c.record_id)).scalars()))
+        # Convert a batch of records per transaction to bound the memory use
+        for start in range(0, len(record_ids), batch_records):
+            with engine.begin() as connection:
+                rows = connection.execute(select(outputs.c.record_id, outputs.c.days_left, outputs.c.price)
+                                          .where(outputs.c.record_id.in_(record_ids[start:start + batch_records]),
+                                                 outputs.c.days_left.isnot(None))
+                                          .order_by(outputs.c.record_id, outputs.c.days_left)).fetchall()
+                batch = []
+                for record_id, record_rows in itertools.groupby(rows, key=lambda row: row[0]):
+                    record_rows = list(record_rows)
+                    prices = np.full(record_rows[-1][1] + 1, np.nan)
+                    prices[[row[1] for row in record_rows]] = [row[2] for row in record_rows]
+                    batch.extend(curve_rows(record_id, prices))
+                if batch:
+                    connection.execute(curves.insert(), batch)
+            converted += len(batch)
+    except sqlalchemy.exc.OperationalError as e:
+        logger.error('Could not convert the model outputs. Check engine string. %s', e)
+        raise e
+    except sqlalchemy.exc.SQLAlchemyError as e:
+        logger.error('Could not convert the model outputs. %s', e)
+        raise e
+    else:
+        logger.info('Converted the model outputs of %s records into price curves.', converted)
+    return converted
+
+
+def migrate_db(engine_string: str) -> None:
+    """Bring a database created by an older version up to the current data model.
+
+    Creates the missing tables and the indexes missing on existing tables. Running it
+    again does nothing.
+
+    Args:
+        engine_string (str): SQLAlchemy engine string specifying which database
+            to migrate
+
+    Returns: None
+    """
+    engine = sqlalchemy.create_engine(engine_string)
+    try:
+        Base.metadata.create_all(engine)
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(engine, checkfirst=True)
+        ensure_id_allocator(engine, 'user_records')
+        ensure_database_info(engine)
+    except sqlalchemy.exc.ArgumentError as e:
+        logger.error('Could not parse URL from the engine string. %s', e)
+        raise e
+    except sqlalchemy.exc.OperationalError as e:
+        logger.error('Could not establish connection. Check engine string. %s', e)
+        raise e
+    else:
+        logger.info('The database is migrated to the current data model.')
 
 
-def create_db(engine_string: str) -> None:
+def create_db(engine_string: str, sqlite_pragmas: typing.Optional[dict] = None) -> None:
     """Create database with data model from provided engine string.
 
     Args:
         engine_string (str): SQLAlchemy engine string specifying which database
             to write to
+        sqlite_pragmas (dict): pragmas set on the connection to a SQLite database, the
+            journal mode is kept by the database file
 
     Returns: None
     """
     engine = sqlalchemy.create_engine(engine_string)
+    apply_sqlite_pragmas(engine, sqlite_pragmas)
     try:
         Base.metadata.create_all(engine)
+        ensure_id_allocator(engine, 'user_records')
+        ensure_database_info(engine)
     except sqlalchemy.exc.ArgumentError as e:
         logger.error('Could not parse URL from the engine string. %s', e)
         raise e
@@ -244,4 +1075,5 @@ def create_db(engine_string: str) -> None:
         logger.error('Could not establish connection. Check engine string. %s', e)
         raise e
     else:
-        logger.info("The tables `user_records` and `model_outputs` are successfully created in the database.")
+        logger.info("The tables `user_records`, `model_outputs`, `price_curves`, `id_allocator` and `database_info` "
+                    "are successfully created in the database.")
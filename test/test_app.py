@@ -0,0 +1,71 @@
+import importlib
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.preprocessing import OneHotEncoder
+
+from src.cache_util import DiskCache, LRUCache
+from src.sql_util import create_db
+
+form_in = {'airline': 'Vistara', 'source': 'Delhi', 'depart_time': '13:15', 'stops': '1', 'destination': 'Mumbai',
+           'flight_class': 'Economy', 'duration': '8.5', 'days_left': '20', 'cur_price': '5000'}
+features_in = pd.DataFrame(
+    [['Vistara', 'Delhi', 'Afternoon', 1, 'Mumbai', 'Economy', 8.5, 20],
+     ['Vistara', 'Delhi', 'Afternoon', 0, 'Mumbai', 'Business', 2.5, 3],
+     ['Indigo', 'Mumbai', 'Night', 2, 'Delhi', 'Economy', 12.0, 45]],
+    columns=['airline', 'source', 'depart_time', 'stops', 'destination', 'flight_class', 'duration', 'days_left'])
+
+
+def load_app(tmp_path, monkeypatch):
+    """Import the app with small models, a SQLite database and a page cache directory in tmp_path"""
+    encoder = ColumnTransformer([('encoder', OneHotEncoder(handle_unknown='ignore'), [0, 1, 2, 4, 5])],
+                                remainder='passthrough', sparse_threshold=0).fit(features_in)
+    model = RandomForestRegressor(n_estimators=3, random_state=0)
+    model.fit(encoder.transform(features_in).astype(np.float32), [6000, 9000, 4000])
+    joblib.dump(encoder, tmp_path / 'encoder.joblib')
+    joblib.dump(model, tmp_path / 'model.joblib')
+    engine_string = f'sqlite:///{tmp_path}/flight.db'
+    create_db(engine_string)
+    monkeypatch.setenv('ENCODER_PATH', str(tmp_path / 'encoder.joblib'))
+    monkeypatch.setenv('MODEL_PATH', str(tmp_path / 'model.joblib'))
+    monkeypatch.setenv('SQLALCHEMY_DATABASE_URI', engine_string)
+    monkeypatch.setenv('PAGE_CACHE_DIR', str(tmp_path / 'pages'))
+    app = importlib.import_module('app')
+    return importlib.reload(app), engine_string
+
+
+def test_prediction_page_revalidation(tmp_path, monkeypatch):
+    """Test whether a prediction page is answered with 304 when the browser has it and is cached per database."""
+    app, engine_string = load_app(tmp_path, monkeypatch)
+    client = app.app.test_client()
+    location = client.post('/predict', data=form_in).headers['Location']
+    page = client.get(location)
+    assert page.status_code == 200
+    token, created_at = app.record_manager.database_info()
+    assert page.last_modified == created_at.replace(tzinfo=page.last_modified.tzinfo)
+    assert page.headers['Cache-Control'] == 'no-cache'
+
+    revalidated = client.get(location, headers={'If-None-Match': page.headers['ETag']})
+    assert revalidated.status_code == 304 and revalidated.data == b''
+    assert client.get(location, headers={'If-Modified-Since': page.headers['Last-Modified']}).status_code == 304
+    assert client.get(location).data == page.data
+    assert app.page_cache.get((token, 1)) is not None
+
+    # A database recreated at the same URI, by a restarted app sharing the page files, hands out
+    # the same record id to another itinerary
+    app.record_manager.session.remove()
+    os.remove(tmp_path / 'flight.db')
+    create_db(engine_string)
+    app.record_manager = type(app.record_manager)(engine_string=engine_string)
+    app.page_cache = LRUCache(max_entries=10, disk=DiskCache(str(tmp_path / 'pages')))
+    location = client.post('/predict', data=dict(form_in, days_left='5')).headers['Location']
+    recreated = client.get(location)
+    assert recreated.request.path == page.request.path
+    assert recreated.data != page.data
+    assert recreated.headers['ETag'] != page.headers['ETag']
+    assert client.get('/prediction/99').last_modified is None
+    app.record_manager.close()
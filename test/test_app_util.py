@@ -1,7 +1,24 @@
+import json
+
 import numpy as np
+import pandas as pd
 import pytest
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.preprocessing import OneHotEncoder
+
+from src.app_util import (build_horizon, build_horizons, cheapest_day, count_down, plot_json, plot_json_express,
+                          price_curve, split_curves, time_of_day, time_of_day_array)
+from src.inference_util import CompiledForest
 
-from src.app_util import count_down, time_of_day
+features_in = pd.DataFrame(
+    [['SpiceJet', 'Delhi', 'Evening', 0, 'Mumbai', 'Economy', 2.17, 1],
+     ['Vistara', 'Mumbai', 'Morning', 1, 'Delhi', 'Business', 12.5, 30],
+     ['Indigo', 'Delhi', 'Night', 2, 'Chennai', 'Economy', 8.5, 49]],
+    columns=['airline', 'source_city', 'departure_time', 'stops',
+             'destination_city', 'class', 'duration', 'days_left'])
+encoder_in = ColumnTransformer([('encoder', OneHotEncoder(sparse=False), [0, 1, 2, 4, 5])],
+                               remainder='passthrough').fit(features_in)
 
 
 def test_count_down():
@@ -49,3 +66,87 @@ def test_time_of_day_nonint():
     time_in = 'a:15'
     with pytest.raises(ValueError):
         time_of_day(time_in)
+
+
+def test_time_of_day_array():
+    """Test whether time_of_day_array() matches time_of_day() for every hour."""
+    times_in = [f'{hour}:{minute:02d}' for hour in range(24) for minute in (0, 59)]
+    assert time_of_day_array(times_in).tolist() == [time_of_day(time) for time in times_in]
+    with pytest.raises(ValueError):
+        time_of_day_array(['13:15', '1315'])
+
+
+def test_build_horizon():
+    """Test whether build_horizon() matches encoding the count_down() matrix."""
+    row_in = ['Vistara', 'Delhi', 'Night', '1', 'Chennai', 'Economy', '8.5', '15']
+    matrix_test = build_horizon(row_in, encoder_in)
+    matrix_true = encoder_in.transform(count_down(row_in)).astype('float')
+    assert matrix_test.dtype == np.float32
+    np.testing.assert_array_equal(matrix_test, matrix_true.astype(np.float32))
+
+
+def test_build_horizons():
+    """Test whether build_horizons() stacks the horizons with correct offsets."""
+    rows_in = [['Vistara', 'Delhi', 'Night', '1', 'Chennai', 'Economy', '8.5', '3'],
+               ['SpiceJet', 'Mumbai', 'Evening', '0', 'Delhi', 'Business', '2.17', '0'],
+               ['Indigo', 'Delhi', 'Morning', '2', 'Mumbai', 'Economy', '12.5', '2']]
+    matrix_test, offsets_test = build_horizons(rows_in, encoder_in)
+    np.testing.assert_array_equal(offsets_test, [0, 3, 3, 5])
+    for i in (0, 2):
+        matrix_true = encoder_in.transform(count_down(rows_in[i])).astype('float')
+        np.testing.assert_array_equal(matrix_test[offsets_test[i]:offsets_test[i + 1]],
+                                      matrix_true.astype(np.float32))
+
+
+def test_build_horizon_unknown():
+    """Test whether build_horizon() handles unknown categories as expected."""
+    row_in = ['Unknown', 'Delhi', 'Night', '1', 'Chennai', 'Economy', '8.5', '15']
+    with pytest.raises(ValueError):
+        build_horizon(row_in, encoder_in)
+
+
+def test_price_curve():
+    """Test whether price_curve() matches predicting the full horizon."""
+    model = RandomForestRegressor(n_estimators=5, random_state=123).fit(
+        encoder_in.transform(features_in), [5000, 30000, 8000])
+    row_in = ['Indigo', 'Delhi', 'Evening', '0', 'Mumbai', 'Economy', '2.17', '55']
+    curve_test = price_curve(row_in, encoder_in, CompiledForest.from_model(model))
+    np.testing.assert_allclose(curve_test, model.predict(build_horizon(row_in, encoder_in)))
+
+
+def test_build_horizon_sparse():
+    """Test whether build_horizon() handles encoders with sparse output as expected."""
+    encoder = ColumnTransformer([('encoder', OneHotEncoder(sparse=True), [0, 1, 2, 4, 5])],
+                                remainder='passthrough', sparse_threshold=1).fit(features_in)
+    row_in = ['Vistara', 'Delhi', 'Night', '1', 'Chennai', 'Economy', '8.5', '15']
+    np.testing.assert_array_equal(build_horizon(row_in, encoder), build_horizon(row_in, encoder_in))
+
+
+def test_split_curves():
+    """Test whether stacked predictions are split per itinerary and the cheapest day is found."""
+    matrix, offsets = build_horizons([features_in.iloc[0].tolist(), features_in.iloc[1].tolist(),
+                                      features_in.iloc[0].tolist()[:-1] + [0]], encoder_in)
+    curves = split_curves(-matrix[:, -1], offsets)
+    assert [len(curve) for curve in curves] == [1, 30, 0]
+    assert cheapest_day(curves[1]) == (29, -29.0)
+    assert cheapest_day(curves[2]) == (None, None)
+
+
+def test_plot_json():
+    """Test whether plot_json builds the same figure as plotly express."""
+    def figure(graph: str) -> dict:
+        # Plotly express orders the flags of the mode arbitrarily
+        parsed = json.loads(graph)
+        for trace in parsed['data']:
+            trace['mode'] = '+'.join(sorted(trace['mode'].split('+')))
+        return parsed
+
+    cases = [([0, 1, 2, 3], [5.5, 4.25, 4.25, 6]),
+             ([0, 1, 2, 3], [5, 4, 4, 6]),
+             (list(range(30)), np.random.default_rng(1).uniform(2000, 9000, 30).tolist()),
+             ([0, 1, 2], [float('nan'), 3.0, 2.0]),
+             ([], [])]
+    for days, price in cases:
+        assert figure(plot_json(days, price)) == figure(plot_json_express(days, price))
+    with pytest.raises(ValueError):
+        plot_json([0, 1], [5])
@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+
+from src.batching_util import MicroBatcher
+
+
+def test_micro_batcher():
+    """Test whether concurrent submissions are run in one call and every caller gets its results."""
+    calls = []
+
+    def double(items):
+        calls.append(list(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(double, window=60, max_requests=3)
+    futures = [batcher.submit([1, 2], rows=2), batcher.submit([3]), batcher.submit([4, 5, 6], rows=3)]
+    assert [future.result(timeout=5) for future in futures] == [[2, 4], [6], [8, 10, 12]]
+    assert calls == [[1, 2, 3, 4, 5, 6]]
+
+    stats = batcher.stats()
+    assert stats['batches'] == 1 and stats['requests'] == 3
+    assert stats['batch_requests'] == {'4': 1}
+    assert stats['batch_rows'] == {'8': 1}
+    assert stats['max_queue_delay_ms'] >= stats['mean_queue_delay_ms'] > 0
+    batcher.close()
+
+
+def test_micro_batcher_errors():
+    """Test whether a failing batch is retried one submission at a time and the rows limit splits batches."""
+    def invert(items):
+        return [1 / item for item in items]
+
+    batcher = MicroBatcher(invert, window=60, max_requests=10, max_rows=3)
+    good, bad, late = batcher.submit([1, 2], rows=2), batcher.submit([0]), batcher.submit([4], rows=1)
+    assert good.result(timeout=5) == [1, 0.5]
+    with pytest.raises(ZeroDivisionError):
+        bad.result(timeout=5)
+    batcher.close()
+    assert late.result(timeout=5) == [0.25]
+    assert batcher.stats()['batches'] == 2
+    with pytest.raises(RuntimeError):
+        batcher.submit([1])
+
+
+def test_micro_batcher_stats():
+    """Test whether the stats read while batches run are consistent with each other."""
+    batcher = MicroBatcher(lambda items: items, window=0)
+    snapshots, done = [], threading.Event()
+
+    def read() -> None:
+        while not done.is_set():
+            snapshots.append(batcher.stats())
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    for future in [batcher.submit([i]) for i in range(500)]:
+        future.result(timeout=5)
+    done.set()
+    reader.join()
+    batcher.close()
+    assert all(sum(stats['batch_requests'].values()) == stats['batches'] for stats in snapshots)
+    assert batcher.stats()['requests'] == 500
@@ -0,0 +1,80 @@
+import os
+import time
+
+import pytest
+
+from src.cache_util import DiskCache, LRUCache
+
+
+def test_lru_cache_eviction():
+    """Test whether LRUCache evicts the least recently used entry."""
+    cache = LRUCache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (3, 1, 1)
+
+
+def test_lru_cache_ttl():
+    """Test whether LRUCache expires entries after the ttl."""
+    cache = LRUCache(max_entries=2, ttl=0.01)
+    cache.put('a', 1)
+    time.sleep(0.02)
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_lru_cache_watch_paths(tmp_path):
+    """Test whether LRUCache is cleared when a watched file changes."""
+    path = tmp_path / 'model.joblib'
+    path.write_text('old')
+    cache = LRUCache(max_entries=2, watch_paths=[str(path)])
+    cache.put('a', 1)
+    assert cache.get('a') == 1
+    path.write_text('new model')
+    os.utime(path, ns=(0, 0))
+    assert cache.get('a') is None
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_lru_cache_size():
+    """Test whether LRUCache handles invalid size as expected."""
+    with pytest.raises(ValueError):
+        LRUCache(max_entries=0)
+
+
+def test_max_bytes():
+    """Test whether LRUCache evicts the least recently used entries to stay under max_bytes."""
+    cache = LRUCache(max_entries=10, max_bytes=10)
+    cache.put('a', 'xxxx')
+    cache.put('b', 'xxxx')
+    assert cache.get('a') == 'xxxx'
+    cache.put('c', 'xxxx')
+    assert cache.get('b') is None
+    assert cache.stats()['bytes'] == 8
+    cache.put('d', 'x' * 11)
+    assert cache.get('d') is None
+    assert len(cache) == 2
+
+
+def test_disk_tier(tmp_path):
+    """Test whether values evicted from memory are read back from the disk tier and it stays bounded."""
+    cache = LRUCache(max_entries=1, disk=DiskCache(str(tmp_path), max_bytes=10 ** 6))
+    cache.put(1, ('page', 'etag'))
+    cache.put(2, ('other', 'etag'))
+    restarted = LRUCache(max_entries=1, disk=DiskCache(str(tmp_path), max_bytes=10 ** 6))
+    assert restarted.get(1) == ('page', 'etag')
+    assert restarted.stats()['disk_hits'] == 1
+    assert restarted.get(3) is None
+
+    small = DiskCache(str(tmp_path / 'small'), max_bytes=200)
+    for key in range(10):
+        small.put(key, 'x' * 50)
+    assert small.stats()['bytes'] <= 200
+    assert small.get(9) == 'x' * 50
+    assert small.get(0) is None
@@ -0,0 +1,62 @@
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.feature_generation_util import encode_and_save, extract_features, featurize, split_target
+from src.preprocess_util import process_and_save
+
+raw_in = pd.DataFrame(
+    [['SpiceJet', 'SG-8709', 'Delhi', 'Evening', 'zero', 'Night', 'Mumbai', 'Economy', 2.17, 1, 5953],
+     ['Vistara', 'UK-995', 'Mumbai', 'Morning', 'one', 'Afternoon', 'Delhi', 'Business', 12.5, 30, 42000],
+     ['Indigo', '6E-5328', 'Delhi', 'Night', 'two_or_more', 'Morning', 'Chennai', 'Economy', 8.5, 49, 4100]],
+    columns=['airline', 'flight', 'source_city', 'departure_time', 'stops', 'arrival_time',
+             'destination_city', 'class', 'duration', 'days_left', 'price'])
+
+
+def test_split_target():
+    """Test whether split_target() separates the features and target as expected."""
+    features, target = split_target(raw_in, 'price', ['airline', 'days_left'])
+    assert list(features.columns) == ['airline', 'days_left']
+    np.testing.assert_array_equal(target, [5953, 42000, 4100])
+
+
+def test_split_target_invalid():
+    """Test whether split_target() handles non-existent columns as expected."""
+    with pytest.raises(KeyError):
+        split_target(raw_in, 'not_exist')
+
+
+def test_featurize(tmp_path):
+    """Test whether featurize() saves the same outputs as preprocessing and generating features."""
+    def make_config(folder):
+        folder.mkdir()
+        return {'preprocess': {'process_param': {
+                    'column_to_modify': 'stops',
+                    'column_to_drop': ['flight', 'arrival_time'],
+                    'lookup_map': {'zero': 0, 'one': 1, 'two_or_more': 2},
+                    'save_path': str(folder / 'clean_data.csv')}},
+                'generate_feature': {
+                    'extract_features': {'read_path': str(folder / 'clean_data.csv'),
+                                         'save_path': str(folder),
+                                         'target_name': 'price'},
+                    'encode': {'read_path': str(folder / 'features.csv'),
+                               'encoded_path': str(folder / 'features.npy'),
+                               'encoder_path': str(folder / 'encoder.joblib'),
+                               'features': ['airline', 'source_city', 'departure_time',
+                                            'destination_city', 'class']}}}
+    config_true = make_config(tmp_path / 'separate')
+    process_and_save(raw_in, **config_true['preprocess']['process_param'])
+    extract_features(**config_true['generate_feature']['extract_features'])
+    encode_and_save(**config_true['generate_feature']['encode'])
+
+    config_test = make_config(tmp_path / 'fused')
+    featurize(raw_in, config_test)
+    assert not (tmp_path / 'fused' / 'clean_data.csv').exists()
+    for name in ('features.npy', 'target.npy'):
+        assert (tmp_path / 'fused' / name).read_bytes() == (tmp_path / 'separate' / name).read_bytes()
+    encoder_test = joblib.load(tmp_path / 'fused' / 'encoder.joblib')
+    encoder_true = joblib.load(tmp_path / 'separate' / 'encoder.joblib')
+    for categories_test, categories_true in zip(encoder_test.transformers_[0][1].categories_,
+                                                encoder_true.transformers_[0][1].categories_):
+        np.testing.assert_array_equal(categories_test, categories_true)
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.preprocessing import OneHotEncoder
+
+from src.inference_util import CompiledEncoder, CompiledForest
+
+rng = np.random.default_rng(123)
+x_in = np.hstack([rng.integers(0, 2, (500, 6)), rng.uniform(0, 50, (500, 2))])
+y_in = x_in[:, 0] * 1000 - x_in[:, 7] * 20 + rng.normal(0, 10, 500)
+model_in = RandomForestRegressor(n_estimators=10, random_state=123).fit(x_in, y_in)
+
+features_in = pd.DataFrame(
+    [['SpiceJet', 'Delhi', 'Evening', 0, 'Mumbai', 'Economy', 2.17, 1],
+     ['Vistara', 'Mumbai', 'Night', 1, 'Delhi', 'Business', 12.5, 30],
+     ['Indigo', 'Delhi', 'Night', 2, 'Chennai', 'Economy', 8.5, 49]],
+    columns=['airline', 'source_city', 'departure_time', 'stops',
+             'destination_city', 'class', 'duration', 'days_left'])
+encoder_in = ColumnTransformer([('encoder', OneHotEncoder(sparse=False), [0, 1, 2, 4, 5])],
+                               remainder='passthrough').fit(features_in)
+
+
+def test_compiled_forest_predict():
+    """Test whether CompiledForest.predict() matches the sklearn model."""
+    forest = CompiledForest.from_model(model_in)
+    x_test = np.hstack([rng.integers(0, 2, (300, 6)), rng.uniform(-5, 55, (300, 2))])
+    np.testing.assert_allclose(forest.predict(x_test, chunk_rows=64), model_in.predict(x_test))
+
+
+def test_compiled_forest_dimension():
+    """Test whether CompiledForest.predict() handles wrong number of features as expected."""
+    forest = CompiledForest.from_model(model_in)
+    with pytest.raises(ValueError):
+        forest.predict(np.zeros((3, 4)))
+
+
+def test_compiled_forest_unfitted():
+    """Test whether CompiledForest.from_model() handles unfitted models as expected."""
+    with pytest.raises(AttributeError):
+        CompiledForest.from_model(RandomForestRegressor())
+
+
+def test_compiled_forest_predict_curve():
+    """Test whether CompiledForest.predict_curve() matches predicting every value."""
+    forest = CompiledForest.from_model(model_in)
+    x_test = np.hstack([rng.integers(0, 2, 6), rng.uniform(0, 50, 2)])
+    x_curve = np.repeat(x_test[np.newaxis, :], 60, axis=0)
+    x_curve[:, 7] = np.arange(60)
+    np.testing.assert_allclose(forest.predict_curve(x_test, 7, 60), model_in.predict(x_curve))
+
+
+def test_compiled_forest_predict_curve_column():
+    """Test whether CompiledForest.predict_curve() handles out of range column as expected."""
+    forest = CompiledForest.from_model(model_in)
+    with pytest.raises(IndexError):
+        forest.predict_curve(np.zeros(8), 8, 10)
+
+
+def test_compiled_encoder_transform():
+    """Test whether CompiledEncoder.transform() is byte-identical to the sklearn transformer."""
+    encoder = CompiledEncoder.from_transformer(encoder_in)
+    rows_in = np.array([['Vistara', 'Delhi', 'Night', '1', 'Chennai', 'Economy', '8.5', '15'],
+                        ['SpiceJet', 'Mumbai', 'Evening', '0', 'Delhi', 'Business', '2.17', '0']])
+    out_true = encoder_in.transform(rows_in).astype('float').astype(np.float32)
+    out_test = encoder.transform(rows_in, out=np.full(out_true.shape, 7, dtype=np.float32))
+    assert out_test.tobytes() == out_true.tobytes()
+    assert encoder.output_column(7) == out_true.shape[1] - 1
+
+
+def test_compiled_encoder_unknown():
+    """Test whether CompiledEncoder.transform() handles unknown categories like sklearn."""
+    encoder = CompiledEncoder.from_transformer(encoder_in)
+    rows_in = np.array([['Vistara', 'Delhi', 'Night', '1', 'Pune', 'Economy', '8.5', '15']])
+    with pytest.raises(ValueError) as error_true:
+        encoder_in.transform(rows_in)
+    with pytest.raises(ValueError) as error_test:
+        encoder.transform(rows_in)
+    assert str(error_test.value) == str(error_true.value)
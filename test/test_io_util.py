@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
+
+from src.io_util import configure_storage, load_features, read_frame, save_features, write_frame
+
+
+def test_save_features_dense(tmp_path):
+    """Test whether dense features are saved as typed arrays and memory-mapped on load."""
+    path = save_features(str(tmp_path / 'features.npz'), np.array([[1, 0, 2.5], [0, 1, 3.0]]), 'float32')
+    assert path.endswith('features.npy')
+    data = load_features(str(tmp_path / 'features.npy'))
+    assert isinstance(data, np.memmap)
+    assert data.dtype == np.float32
+    np.testing.assert_array_equal(data, [[1, 0, 2.5], [0, 1, 3.0]])
+
+
+def test_save_features_sparse(tmp_path):
+    """Test whether sparse features are saved as .npz and found from the configured .npy path."""
+    matrix = sparse.csr_matrix(np.array([[1, 0, 2.5], [0, 1, 3.0]]))
+    path = save_features(str(tmp_path / 'features.npy'), matrix)
+    assert path.endswith('features.npz')
+    data = load_features(str(tmp_path / 'features.npy'))
+    assert sparse.isspmatrix_csr(data)
+    np.testing.assert_array_equal(data.toarray(), matrix.toarray())
+
+
+def test_load_features_object(tmp_path):
+    """Test whether object arrays saved by older pipelines can still be loaded."""
+    path = str(tmp_path / 'features.npy')
+    np.save(path, np.array([[1.0, 'a'], [0.0, 'b']], dtype=object))
+    data = load_features(path)
+    assert data.dtype == object
+    assert data[1, 1] == 'b'
+
+
+def test_read_frame_parquet(tmp_path):
+    """Test whether Parquet tables keep categorical columns and only read the requested columns."""
+    pytest.importorskip('pyarrow')
+    df = pd.DataFrame({'airline': ['SpiceJet', 'Vistara'], 'stops': [0, 1], 'price': [5953, 42000]})
+    path = str(tmp_path / 'features.parquet')
+    configure_storage(categorical_columns=['airline'])
+    try:
+        write_frame(df, path)
+    finally:
+        configure_storage()
+    data = read_frame(path, columns=['price', 'airline'])
+    assert list(data.columns) == ['price', 'airline']
+    assert isinstance(data['airline'].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(data.astype({'airline': object}), df[['price', 'airline']])
+
+
+def test_read_frame_csv(tmp_path):
+    """Test whether csv tables only read the requested columns in the requested order."""
+    df = pd.DataFrame({'airline': ['SpiceJet', 'Vistara'], 'stops': [0, 1], 'price': [5953, 42000]})
+    path = str(tmp_path / 'features.csv')
+    write_frame(df, path)
+    pd.testing.assert_frame_equal(read_frame(path, columns=['price', 'airline']), df[['price', 'airline']])
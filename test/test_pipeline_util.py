@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+from src.pipeline_util import Manifest, Stage, run_pipeline, stage_dependencies
+
+config_in = {
+    'score': {'model_path': 'model.joblib', 'x_test_path': 'X_test.npy', 'save_path': 'prediction.npy'},
+    'evaluate': {'prediction_path': 'prediction.npy', 'ytrue_path': 'y_test.npy', 'save_path': 'report.txt'}
+}
+
+
+def _dependencies(tmp_path, step):
+    """Get the dependencies of a step with paths inside the temporary directory."""
+    dependencies = stage_dependencies(step, config_in)
+    for key in ('inputs', 'outputs'):
+        dependencies[key] = [str(tmp_path / path) for path in dependencies[key]]
+    return dependencies
+
+
+def test_manifest_skips_unchanged(tmp_path):
+    """Test whether a step is fresh until its files change and not when they are only touched."""
+    dependencies = _dependencies(tmp_path, 'evaluate')
+    for path, content in zip(dependencies['inputs'] + dependencies['outputs'], [b'1', b'2', b'3']):
+        with open(path, 'wb') as file:
+            file.write(content)
+    manifest = Manifest(str(tmp_path / 'manifest.json'))
+    assert not manifest.is_fresh('evaluate', dependencies, config_in)
+    manifest.record('evaluate', dependencies, config_in)
+
+    manifest = Manifest(str(tmp_path / 'manifest.json'))
+    assert manifest.is_fresh('evaluate', dependencies, config_in)
+    os.utime(dependencies['inputs'][0], ns=(0, 0))
+    assert manifest.is_fresh('evaluate', dependencies, config_in)
+    with open(dependencies['inputs'][0], 'wb') as file:
+        file.write(b'4')
+    assert not manifest.is_fresh('evaluate', dependencies, config_in)
+
+
+def test_manifest_config_sections(tmp_path):
+    """Test whether only a change to the config sections of a step makes it dirty."""
+    dependencies = _dependencies(tmp_path, 'evaluate')
+    for path in dependencies['inputs'] + dependencies['outputs']:
+        with open(path, 'wb') as file:
+            file.write(b'0')
+    manifest = Manifest(str(tmp_path / 'manifest.json'))
+    manifest.record('evaluate', dependencies, config_in)
+    assert manifest.is_fresh('evaluate', dependencies, dict(config_in, score={}))
+    assert not manifest.is_fresh('evaluate', dependencies, dict(config_in, evaluate={}))
+    os.remove(dependencies['outputs'][0])
+    assert not manifest.is_fresh('evaluate', dependencies, config_in)
+
+
+def test_run_pipeline_order():
+    """Test whether stages run after the stages providing their artifacts, whatever their order."""
+    stages = [Stage('double', lambda config, x: {'y': 2 * x}, ('x',), ('y',)),
+              Stage('load', lambda config: {'x': config['x']}, (), ('x',))]
+    timings = run_pipeline({'x': 3}, stages)
+    assert [timing['stage'] for timing in timings] == ['load', 'double']
+    assert all(timing['seconds'] >= 0 and timing['peak_rss'] > 0 for timing in timings)
+
+
+def test_run_pipeline_missing():
+    """Test whether a stage requiring an artifact no stage provides is rejected."""
+    stages = [Stage('double', lambda config, x: {'y': 2 * x}, ('x',), ('y',))]
+    with pytest.raises(ValueError):
+        run_pipeline({}, stages)
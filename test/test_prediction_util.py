@@ -0,0 +1,60 @@
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.preprocessing import OneHotEncoder
+
+from src.app_util import time_of_day
+from src.prediction_util import RAW_COLUMNS, batch_score_and_save, predict_and_save
+
+itineraries_in = pd.DataFrame(
+    [['SpiceJet', '18:30', 'Delhi', 0, 'Mumbai', 'Economy', 2.17, 1],
+     ['Vistara', '9:05', 'Mumbai', 1, 'Delhi', 'Business', 12.5, 30],
+     ['Indigo', '23:40', 'Delhi', 2, 'Chennai', 'Economy', 8.5, 49],
+     ['SpiceJet', '12:00', 'Mumbai', 1, 'Chennai', 'Business', 5.0, 12]] * 5,
+    columns=RAW_COLUMNS)
+
+
+def _save_models(tmp_path):
+    """Fit an encoder and a model on the itineraries and save them."""
+    rows = itineraries_in.copy()
+    rows['depart_time'] = rows['depart_time'].map(time_of_day)
+    rows = rows[['airline', 'source', 'depart_time', 'stops', 'destination', 'class', 'duration', 'days_left']]
+    encoder = ColumnTransformer([('encoder', OneHotEncoder(), [0, 1, 2, 4, 5])],
+                                remainder='passthrough', sparse_threshold=0).fit(rows)
+    x = encoder.transform(rows).astype(np.float32)
+    model = RandomForestRegressor(n_estimators=5, random_state=0).fit(x, np.arange(len(rows)) * 100.0)
+    joblib.dump(encoder, tmp_path / 'encoder.joblib')
+    joblib.dump(model, tmp_path / 'model.joblib')
+    return model.predict(x)
+
+
+def test_batch_score_and_save(tmp_path):
+    """Test whether the chunked, multi-process scoring keeps the input order and predictions."""
+    price_true = _save_models(tmp_path)
+    itineraries_in.to_csv(tmp_path / 'itineraries.csv', index=False)
+    for engine, n_workers in (('sklearn', 1), ('sklearn', 2), ('compiled', 2)):
+        save_path = str(tmp_path / f'prices_{engine}_{n_workers}.csv')
+        stats = batch_score_and_save(str(tmp_path / 'itineraries.csv'), save_path, str(tmp_path / 'model.joblib'),
+                                     str(tmp_path / 'encoder.joblib'), engine=engine, chunksize=3,
+                                     n_workers=n_workers)
+        out = pd.read_csv(save_path)
+        assert stats['rows'] == len(itineraries_in)
+        pd.testing.assert_frame_equal(out[RAW_COLUMNS], itineraries_in)
+        np.testing.assert_allclose(out['price'], price_true)
+
+
+def test_predict_and_save_sharded(tmp_path):
+    """Test whether sharded scoring saves exactly the same predictions as the single-process path."""
+    x = np.random.default_rng(0).random((50, 4)).astype(np.float32)
+    np.save(tmp_path / 'X_test.npy', x)
+    model = RandomForestRegressor(n_estimators=5, random_state=0).fit(x, x.sum(axis=1))
+    joblib.dump(model, tmp_path / 'model.joblib')
+    paths = [str(tmp_path / 'model.joblib'), str(tmp_path / 'X_test.npy')]
+    predict_and_save(*paths, str(tmp_path / 'prediction.npy'))
+    for n_workers in (1, 2):
+        save_path = str(tmp_path / f'prediction_{n_workers}.npy')
+        predict_and_save(*paths, save_path, n_workers=n_workers, chunk_rows=7)
+        with open(save_path, 'rb') as file, open(tmp_path / 'prediction.npy', 'rb') as expected:
+            assert file.read() == expected.read()
@@ -1,7 +1,7 @@
 import pandas as pd
 import pytest
 
-from src.preprocess_util import convert_column
+from src.preprocess_util import convert_column, process_and_save, process_and_save_chunked
 
 df_in = pd.DataFrame(
     [[5000.0, 'one'],
@@ -31,3 +31,21 @@ def test_convert_column_invalidcol():
     col_in = 'not_exist'
     with pytest.raises(KeyError):
         convert_column(df_in, col_in, dict_in)
+
+
+def test_process_and_save_chunked(tmp_path):
+    """Test whether process_and_save_chunked() saves the same file as process_and_save()"""
+    raw = pd.DataFrame({'airline': ['SpiceJet', 'Vistara', 'Indigo', 'AirAsia', 'Vistara'],
+                        'flight': ['SG-8709', 'UK-995', '6E-5328', 'I5-764', 'UK-963'],
+                        'stops': ['zero', 'one', 'two_or_more', 'three', 'zero'],
+                        'duration': [2.17, 2.33, 12.5, 8.0, 3.25],
+                        'price': [5953, 5956, 5955, 5949, 5954]})
+    raw.loc[1, 'duration'] = None
+    read_path = str(tmp_path / 'raw.csv')
+    raw.to_csv(read_path)
+    param = {'column_to_modify': 'stops',
+             'column_to_drop': ['flight'],
+             'lookup_map': {'zero': 0, 'one': 1, 'two_or_more': 2}}
+    process_and_save(pd.read_csv(read_path, index_col=0), save_path=str(tmp_path / 'full.csv'), **param)
+    process_and_save_chunked(read_path, 2, save_path=str(tmp_path / 'chunked.csv'), **param)
+    assert (tmp_path / 'chunked.csv').read_text() == (tmp_path / 'full.csv').read_text()
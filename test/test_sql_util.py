@@ -0,0 +1,416 @@
+import contextlib
+import queue
+import threading
+import time
+
+import numpy as np
+import pytest
+import sqlalchemy
+
+from src import sql_util
+from src.sql_util import (IdAllocations, ModelOutputs, RecordManager, UserRecords, convert_outputs,
+                          create_db, migrate_db, pack_curve, unpack_curve, user_row)
+
+user_in = {'airline': 'Vistara', 'depart_time': '13:15', 'source': 'Delhi', 'destination': 'Mumbai',
+           'stops': 1, 'flight_class': 'Economy', 'duration': 8, 'days_left': 3, 'cur_price': 5000}
+
+
+def test_add_users_with_outputs(tmp_path):
+    """Test whether the records of a batch are written together or not at all."""
+    engine_string = f'sqlite:///{tmp_path}/flight.db'
+    create_db(engine_string)
+    record_manager = RecordManager(engine_string=engine_string)
+    record_ids = record_manager.add_users_with_outputs([(user_in, np.array([3.0, 2.0])), (user_in, np.array([1.0]))])
+    assert sorted(record_manager.get_ids()) == sorted(record_ids)
+    assert len(set(record_ids)) == 2
+
+    # The second itinerary misses a required field, so neither is written
+    bad_user = dict(user_in, depart_time=None)
+    with pytest.raises(sqlalchemy.exc.IntegrityError):
+        record_manager.add_users_with_outputs([(user_in, np.array([5.0])), (bad_user, np.array([6.0]))])
+    assert sorted(record_manager.get_ids()) == sorted(record_ids)
+    assert record_manager.session.execute(sqlalchemy.text('SELECT COUNT(*) FROM model_outputs')).scalar() == 3
+
+
+def test_write_behind(tmp_path):
+    """Test whether queued records are served while pending and written on flush and close."""
+    engine_string = f'sqlite:///{tmp_path}/flight.db'
+    create_db(engine_string)
+    # The writer waits for a fifth record to fill its batch
+    record_manager = RecordManager(engine_string=engine_string, write_behind=True, batch_size=5, flush_interval=60)
+    for record_id in (1, 2):
+        assert record_manager.add_user(**user_in) == record_id
+        record_manager.add_all_output(record_id, 3, np.array([3.0, 2.0, 1.0]) * record_id)
+    pending = record_manager.pending_outputs(2)
+    assert [(output.days_left, output.price) for output in pending] == [(0, 6), (1, 4), (2, 2)]
+    assert record_manager.get_ids() == []
+
+    assert record_manager.add_user(**user_in) == 3
+    record_manager.flush()
+    assert record_manager.pending_outputs(2) is None
+    assert record_manager.stats()['written_outputs'] == 6
+    assert record_manager.add_user(**user_in) == 4
+    record_manager.close()
+
+    check = RecordManager(engine_string=engine_string)
+    assert sorted(check.get_ids()) == [1, 2, 3, 4]
+    prices = [output.price for output in
+              check.session.query(ModelOutputs).filter(ModelOutputs.record_id == 2).order_by(ModelOutputs.days_left)]
+    assert prices == [6, 4, 2]
+    assert check.session.query(UserRecords).count() == 4
+
+
+def test_write_behind_bad_record(tmp_path):
+    """Test whether a batch failing on one bad record only drops the records of that request."""
+    engine_string = f'sqlite:///{tmp_path}/flight.db'
+    create_db(engine_string)
+    record_manager = RecordManager(engine_string=engine_string, write_behind=True, batch_size=6, flush_interval=60)
+    # A row written around the allocator takes the second id
+    with record_manager.engine.begin() as connection:
+        connection.execute(UserRecords.__table__.insert(), [user_row(2, **user_in)])
+    for _ in range(3):
+        record_id = record_manager.add_user(**user_in)
+        record_manager.add_all_output(record_id, 2, np.array([2.0, 1.0]) * record_id)
+    record_manager.flush()
+    stats = record_manager.stats()
+    assert (stats['failed_batches'], stats['dropped_records'], stats['written_records']) == (1, 1, 2)
+    rows = record_manager.session.query(ModelOutputs.record_id, ModelOutputs.price).all()
+    assert sorted(rows) == [(1, 1), (1, 2), (3, 3), (3, 6)]
+    record_manager.close()
+
+
+class FlakyEngine:
+    """Engine refusing the first connections and losing the reply to the first commit, which is applied"""
+    def __init__(self, engine, refusals: int):
+        self.engine = engine
+        self.refusals = refusals
+        self.lost_commits = 1
+
+    def connect(self):
+        if self.refusals:
+            self.refusals -= 1
+            raise sqlalchemy.exc.OperationalError('connect', {}, Exception('Connection refused'))
+        return FlakyConnection(self, self.engine.connect())
+
+
+class FlakyConnection:
+    """Connection of :obj:`FlakyEngine`"""
+    def __init__(self, engine: FlakyEngine, connection):
+        self.flaky_engine = engine
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.connection.close()
+
+    def execute(self, *args):
+        return self.connection.execute(*args)
+
+    @contextlib.contextmanager
+    def begin(self):
+        with self.connection.begin():
+            yield
+        if self.flaky_engine.lost_commits:
+            self.flaky_engine.lost_commits -= 1
+            raise sqlalchemy.exc.OperationalError('COMMIT', {}, Exception('Lost connection during query'))
+
+
+def test_write_behind_outage(tmp_path, monkeypatch):
+    """Test whether the writer waits out an unavailable database and never writes records twice."""
+    engine_string = f'sqlite:///{tmp_path}/flight.db'
+    create_db(engine_string)
+    record_manager = RecordManager(engine_string=engine_string, write_behind=True, batch_size=2, flush_interval=60)
+    delays = []
+    monkeypatch.setattr(sql_util.time, 'sleep', delays.append)
+    record_manager.engine = FlakyEngine(record_manager.engine, refusals=8)
+    record_id = record_manager.add_user(**user_in)
+    record_manager.add_all_output(record_id, 3, np.array([3.0, 2.0, 1.0]))
+    record_manager.flush()
+    assert delays == [0.1, 0.2, 0.4, 0.8, 1.6, 3.2, 5.0, 5.0, 5.0]
+    assert record_manager.stats()['written_outputs'] == 3
+    assert record_manager.session.query(UserRecords).count() == 1
+    assert record_manager.session.query(ModelOutputs).count() == 3
+    record_manager.close()
+
+
+class StuckEngine:
+    """Engine whose connections wait for an event"""
+    def __init__(self, engine, event: threading.Event):
+        self.engine = engine
+        self.event = event
+
+    def connect(self):
+        self.event.wait()
+        return self.engine.connect()
+
+
+def test_write_behind_full_queue(tmp_path):
+    """Test whether the records of a batch are queued together or not at all."""
+    engine_string = f'sqlite:///{tmp_path}/flight.db'
+    create_db(engine_string)
+    record_manager = RecordManager(engine_string=engine_string, write_behind=True, queue_size=1, batch_size=1,
+                                   put_timeout=0)
+    # The writer is stuck on the first record until the database is back, the second one fills the queue
+    database_back = threading.Event()
+    record_manager.engine = StuckEngine(record_manager.engine, database_back)
+    first_id = record_manager.add_user(**user_in)
+    while record_manager.stats()['queue_depth']:
+        time.sleep(0.001)
+    second_id = record_manager.add_user(**user_in)
+    with pytest.raises(queue.Full):
+        record_manager.add_users_with_outputs([(user_in, np.array([5.0])), (user_in, np.array([6.0]))])
+    assert record_manager.stats()['pending_users'] == 2
+    assert record_manager.stats()['pending_outputs'] == 0
+
+    database_back.set()
+    record_manager.flush()
+    record_ids = record_manager.add_users_with_outputs([(user_in, np.array([5.0])), (user_in, np.array([6.0]))])
+    record_manager.close()
+    assert sorted(record_manager.get_ids()) == sorted([first_id, second_id] + record_ids)
+
+
+def test_add_outputs(tmp_path):
+    """Test whether the bulk insert writes one row per day of every record."""
+    engine_string = f'sqlite:///{tmp_path}/flight.db'
+    create_db(engine_string)
+    record_manager = RecordManager(engine_string=engine_string)
+    record_manager.add_all_output(1, 2, np.array([5.5, 4.5, 3.5]))
+    record_manager.add_outputs([(2, np.array([7.0])), (3, np.array([]))])
+    rows = record_manager.session.query(ModelOutputs.record_id, ModelOutputs.days_left, ModelOutputs.price).all()
+    assert sorted(rows) == [(1, 0, 5.5), (1, 1, 4.5), (2, 0, 7.0)]
+    with pytest.raises(IndexError):
+        record_manager.add_all_output(4, 3, [1.0])
+
+
+def test_unique_id_concurrent(tmp_path):
+    """Test whether threads of two managers sharing a database never get the same id."""
+    engine_string = f'sqlite:///{tmp_path}/flight.db'
+    create_db(engine_string)
+    seeded = RecordManager(engine_string=engine_string, id_block_size=1)
+    assert seeded.add_user(**user_in) == 1
+    managers = [RecordManager(engine_string=engine_string, id_block_size=7) for _ in range(2)]
+    ids = [[] for _ in range(8)]
+
+    def allocate(worker: int) -> None:
+        for _ in range(50):
+            ids[worker].append(managers[worker % 2].unique_id())
+
+    threads = [threading.Thread(target=allocate, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    allocated = [_id for worker_ids in ids for _id in worker_ids]
+    assert len(set(allocated)) == 400
+    assert min(allocated) > 1
+    assert sum(manager.id_allocator.reservations for manager in managers) <= 2 * (200 // 7 + 1)
+
+
+def test_id_allocator_seed_race(tmp_path, monkeypatch):
+    """Test whether a reservation losing the race to seed the id allocation retries on the other row."""
+    engine_string = f'sqlite:///{tmp_path}/flight.db'
+    create_db(engine_string)
+    record_manager = RecordManager(engine_string=engine_string)
+    with record_manager.engine.begin() as connection:
+        connection.execute(IdAllocations.__table__.delete())
+    seed, calls = sql_util.seed_id_allocator, []
+
+    def racing_seed(connection, name):
+        calls.append(name)
+        if len(calls) == 1:
+            raise sqlalchemy.exc.IntegrityError('INSERT INTO id_allocator', {}, Exception('UNIQUE constraint failed'))
+        seed(connection, name)
+
+    monkeypatch.setattr(sql_util, 'seed_id_allocator', racing_seed)
+    assert record_manager.unique_id() == 1
+    assert len(calls) == 2
+    calls.clear()
+    sql_util.ensure_id_allocator(record_manager.engine)
+    assert calls == ['user_records']
+def test_get_outputs(tmp_path):
+    """Test whether the outputs of a record are read ordered by days left, pending ones included."""
+    engine_string = f'sqlite:///{tmp_path}/flight.db'
+    create_db(engine_string)
+    record_manager = RecordManager(engine_string=engine_string)
+    record_manager.session.execute(ModelOutputs.__table__.insert(),
+                                   [{'record_id': 1, 'days_left': day, 'price': price}
+                                    for day, price in ((2, 30), (0, 10), (1, 20))])
+    record_manager.add_all_output(2, 1, [5.0])
+    days, prices = record_manager.get_outputs(1)
+    assert days.tolist() == [0, 1, 2]
+    assert prices.tolist() == [10, 20, 30]
+    assert [array.tolist() for array in record_manager.get_outputs(3)] == [[], []]
+
+    pending = RecordManager(engine_string=engine_string, write_behind=True, flush_interval=60)
+    pending.add_all_output(4, 2, np.array([7.0, 6.0]))
+    days, prices = pending.get_outputs(4)
+    assert days.tolist() == [0, 1]
+    assert prices.tolist() == [7.0, 6.0]
+    pending.close()
+
+
+def test_migrate_db(tmp_path):
+    """Test whether the index and the id allocation are added to a database of an older version."""
+    engine_string = f'sqlite:///{tmp_path}/flight.db'
+    engine = sqlalchemy.create_engine(engine_string)
+    UserRecords.__table__.create(engine)
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text('CREATE TABLE model_outputs (id INTEGER PRIMARY KEY, record_id INTEGER, '
+                                           'days_left INTEGER, price INTEGER)'))
+        connection.execute(UserRecords.__table__.insert(), {'id': 7, 'departure_time': '13:15'})
+
+    migrate_db(engine_string)
+    migrate_db(engine_string)
+    indexes = sqlalchemy.inspect(engine).get_indexes('model_outputs')
+    assert [index['column_names'] for index in indexes] == [['record_id', 'days_left']]
+    assert RecordManager(engine_string=engine_string).unique_id() == 8
+
+
+def test_pack_curve():
+    """Test whether a price curve survives packing as little-endian float32."""
+    blob = pack_curve(np.array([5000.25, 4000.5, 3000.0]))
+    assert len(blob) == 12
+    assert unpack_curve(blob, 3).tolist() == [5000.25, 4000.5, 3000.0]
+    with pytest.raises(ValueError):
+        unpack_curve(blob, 4)
+
+
+def test_packed_outputs(tmp_path):
+    """Test whether the packed storage writes one curve per record and reads it back as arrays."""
+    engine_string = f'sqlite:///{tmp_path}/flight.db'
+    create_db(engine_string)
+    record_manager = RecordManager(engine_string=engine_string, output_storage='packed')
+    record_manager.add_outputs([(1, np.array([5432.1, 6.5])), (2, np.array([]))])
+    days, prices = record_manager.get_outputs(1)
+    assert days.tolist() == [0, 1]
+    assert prices.dtype == np.float64 and prices.tolist() == [5432.1, 6.5]
+    assert record_manager.get_outputs(2)[1].tolist() == []
+    assert record_manager.get_curve(3) is None
+    assert record_manager.session.query(ModelOutputs).count() == 0
+    # Records saved one row per day before switching are still found
+    RecordManager(engine_string=engine_string).add_all_output(5, 2, [8.0, 7.0])
+    assert record_manager.get_outputs(5)[1].tolist() == [8.0, 7.0]
+
+    writer = RecordManager(engine_string=engine_string, write_behind=True, output_storage='packed')
+    writer.add_all_output(4, 2, [3.0, 2.0, 1.0])
+    writer.close()
+    assert record_manager.get_curve(4).tolist() == [3.0, 2.0]
+    with pytest.raises(ValueError):
+        RecordManager(engine_string=engine_string, output_storage='columns')
+
+
+def test_convert_outputs(tmp_path):
+    """Test whether the rows of every record are converted into one curve, skipping converted records."""
+    engine_string = f'sqlite:///{tmp_path}/flight.db'
+    create_db(engine_string)
+    record_manager = RecordManager(engine_string=engine_string)
+    record_manager.add_outputs([(1, np.array([3.0, 2.0, 1.0])), (2, np.array([9.0]))])
+    record_manager.session.execute(ModelOutputs.__table__.insert(), [{'record_id': 3, 'days_left': 1, 'price': 4}])
+    record_manager.session.commit()
+
+    assert convert_outputs(engine_string, batch_records=2) == 3
+    assert convert_outputs(engine_string) == 0
+    assert record_manager.get_curve(1).tolist() == [3.0, 2.0, 1.0]
+    assert record_manager.get_curve(2).tolist() == [9.0]
+    assert np.isnan(record_manager.get_curve(3)[0]) and record_manager.get_curve(3)[1] == 4
+
+
+def test_concurrent_sessions(tmp_path):
+    """Test whether 16 threads sharing a manager write and read their records in their own sessions."""
+    engine_string = f'sqlite:///{tmp_path}/flight.db'
+    create_db(engine_string)
+    record_manager = RecordManager(engine_string=engine_string, engine_options={'pool_pre_ping': True},
+                                   id_block_size=4, retry_backoff=0.01)
+    results, errors = {}, []
+
+    def work(worker: int) -> None:
+        try:
+            for _ in range(5):
+                record_id = record_manager.add_user(**user_in)
+                record_manager.add_all_output(record_id, 2, np.array([worker, record_id], dtype=float))
+                results[record_id] = (worker, record_manager.get_outputs(record_id)[1].tolist())
+            record_manager.session.remove()
+        except Exception as e:  # pylint: disable=broad-except
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(results) == 80
+    assert all(prices == [worker, record_id] for record_id, (worker, prices) in results.items())
+    assert sorted(record_manager.get_ids()) == sorted(results)
+
+
+def test_retry(tmp_path, monkeypatch):
+    """Test whether transient operational errors are retried a bounded number of times."""
+    engine_string = f'sqlite:///{tmp_path}/flight.db'
+    create_db(engine_string)
+    record_manager = RecordManager(engine_string=engine_string, retries=2, retry_backoff=0)
+    calls = []
+
+    def flaky(session):
+        calls.append(session)
+        if len(calls) < 3:
+            raise sqlalchemy.exc.OperationalError('SELECT 1', {}, Exception('connection lost'))
+        return 'done'
+
+    assert record_manager._retry(flaky, 'test') == 'done'  # pylint: disable=protected-access
+    calls.clear()
+    monkeypatch.setattr(record_manager, 'retries', 1)
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        record_manager._retry(flaky, 'test')  # pylint: disable=protected-access
+    assert len(calls) == 2
+
+
+def test_retry_commit(tmp_path, monkeypatch):
+    """Test whether a commit failing after it was applied is raised and not written twice."""
+    engine_string = f'sqlite:///{tmp_path}/flight.db'
+    create_db(engine_string)
+    record_manager = RecordManager(engine_string=engine_string, retry_backoff=0)
+    commit, lost_replies = sqlalchemy.orm.Session.commit, [1]
+
+    def lose_reply(session):
+        commit(session)
+        if lost_replies:
+            lost_replies.pop()
+            raise sqlalchemy.exc.OperationalError('COMMIT', {}, Exception('Lost connection during query'))
+
+    monkeypatch.setattr(sqlalchemy.orm.Session, 'commit', lose_reply)
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        record_manager.add_all_output(1, 2, np.array([2.0, 1.0]))
+    assert record_manager.session.query(ModelOutputs).count() == 2
+
+
+def test_sqlite_pragmas(tmp_path):
+    """Test whether the SQLite pragmas are set on the connections of create_db and the manager."""
+    engine_string = f'sqlite:///{tmp_path}/flight.db'
+    create_db(engine_string, {'journal_mode': 'WAL'})
+    record_manager = RecordManager(engine_string=engine_string,
+                                   sqlite_pragmas={'synchronous': 'NORMAL', 'busy_timeout': 2500})
+    with record_manager.engine.connect() as connection:
+        assert connection.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+        assert connection.exec_driver_sql('PRAGMA synchronous').scalar() == 1
+        assert connection.exec_driver_sql('PRAGMA busy_timeout').scalar() == 2500
+    with RecordManager(engine_string=engine_string).engine.connect() as connection:
+        assert connection.exec_driver_sql('PRAGMA synchronous').scalar() == 2
+
+
+def test_database_info(tmp_path):
+    """Test whether every manager of a database reads the same token and another database gets another one."""
+    engine_string = f'sqlite:///{tmp_path}/flight.db'
+    create_db(engine_string)
+    create_db(engine_string)
+    token, created_at = RecordManager(engine_string=engine_string).database_info()
+    assert RecordManager(engine_string=engine_string).database_info() == (token, created_at)
+    assert created_at.microsecond == 0
+
+    other = f'sqlite:///{tmp_path}/other.db'
+    create_db(other)
+    with sqlalchemy.create_engine(other).begin() as connection:
+        connection.execute(sqlalchemy.text('DELETE FROM database_info'))
+    assert RecordManager(engine_string=other).database_info()[0] not in (None, token)